@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Command-line interface for building the local atlas library of PyNets.
+"""
+import warnings
+warnings.filterwarnings("ignore")
+
+
+def get_parser():
+    """Parse command-line inputs"""
+    import argparse
+    from pynets.__about__ import __version__
+
+    verstr = f"pynets v{__version__}"
+
+    # Parse args
+    parser = argparse.ArgumentParser(
+        description="PyNets: Build a local library of atlas nodes and labels"
+                    " in template space, to be loaded by subsequent pynets "
+                    "runs instead of being recomputed for every subject.")
+    parser.add_argument(
+        "-a",
+        metavar="Atlas",
+        required=True,
+        nargs="+",
+        help="Specify an atlas name from nilearn or local (pynets) library, "
+             "and/or a path to a custom parcellation/atlas Nifti1Image file "
+             "in MNI space. If building multiple atlases, separate them by "
+             "space.\n",
+    )
+    parser.add_argument(
+        "-ref",
+        metavar="Atlas reference file path",
+        default=None,
+        help="Specify the path to the atlas reference .txt file that maps "
+             "labels to intensities corresponding to the atlas parcellation "
+             "file specified with the -a flag.\n",
+    )
+    parser.add_argument(
+        "-vox",
+        default=["1mm", "2mm"],
+        nargs="+",
+        choices=["1mm", "2mm"],
+        help="Resolutions to build the library for. Default is both 1mm and "
+             "2mm.\n",
+    )
+    parser.add_argument(
+        "-spheres",
+        default=False,
+        action="store_true",
+        help="Include this flag to build entries for runs that use spheres "
+             "instead of parcels as nodes.\n",
+    )
+    parser.add_argument(
+        "-o",
+        metavar="Library directory",
+        default=None,
+        help="Root directory of the atlas library. Default is the "
+             "`atlas_library` setting of runconfig.yaml, or "
+             "~/.pynets/atlas_library.\n",
+    )
+    parser.add_argument("--version", action="version", version=verstr)
+    return parser
+
+
+def main():
+    """Initializes building of the pynets atlas library."""
+    import sys
+    import os
+    from pynets.core.nodemaker import build_atlas_library_entry
+    from pynets.core.utils import load_runconfig
+
+    if len(sys.argv) < 2:
+        print("\nMissing command-line inputs! See help options with the -h"
+              " flag.\n")
+        sys.exit(1)
+
+    args = get_parser().parse_args()
+
+    hardcoded_params = load_runconfig()
+    use_parcel_naming = hardcoded_params["parcel_naming"][0]
+    nilearn_coord_atlases = hardcoded_params["nilearn_coord_atlases"]
+    nilearn_prob_atlases = hardcoded_params["nilearn_prob_atlases"]
+
+    for atl in args.a:
+        if '/' in atl:
+            if not os.path.isfile(atl):
+                raise FileNotFoundError(f"{atl} is not an existing file.")
+            atlas, uatlas = None, atl
+        else:
+            atlas, uatlas = atl, None
+
+        # Coordinate and probabilistic atlases only provide sphere nodes
+        parc = args.spheres is False and atl not in nilearn_coord_atlases \
+            and atl not in nilearn_prob_atlases
+
+        for vox_size in args.vox:
+            entry_dir = build_atlas_library_entry(
+                atlas, uatlas, args.ref, parc,
+                use_parcel_naming=use_parcel_naming, vox_size=vox_size,
+                library_dir=args.o)
+            print(f"{atl} ({vox_size}): {entry_dir}")
+
+    print('\nDone!')
+    return
+
+
+if __name__ == "__main__":
+    import warnings
+    warnings.filterwarnings("ignore")
+    __spec__ = "ModuleSpec(name='builtins', loader=<class '_frozen" \
+               "_importlib.BuiltinImporter'>)"
+    main()
@@ -7,9 +7,6 @@ Copyright (C) 2016
 """
 import warnings
 import numpy as np
-import sys
-if sys.platform.startswith('win') is False:
-    import indexed_gzip
 import nibabel as nib
 from nipype.interfaces.base import (
     BaseInterface,
@@ -58,280 +55,35 @@ class FetchNodesLabels(SimpleInterface):
     output_spec = _FetchNodesLabelsOutputSpec
 
     def _run_interface(self, runtime):
-        import sys
         from pynets.core import utils, nodemaker
-        from nipype.utils.filemanip import fname_presuffix, copyfile
-        from nilearn.image import concat_imgs
-        import pandas as pd
-        import time
         import textwrap
-        from pathlib import Path
-        import os.path as op
-        import glob
-
-        base_path = utils.get_file()
-        # Test if atlas is a nilearn atlas. If so, fetch coords, labels, and/or
-        # networks.
-        nilearn_parc_atlases = [
-            "atlas_harvard_oxford",
-            "atlas_aal",
-            "atlas_destrieux_2009",
-            "atlas_talairach_gyrus",
-            "atlas_talairach_ba",
-            "atlas_talairach_lobe",
-        ]
-        nilearn_coords_atlases = ["coords_power_2011", "coords_dosenbach_2010"]
-        nilearn_prob_atlases = ["atlas_msdl", "atlas_pauli_2017"]
-        local_atlases = [
-            op.basename(i).split(".nii")[0]
-            for i in glob.glob(f"{str(Path(base_path).parent)}"
-                               f"/atlases/*.nii.gz")
-            if "_4d" not in i
-        ]
-
-        if self.inputs.uatlas is None and self.inputs.atlas in \
-                nilearn_parc_atlases:
-            [labels, networks_list, uatlas] = nodemaker.nilearn_atlas_helper(
-                self.inputs.atlas, self.inputs.parc
-            )
-            if uatlas:
-                if not isinstance(uatlas, str):
-                    nib.save(
-                        uatlas, f"{runtime.cwd}{self.inputs.atlas}{'.nii.gz'}")
-                    uatlas = f"{runtime.cwd}{self.inputs.atlas}{'.nii.gz'}"
-                if self.inputs.clustering is False:
-                    [uatlas,
-                     labels] = \
-                        nodemaker.enforce_hem_distinct_consecutive_labels(
-                        uatlas, label_names=labels)
-                [coords, atlas, par_max, label_intensities] = \
-                    nodemaker.get_names_and_coords_of_parcels(uatlas)
-                if self.inputs.parc is True:
-                    parcel_list = nodemaker.gen_img_list(uatlas)
-                else:
-                    parcel_list = None
-            else:
-                raise FileNotFoundError(
-                    f"\nAtlas file for {self.inputs.atlas} not found!"
-                )
 
-            atlas = self.inputs.atlas
-        elif (
-            self.inputs.uatlas is None
-            and self.inputs.parc is False
-            and self.inputs.atlas in nilearn_coords_atlases
-        ):
-            print(
-                "Fetching coords and labels from nilearn coordinate-based"
-                " atlas library..."
-            )
-            # Fetch nilearn atlas coords
-            [coords, _, networks_list,
-             labels] = nodemaker.fetch_nilearn_atlas_coords(
-                self.inputs.atlas)
-            parcel_list = None
-            par_max = None
-            atlas = self.inputs.atlas
-            uatlas = None
-            label_intensities = None
-        elif (
-            self.inputs.uatlas is None
-            and self.inputs.parc is False
-            and self.inputs.atlas in nilearn_prob_atlases
-        ):
-            from nilearn.plotting import find_probabilistic_atlas_cut_coords
-
-            print(
-                "Fetching coords and labels from nilearn probabilistic atlas"
-                " library..."
-            )
-            # Fetch nilearn atlas coords
-            [labels, networks_list, uatlas] = nodemaker.nilearn_atlas_helper(
-                self.inputs.atlas, self.inputs.parc
-            )
-            coords = find_probabilistic_atlas_cut_coords(maps_img=uatlas)
-            if uatlas:
-                if not isinstance(uatlas, str):
-                    nib.save(
-                        uatlas, f"{runtime.cwd}{self.inputs.atlas}{'.nii.gz'}")
-                    uatlas = f"{runtime.cwd}{self.inputs.atlas}{'.nii.gz'}"
-                if self.inputs.clustering is False:
-                    [uatlas,
-                     labels] = \
-                        nodemaker.enforce_hem_distinct_consecutive_labels(
-                        uatlas, label_names=labels)
-                if self.inputs.parc is True:
-                    parcel_list = nodemaker.gen_img_list(uatlas)
-                else:
-                    parcel_list = None
-            else:
-                raise FileNotFoundError(
-                    f"\nAtlas file for {self.inputs.atlas} not found!")
-
-            par_max = None
-            atlas = self.inputs.atlas
-            label_intensities = None
-        elif self.inputs.uatlas is None and self.inputs.atlas in local_atlases:
-            uatlas_pre = (
-                f"{str(Path(base_path).parent)}/atlases/"
-                f"{self.inputs.atlas}.nii.gz"
-            )
-            uatlas = fname_presuffix(
-                uatlas_pre, newpath=runtime.cwd)
-            copyfile(uatlas_pre, uatlas, copy=True, use_hardlink=False)
-            try:
-                par_img = nib.load(uatlas)
-            except indexed_gzip.ZranError as e:
-                print(e,
-                      "\nCannot load RSN reference image. Do you have git-lfs "
-                      "installed?")
-            try:
-                if self.inputs.clustering is False:
-                    [uatlas, _] = \
-                        nodemaker.enforce_hem_distinct_consecutive_labels(
-                            uatlas)
-
-                # Fetch user-specified atlas coords
-                [coords, _, par_max, label_intensities] = \
-                    nodemaker.get_names_and_coords_of_parcels(uatlas)
-                if self.inputs.parc is True:
-                    parcel_list = nodemaker.gen_img_list(uatlas)
-                else:
-                    parcel_list = None
-                # Describe user atlas coords
-                print(f"\n{self.inputs.atlas} comes with {par_max} parcels\n")
-            except ValueError as e:
-                print(e,
-                      "Either you have specified the name of an atlas that "
-                      "does not exist in the nilearn or local repository or "
-                      "you have not supplied a 3d atlas parcellation image!")
-            labels = None
-            networks_list = None
-            atlas = self.inputs.atlas
-        elif self.inputs.uatlas:
-            if self.inputs.clustering is True:
-                while True:
-                    if op.isfile(self.inputs.uatlas):
-                        break
-                    else:
-                        print("Waiting for atlas file...")
-                        time.sleep(5)
-
-            try:
-                uatlas_tmp_path = fname_presuffix(
-                    self.inputs.uatlas, newpath=runtime.cwd
-                )
-                copyfile(
-                    self.inputs.uatlas,
-                    uatlas_tmp_path,
-                    copy=True,
-                    use_hardlink=False)
-                # Fetch user-specified atlas coords
-                if self.inputs.clustering is False:
-                    [uatlas,
-                     _] = nodemaker.enforce_hem_distinct_consecutive_labels(
-                        uatlas_tmp_path)
-                else:
-                    uatlas = uatlas_tmp_path
-                [coords, atlas, par_max, label_intensities] = \
-                    nodemaker.get_names_and_coords_of_parcels(uatlas)
-                if self.inputs.parc is True:
-                    parcel_list = nodemaker.gen_img_list(uatlas)
-                else:
-                    parcel_list = None
-
-                atlas = utils.prune_suffices(atlas)
-
-                # Describe user atlas coords
-                print(f"\n{atlas} comes with {par_max} parcels\n")
-            except ValueError as e:
-                print(e,
-                      "Either you have specified the name of an atlas that "
-                      "does not exist in the nilearn or local repository or "
-                      "you have not supplied a 3d atlas parcellation image!")
-            labels = None
-            networks_list = None
+        # Atlases built into the atlas library are loaded rather than
+        # relabeled and summarized again for every subject
+        nodes = None
+        if self.inputs.clustering is False:
+            nodes = nodemaker.load_atlas_library_entry(
+                self.inputs.atlas, self.inputs.uatlas, self.inputs.ref_txt,
+                self.inputs.parc, runtime.cwd,
+                use_parcel_naming=self.inputs.use_parcel_naming,
+                vox_size=self.inputs.vox_size)
+        if nodes is None:
+            nodes = nodemaker.fetch_nodes_and_labels(
+                self.inputs.atlas, self.inputs.uatlas, self.inputs.ref_txt,
+                self.inputs.parc, runtime.cwd,
+                use_parcel_naming=self.inputs.use_parcel_naming,
+                vox_size=self.inputs.vox_size,
+                clustering=self.inputs.clustering)
+        [labels, coords, atlas, networks_list, par_max, uatlas,
+         label_intensities] = nodes
+
+        if self.inputs.parc is True and uatlas is not None:
+            parcel_list = nodemaker.ParcelMembership.from_img(uatlas)
         else:
-            raise ValueError(
-                "Either you have specified the name of an atlas that does"
-                " not exist in the nilearn or local repository or you have"
-                " not supplied a 3d atlas parcellation image!")
-
-        # Labels prep
-        if atlas and not labels:
-            if (self.inputs.ref_txt is not None) and (
-                    op.exists(self.inputs.ref_txt)):
-                labels = pd.read_csv(
-                    self.inputs.ref_txt, sep=" ", header=None, names=[
-                        "Index", "Region"])["Region"].tolist()
-            else:
-                if atlas in local_atlases:
-                    ref_txt = (
-                        f"{str(Path(base_path).parent)}/labelcharts/"
-                        f"{atlas}.txt"
-                    )
-                else:
-                    ref_txt = self.inputs.ref_txt
-                if ref_txt is not None:
-                    try:
-                        labels = pd.read_csv(
-                            ref_txt, sep=" ", header=None, names=[
-                                "Index", "Region"])["Region"].tolist()
-                    except BaseException:
-                        if self.inputs.use_parcel_naming is True:
-                            try:
-                                labels = nodemaker.parcel_naming(
-                                    coords, self.inputs.vox_size)
-                            except BaseException:
-                                print("AAL reference labeling failed!")
-                                labels = np.arange(len(coords) + 1)[
-                                    np.arange(len(coords) + 1) != 0
-                                ].tolist()
-                        else:
-                            print("Using generic index labels...")
-                            labels = np.arange(len(coords) + 1)[
-                                np.arange(len(coords) + 1) != 0
-                            ].tolist()
-                else:
-                    if self.inputs.use_parcel_naming is True:
-                        try:
-                            labels = nodemaker.parcel_naming(
-                                coords, self.inputs.vox_size)
-                        except BaseException:
-                            print("AAL reference labeling failed!")
-                            labels = np.arange(len(coords) + 1)[
-                                np.arange(len(coords) + 1) != 0
-                            ].tolist()
-                    else:
-                        print("Using generic index labels...")
-                        labels = np.arange(len(coords) + 1)[
-                            np.arange(len(coords) + 1) != 0
-                        ].tolist()
+            parcel_list = None
 
         dir_path = utils.do_dir_path(atlas, self.inputs.outdir)
 
-        if len(coords) != len(labels):
-            labels = [i for i in labels if (i != 'Unknown' and
-                                            i != 'Background')]
-            if len(coords) != len(labels):
-                print("Length of coordinates is not equal to length of "
-                      "label names...")
-                if self.inputs.use_parcel_naming is True:
-                    try:
-                        print("Attempting consensus parcel naming instead...")
-                        labels = nodemaker.parcel_naming(
-                            coords, self.inputs.vox_size)
-                    except BaseException:
-                        print("Reverting to integer labels instead...")
-                        labels = np.arange(len(coords) + 1)[
-                            np.arange(len(coords) + 1) != 0
-                        ].tolist()
-                else:
-                    print("Reverting to integer labels instead...")
-                    labels = np.arange(len(coords) + 1)[
-                        np.arange(len(coords) + 1) != 0
-                    ].tolist()
-
         print(f"Coordinates:\n{coords}")
         print(f"Labels:\n"
               f"{textwrap.shorten(str(labels), width=1000, placeholder='...')}")
@@ -345,12 +97,15 @@ class FetchNodesLabels(SimpleInterface):
         self._results["coords"] = coords
         self._results["atlas"] = atlas
         self._results["networks_list"] = networks_list
-        # TODO: Optimize this with 4d array concatenation and .npyz
 
-        parcel_list_4d = concat_imgs([i for i in parcel_list])
-        out_path = f"{runtime.cwd}/parcel_list.nii.gz"
-        nib.save(parcel_list_4d, out_path)
-        self._results["parcel_list"] = out_path
+        # Parcels are passed downstream as a single 3D label volume rather
+        # than as a 4D stack of per-parcel masks
+        if parcel_list is not None:
+            out_path = f"{runtime.cwd}/parcel_list.nii.gz"
+            nib.save(parcel_list.to_img(), out_path)
+            self._results["parcel_list"] = out_path
+        else:
+            self._results["parcel_list"] = None
         self._results["par_max"] = par_max
         self._results["uatlas"] = uatlas
         self._results["dir_path"] = dir_path
@@ -458,6 +213,7 @@ class _IndividualClusteringInputSpec(BaseInterfaceInputSpec):
     clust_mask = File(exists=True, mandatory=True)
     ID = traits.Any(mandatory=True)
     k = traits.Any(mandatory=True)
+    k_list = traits.Any(None, mandatory=False, usedefault=True)
     clust_type = traits.Str(mandatory=True)
     vox_size = traits.Str("2mm", mandatory=True, usedefault=True)
     local_corr = traits.Str("allcorr", mandatory=True, usedefault=True)
@@ -525,6 +281,9 @@ class IndividualClustering(SimpleInterface):
         hardcoded_params = load_runconfig()
         c_boot = hardcoded_params["c_boot"][0]
         nthreads = hardcoded_params["nthreads"][0]
+        c_boot_ensemble = hardcoded_params.get("c_boot_ensemble",
+                                               ["disk"])[0]
+        ncut_solver = hardcoded_params.get("ncut_solver", ["arpack"])[0]
 
         clust_list = ["kmeans", "ward", "complete", "average", "ncut", "rena"]
 
@@ -544,35 +303,22 @@ class IndividualClustering(SimpleInterface):
             copy=True,
             use_hardlink=False)
 
-        mni2t1w_warp_tmp_path = fname_presuffix(
-            self.inputs.mni2t1w_warp, suffix="_tmp", newpath=runtime.cwd
-        )
-        copyfile(
-            self.inputs.mni2t1w_warp,
-            mni2t1w_warp_tmp_path,
-            copy=True,
-            use_hardlink=False,
-        )
-
-        mni2t1_xfm_tmp_path = fname_presuffix(
-            self.inputs.mni2t1_xfm, suffix="_tmp", newpath=runtime.cwd
-        )
-        copyfile(
-            self.inputs.mni2t1_xfm,
-            mni2t1_xfm_tmp_path,
-            copy=True,
-            use_hardlink=False)
+        registry = regutils.TransformRegistry(
+            os.path.dirname(os.path.dirname(self.inputs.mni2t1_xfm)))
+        mni2t1w_warp = registry.register("mni", "t1w",
+                                         self.inputs.mni2t1w_warp,
+                                         kind="warp")
+        mni2t1_xfm = registry.register("mni", "t1w", self.inputs.mni2t1_xfm)
 
         clust_mask_in_t1w = regutils.roi2t1w_align(
             clust_mask_temp_path,
             t1w_brain_tmp_path,
-            mni2t1_xfm_tmp_path,
-            mni2t1w_warp_tmp_path,
+            mni2t1_xfm,
+            mni2t1w_warp,
             clust_mask_in_t1w_path,
             template_tmp_path,
             self.inputs.simple,
         )
-        time.sleep(0.5)
 
         if self.inputs.mask:
             out_name_mask = fname_presuffix(
@@ -620,10 +366,53 @@ class IndividualClustering(SimpleInterface):
         )
 
         atlas = nip.create_clean_mask()
-        nip.create_local_clustering(overwrite=True, r_thresh=0.4)
 
-        if self.inputs.clust_type in clust_list:
-            if float(c_boot) > 1:
+        # Sweeps over k with hierarchical clustering or ncut are derived from
+        # a single clustering pass, shared across the k iterables of this node
+        multi_k = self.inputs.k_list is not None and \
+            len(self.inputs.k_list) > 1 and \
+            int(self.inputs.k) in [int(k) for k in self.inputs.k_list] and \
+            nip.clust_type in ["ward", "complete", "average", "ncut"] and \
+            (float(c_boot) <= 1 or c_boot_ensemble == "memory")
+
+        if multi_k:
+            uatlases = nip.create_multi_k_clustering(
+                self.inputs.k_list, c_boot=c_boot, nthreads=nthreads,
+                ncut_solver=ncut_solver,
+                provenance={"func_file": self.inputs.func_file,
+                            "clust_mask": self.inputs.clust_mask,
+                            "conf": self.inputs.conf or None,
+                            "mask": self.inputs.mask or None,
+                            "t1w_brain": self.inputs.t1w_brain})
+            nip.uatlas = uatlases[int(self.inputs.k)]
+        elif self.inputs.clust_type in clust_list:
+            nip.create_local_clustering(overwrite=True, r_thresh=0.4)
+            # Clustering methods supported on masked arrays share the
+            # estimators of the multi-k sweep, whether bootstrapped samples
+            # are held in memory or written to disk
+            array_backed = nip.clust_type in ["ward", "complete", "average",
+                                              "ncut"] or \
+                (nip.clust_type == "kmeans" and nip.num_conn_comps == 1)
+            if float(c_boot) > 1 and array_backed:
+                print(
+                    f"Performing circular block bootstrapping with {c_boot}"
+                    f" iterations..."
+                )
+                ts_data, block_size = nip.prep_boot()
+                consensus_parcellation = \
+                    clustools.ensemble_parcellate_arrays(
+                        ts_data, block_size, nip.clust_type, nip.k,
+                        int(c_boot), nip._clust_mask_corr_img,
+                        local_conn=nip._local_conn, conf=nip.conf,
+                        standardize=nip._standardize,
+                        detrend=nip._detrending, nthreads=nthreads,
+                        ncut_solver=ncut_solver,
+                        work_dir=runtime.cwd if c_boot_ensemble == "disk"
+                        else None)
+                nib.save(consensus_parcellation, nip.uatlas)
+                del ts_data
+                gc.collect()
+            elif float(c_boot) > 1:
                 import random
                 from joblib import Memory
                 from joblib.externals.loky import get_reusable_executor
@@ -652,7 +441,6 @@ class IndividualClustering(SimpleInterface):
                                      _local_conn, conf, _dir_path,
                                      _conn_comps):
                     import os
-                    import time
                     import gc
                     from pynets.fmri.clustools import parcellate
                     print(f"\nBootstrapped iteration: {i}")
@@ -669,7 +457,7 @@ class IndividualClustering(SimpleInterface):
                                                   _standardize,
                                                   _detrending, k, _local_conn,
                                                   conf, _dir_path,
-                                                  _conn_comps)
+                                                  _conn_comps, ncut_solver)
                         parcellation.to_filename(out_path)
                         parcellation.uncache()
                         boot_img.uncache()
@@ -725,6 +513,18 @@ class IndividualClustering(SimpleInterface):
                     if i is not None:
                         if os.path.isfile(i):
                             os.system(f"rm -f {i} &")
+            elif array_backed:
+                print(
+                    "Creating spatially-constrained parcellation...")
+                ts_data, _ = nip.prep_boot()
+                parcellation = clustools.parcellate_arrays(
+                    ts_data, nip.clust_type, nip.k, nip._clust_mask_corr_img,
+                    local_conn=nip._local_conn, conf=nip.conf,
+                    standardize=nip._standardize, detrend=nip._detrending,
+                    r_thresh=0.4, ncut_solver=ncut_solver)
+                nib.save(parcellation, nip.uatlas)
+                del ts_data
+                gc.collect()
             else:
                 print(
                     "Creating spatially-constrained parcellation...")
@@ -740,7 +540,8 @@ class IndividualClustering(SimpleInterface):
                                                     nip._detrending, nip.k,
                                                     nip._local_conn,
                                                     nip.conf, nip._dir_path,
-                                                    nip._conn_comps)
+                                                    nip._conn_comps,
+                                                    ncut_solver)
                 parcellation.to_filename(out_path)
 
         else:
@@ -771,8 +572,6 @@ class IndividualClustering(SimpleInterface):
 
         reg_tmp = [
             t1w_brain_tmp_path,
-            mni2t1w_warp_tmp_path,
-            mni2t1_xfm_tmp_path,
             template_tmp_path,
             out_name_func_file
         ]
@@ -1151,13 +950,13 @@ class RegisterDWI(SimpleInterface):
 
     def _run_interface(self, runtime):
         import gc
-        import time
         import glob
         import os
         import os.path as op
         from pynets.registration import register
         from nipype.utils.filemanip import fname_presuffix, copyfile
-        from pynets.registration.utils import check_orient_and_dims
+        from pynets.registration.utils import check_orient_and_dims, \
+            TransformRegistry
 
         fa_tmp_path = fname_presuffix(
             self.inputs.fa_path, suffix="_tmp", newpath=runtime.cwd
@@ -1294,11 +1093,9 @@ class RegisterDWI(SimpleInterface):
 
         # Generate T1w brain mask
         reg.gen_mask(mask_tmp_path)
-        time.sleep(0.5)
 
         # Perform anatomical segmentation
         reg.gen_tissue(wm_mask, gm_mask, csf_mask, self.inputs.overwrite)
-        time.sleep(0.5)
 
         # Align t1w to mni template
         # from joblib import Memory
@@ -1310,20 +1107,24 @@ class RegisterDWI(SimpleInterface):
         # t1w2mni_align = memory.cache(reg.t1w2mni_align)
         # t1w2mni_align()
         reg.t1w2mni_align()
-        time.sleep(0.5)
 
         if (self.inputs.overwrite is True) or (
                 op.isfile(reg.t1w2dwi) is False):
             # Align t1w to dwi
             reg.t1w2dwi_align()
-            time.sleep(0.5)
 
         if (self.inputs.overwrite is True) or (
             op.isfile(reg.wm_gm_int_in_dwi) is False
         ):
             # Align tissue
             reg.tissue2dwi_align()
-            time.sleep(0.5)
+
+        # Record the subject's transforms for reuse by every atlas and ROI
+        registry = TransformRegistry(reg.reg_path)
+        registry.register("mni", "t1w", reg.mni2t1_xfm)
+        registry.register("t1w", "dwi", reg.t1wtissue2dwi_xfm)
+        if op.isfile(reg.mni2t1w_warp):
+            registry.register("mni", "t1w", reg.mni2t1w_warp, kind="warp")
 
         self._results["wm_in_dwi"] = reg.wm_in_dwi
         self._results["gm_in_dwi"] = reg.gm_in_dwi
@@ -1434,7 +1235,6 @@ class RegisterAtlasDWI(SimpleInterface):
 
     def _run_interface(self, runtime):
         import gc
-        import time
         import os
         import os.path as op
         from pynets.registration import utils as regutils
@@ -1519,34 +1319,17 @@ class RegisterAtlasDWI(SimpleInterface):
             copy=True,
             use_hardlink=False)
 
-        mni2t1w_warp_tmp_path = fname_presuffix(
-            self.inputs.mni2t1w_warp, suffix="_tmp", newpath=runtime.cwd
-        )
-        copyfile(
-            self.inputs.mni2t1w_warp,
-            mni2t1w_warp_tmp_path,
-            copy=True,
-            use_hardlink=False,
-        )
-
-        t1wtissue2dwi_xfm_tmp_path = fname_presuffix(
-            self.inputs.t1wtissue2dwi_xfm, suffix="_tmp", newpath=runtime.cwd
-        )
-        copyfile(
-            self.inputs.t1wtissue2dwi_xfm,
-            t1wtissue2dwi_xfm_tmp_path,
-            copy=True,
-            use_hardlink=False,
-        )
-
-        mni2t1_xfm_tmp_path = fname_presuffix(
-            self.inputs.mni2t1_xfm, suffix="_tmp", newpath=runtime.cwd
-        )
-        copyfile(
-            self.inputs.mni2t1_xfm,
-            mni2t1_xfm_tmp_path,
-            copy=True,
-            use_hardlink=False)
+        # Resolve the subject's transforms once, rather than copying them for
+        # every atlas
+        registry = regutils.TransformRegistry(
+            op.dirname(op.dirname(self.inputs.mni2t1_xfm)))
+        mni2t1w_warp = registry.register("mni", "t1w",
+                                         self.inputs.mni2t1w_warp,
+                                         kind="warp")
+        t1wtissue2dwi_xfm = registry.register("t1w", "dwi",
+                                              self.inputs.t1wtissue2dwi_xfm)
+        mni2t1_xfm = registry.register("mni", "t1w", self.inputs.mni2t1_xfm)
+        mni2dwi_xfm = registry.compose("mni", "t1w", "dwi")
 
         t1w_brain_mask_tmp_path = fname_presuffix(
             self.inputs.t1w_brain_mask, suffix="_tmp", newpath=runtime.cwd
@@ -1610,9 +1393,6 @@ class RegisterAtlasDWI(SimpleInterface):
         base_dir_tmp = f"{runtime.cwd}/atlas_{atlas_name}"
         os.makedirs(base_dir_tmp, exist_ok=True)
 
-        mni2dwi_xfm = f"{base_dir_tmp}{'/'}{atlas_name}" \
-            f"{'_mni2dwi_xfm.mat'}"
-
         aligned_atlas_t1mni = f"{base_dir_tmp}{'/'}{atlas_name}" \
                               f"{'_t1w_mni.nii.gz'}"
         aligned_atlas_skull = f"{base_dir_tmp}{'/'}{atlas_name}" \
@@ -1637,11 +1417,11 @@ class RegisterAtlasDWI(SimpleInterface):
             atlas_name,
             t1w_brain_tmp_path,
             t1w_brain_mask_tmp_path,
-            mni2t1w_warp_tmp_path,
+            mni2t1w_warp,
             t1_aligned_mni_tmp_path,
             ap_tmp_path,
-            mni2t1_xfm_tmp_path,
-            t1wtissue2dwi_xfm_tmp_path,
+            mni2t1_xfm,
+            t1wtissue2dwi_xfm,
             wm_gm_int_in_dwi_tmp_path,
             aligned_atlas_t1mni,
             aligned_atlas_skull,
@@ -1650,6 +1430,7 @@ class RegisterAtlasDWI(SimpleInterface):
             B0_mask_tmp_path,
             mni2dwi_xfm,
             self.inputs.simple,
+            cache_dir=f"{registry.reg_path}/maps",
         )
 
         # Correct coords and labels
@@ -1681,16 +1462,15 @@ class RegisterAtlasDWI(SimpleInterface):
                 waymask_tmp_path,
                 t1w_brain_tmp_path,
                 ap_tmp_path,
-                mni2t1w_warp_tmp_path,
-                mni2t1_xfm_tmp_path,
-                t1wtissue2dwi_xfm_tmp_path,
+                mni2t1w_warp,
+                mni2t1_xfm,
+                t1wtissue2dwi_xfm,
                 waymask_in_t1w,
                 waymask_in_dwi,
                 B0_mask_tmp_path,
                 template_tmp_path,
                 self.inputs.simple,
             )
-            time.sleep(0.5)
             os.system(f"rm -f {waymask_tmp_path} &")
         else:
             waymask_in_dwi = None
@@ -1805,8 +1585,6 @@ class RegisterAtlasDWI(SimpleInterface):
 
         reg_tmp = [
             uatlas_tmp_path,
-            mni2t1w_warp_tmp_path,
-            mni2t1_xfm_tmp_path,
             t1w_brain_mask_tmp_path,
             t1_aligned_mni_tmp_path,
             t1w2dwi_bbr_xfm_tmp_path,
@@ -1864,7 +1642,7 @@ class RegisterROIDWI(SimpleInterface):
     def _run_interface(self, runtime):
         import gc
         import os
-        import time
+        import os.path as op
         from pynets.registration import utils as regutils
         from nipype.utils.filemanip import fname_presuffix, copyfile
         import pkg_resources
@@ -1910,34 +1688,16 @@ class RegisterROIDWI(SimpleInterface):
             copy=True,
             use_hardlink=False)
 
-        mni2t1w_warp_tmp_path = fname_presuffix(
-            self.inputs.mni2t1w_warp, suffix="_tmp", newpath=runtime.cwd
-        )
-        copyfile(
-            self.inputs.mni2t1w_warp,
-            mni2t1w_warp_tmp_path,
-            copy=True,
-            use_hardlink=False,
-        )
-
-        t1wtissue2dwi_xfm_tmp_path = fname_presuffix(
-            self.inputs.t1wtissue2dwi_xfm, suffix="_tmp", newpath=runtime.cwd
-        )
-        copyfile(
-            self.inputs.t1wtissue2dwi_xfm,
-            t1wtissue2dwi_xfm_tmp_path,
-            copy=True,
-            use_hardlink=False,
-        )
-
-        mni2t1_xfm_tmp_path = fname_presuffix(
-            self.inputs.mni2t1_xfm, suffix="_tmp", newpath=runtime.cwd
-        )
-        copyfile(
-            self.inputs.mni2t1_xfm,
-            mni2t1_xfm_tmp_path,
-            copy=True,
-            use_hardlink=False)
+        # Resolve the subject's transforms once, rather than copying them for
+        # every ROI
+        registry = regutils.TransformRegistry(
+            op.dirname(op.dirname(self.inputs.mni2t1_xfm)))
+        mni2t1w_warp = registry.register("mni", "t1w",
+                                         self.inputs.mni2t1w_warp,
+                                         kind="warp")
+        t1wtissue2dwi_xfm = registry.register("t1w", "dwi",
+                                              self.inputs.t1wtissue2dwi_xfm)
+        mni2t1_xfm = registry.register("mni", "t1w", self.inputs.mni2t1_xfm)
 
         roi_in_t1w = f"{runtime.cwd}/waymask-" \
                      f"{os.path.basename(self.inputs.roi).split('.nii')[0]}" \
@@ -1947,37 +1707,19 @@ class RegisterROIDWI(SimpleInterface):
                      f"_in_dwi.nii.gz"
 
         if self.inputs.roi:
-            t1w_brain_tmp_path2 = fname_presuffix(
-                self.inputs.t1w_brain, suffix="2", newpath=runtime.cwd
-            )
-            copyfile(
-                self.inputs.t1w_brain,
-                t1w_brain_tmp_path2,
-                copy=True,
-                use_hardlink=False)
-
-            mni2t1w_warp_tmp_path2 = fname_presuffix(
-                self.inputs.mni2t1w_warp, suffix="2", newpath=runtime.cwd
-            )
-            copyfile(
-                self.inputs.mni2t1w_warp,
-                mni2t1w_warp_tmp_path2,
-                copy=True,
-                use_hardlink=False)
-
             # Align roi
             roi_in_dwi = regutils.roi2dwi_align(
                 roi_file_tmp_path,
-                t1w_brain_tmp_path2,
+                t1w_brain_tmp_path,
                 roi_in_t1w,
                 roi_in_dwi,
-                mni2t1w_warp_tmp_path2,
-                t1wtissue2dwi_xfm_tmp_path,
-                mni2t1_xfm_tmp_path,
+                ap_tmp_path,
+                mni2t1w_warp,
+                t1wtissue2dwi_xfm,
+                mni2t1_xfm,
                 template_tmp_path,
                 self.inputs.simple,
             )
-            time.sleep(0.5)
         else:
             roi_in_dwi = None
 
@@ -1985,9 +1727,6 @@ class RegisterROIDWI(SimpleInterface):
 
         reg_tmp = [
             t1w_brain_tmp_path,
-            mni2t1w_warp_tmp_path,
-            t1wtissue2dwi_xfm_tmp_path,
-            mni2t1_xfm_tmp_path,
             template_tmp_path,
             roi_in_t1w,
             roi_file_tmp_path
@@ -2040,11 +1779,11 @@ class RegisterFunc(SimpleInterface):
     def _run_interface(self, runtime):
         import gc
         import glob
-        import time
         import os.path as op
         from pynets.registration import register
         from nipype.utils.filemanip import fname_presuffix, copyfile
-        from pynets.registration.utils import check_orient_and_dims
+        from pynets.registration.utils import check_orient_and_dims, \
+            TransformRegistry
 
         anat_mask_existing = [
             i
@@ -2137,11 +1876,9 @@ class RegisterFunc(SimpleInterface):
 
         # Generate T1w brain mask
         reg.gen_mask(mask_tmp_path)
-        time.sleep(0.5)
 
         # Perform anatomical segmentation
         reg.gen_tissue(wm_mask, gm_mask, self.inputs.overwrite)
-        time.sleep(0.5)
 
         # Align t1w to mni template
         # from joblib import Memory
@@ -2153,7 +1890,12 @@ class RegisterFunc(SimpleInterface):
         # t1w2mni_align = memory.cache(reg.t1w2mni_align)
         # t1w2mni_align()
         reg.t1w2mni_align()
-        time.sleep(0.5)
+
+        # Record the subject's transforms for reuse by every atlas and ROI
+        registry = TransformRegistry(reg.reg_path)
+        registry.register("mni", "t1w", reg.mni2t1_xfm)
+        if op.isfile(reg.mni2t1w_warp):
+            registry.register("mni", "t1w", reg.mni2t1w_warp, kind="warp")
 
         self._results["reg_fmri_complete"] = True
         self._results["basedir_path"] = runtime.cwd
@@ -2200,7 +1942,6 @@ class RegisterParcellation2MNIFunc(SimpleInterface):
         import gc
         import os
         import pkg_resources
-        import time
         from pynets.core.utils import prune_suffices
         from pynets.registration import utils as regutils
         from nipype.utils.filemanip import fname_presuffix, copyfile
@@ -2292,7 +2033,6 @@ class RegisterParcellation2MNIFunc(SimpleInterface):
             t1w2mni_warp_tmp_path,
             self.inputs.simple
         )
-        time.sleep(0.5)
 
         out_dir = f"{self.inputs.dir_path}/t1w_clustered_parcellations/"
         os.makedirs(out_dir, exist_ok=True)
@@ -2367,7 +2107,6 @@ class RegisterAtlasFunc(SimpleInterface):
     def _run_interface(self, runtime):
         import gc
         import os
-        import time
         import glob
         from pynets.registration import utils as regutils
         from pynets.core.nodemaker import \
@@ -2473,24 +2212,15 @@ class RegisterAtlasFunc(SimpleInterface):
             if self.inputs.node_size is not None:
                 atlas_name = f"{atlas_name}{'_'}{self.inputs.node_size}"
 
-            mni2t1_xfm_tmp_path = fname_presuffix(
-                self.inputs.mni2t1_xfm, suffix="_tmp", newpath=runtime.cwd
-            )
-            copyfile(
-                self.inputs.mni2t1_xfm,
-                mni2t1_xfm_tmp_path,
-                copy=True,
-                use_hardlink=False)
-
-            mni2t1w_warp_tmp_path = fname_presuffix(
-                self.inputs.mni2t1w_warp, suffix="_tmp", newpath=runtime.cwd
-            )
-            copyfile(
-                self.inputs.mni2t1w_warp,
-                mni2t1w_warp_tmp_path,
-                copy=True,
-                use_hardlink=False,
-            )
+            # Resolve the subject's transforms once, rather than copying them
+            # for every atlas
+            registry = regutils.TransformRegistry(
+                os.path.dirname(os.path.dirname(self.inputs.mni2t1_xfm)))
+            mni2t1_xfm = registry.register("mni", "t1w",
+                                           self.inputs.mni2t1_xfm)
+            mni2t1w_warp = registry.register("mni", "t1w",
+                                             self.inputs.mni2t1w_warp,
+                                             kind="warp")
 
             aligned_atlas_gm, aligned_atlas_skull = regutils.atlas2t1w_align(
                 uatlas_tmp_path,
@@ -2499,15 +2229,14 @@ class RegisterAtlasFunc(SimpleInterface):
                 t1w_brain_tmp_path,
                 t1w_brain_mask_tmp_path,
                 t1_aligned_mni_tmp_path,
-                mni2t1w_warp_tmp_path,
-                mni2t1_xfm_tmp_path,
+                mni2t1w_warp,
+                mni2t1_xfm,
                 gm_mask_tmp_path,
                 aligned_atlas_t1mni,
                 aligned_atlas_skull,
                 aligned_atlas_gm,
                 self.inputs.simple,
             )
-            time.sleep(0.5)
 
             # Correct coords and labels
             [aligned_atlas_gm, coords, labels] = \
@@ -2520,8 +2249,6 @@ class RegisterAtlasFunc(SimpleInterface):
                 gm_mask_tmp_path,
                 t1_aligned_mni_tmp_path,
                 t1w_brain_mask_tmp_path,
-                mni2t1w_warp_tmp_path,
-                mni2t1_xfm_tmp_path,
             ]
 
             if self.inputs.uatlas is None:
@@ -2602,7 +2329,6 @@ class RegisterROIEPI(SimpleInterface):
     def _run_interface(self, runtime):
         import gc
         import os
-        import time
         from pynets.registration import utils as regutils
         from nipype.utils.filemanip import fname_presuffix, copyfile
         import pkg_resources
@@ -2642,37 +2368,26 @@ class RegisterROIEPI(SimpleInterface):
             copy=True,
             use_hardlink=False)
 
-        mni2t1w_warp_tmp_path = fname_presuffix(
-            self.inputs.mni2t1w_warp, suffix="_tmp", newpath=runtime.cwd
-        )
-        copyfile(
-            self.inputs.mni2t1w_warp,
-            mni2t1w_warp_tmp_path,
-            copy=True,
-            use_hardlink=False,
-        )
-
-        mni2t1_xfm_tmp_path = fname_presuffix(
-            self.inputs.mni2t1_xfm, suffix="_tmp", newpath=runtime.cwd
-        )
-        copyfile(
-            self.inputs.mni2t1_xfm,
-            mni2t1_xfm_tmp_path,
-            copy=True,
-            use_hardlink=False)
+        # Resolve the subject's transforms once, rather than copying them for
+        # every ROI
+        registry = regutils.TransformRegistry(
+            os.path.dirname(os.path.dirname(self.inputs.mni2t1_xfm)))
+        mni2t1w_warp = registry.register("mni", "t1w",
+                                         self.inputs.mni2t1w_warp,
+                                         kind="warp")
+        mni2t1_xfm = registry.register("mni", "t1w", self.inputs.mni2t1_xfm)
 
         if self.inputs.roi:
             # Align roi
             roi_in_t1w = regutils.roi2t1w_align(
                 roi_file_tmp_path,
                 t1w_brain_tmp_path,
-                mni2t1_xfm_tmp_path,
-                mni2t1w_warp_tmp_path,
+                mni2t1_xfm,
+                mni2t1w_warp,
                 roi_in_t1w,
                 template_tmp_path,
                 self.inputs.simple,
             )
-            time.sleep(0.5)
         else:
             roi_in_t1w = None
 
@@ -2680,8 +2395,6 @@ class RegisterROIEPI(SimpleInterface):
 
         reg_tmp = [
             t1w_brain_tmp_path,
-            mni2t1w_warp_tmp_path,
-            mni2t1_xfm_tmp_path,
             roi_file_tmp_path,
             template_tmp_path
         ]
@@ -2778,7 +2491,6 @@ class Tracking(SimpleInterface):
         import gc
         import os
         import sys
-        import time
         import os.path as op
         from dipy.io import load_pickle
         from colorama import Fore, Style
@@ -2786,7 +2498,7 @@ class Tracking(SimpleInterface):
         from pynets.core import utils
         from pynets.core.utils import load_runconfig
         from pynets.dmri.track import (
-            reconstruction,
+            cached_reconstruction,
             create_density_map,
             track_ensemble,
         )
@@ -2800,6 +2512,8 @@ class Tracking(SimpleInterface):
         roi_neighborhood_tol = hardcoded_params['tracking'][
             "roi_neighborhood_tol"][0]
         sphere = hardcoded_params['tracking']["sphere"][0]
+        sh_order = hardcoded_params['tracking']["sh_order"][0]
+        nthreads = hardcoded_params["nthreads"][0]
 
         dir_path = utils.do_dir_path(
             self.inputs.atlas, os.path.dirname(self.inputs.dwi_file)
@@ -2820,7 +2534,6 @@ class Tracking(SimpleInterface):
             use_hardlink=False)
 
         dwi_img = nib.load(dwi_file_tmp_path, mmap=True)
-        dwi_data = dwi_img.get_fdata(dtype=np.float32)
 
         # Load FA data
         fa_file_tmp_path = fname_presuffix(
@@ -2933,36 +2646,7 @@ class Tracking(SimpleInterface):
             gc.collect()
             self._results["dm_path"] = dm_path
             self._results["streams"] = streams
-            recon_path = None
         else:
-            # Fit diffusion model
-            # Save reconstruction to .npy
-            recon_path = "%s%s%s%s%s%s%s%s" % (
-                runtime.cwd,
-                "/reconstruction_",
-                "%s"
-                % (self.inputs.network + "_" if self.inputs.network is not None
-                   else ""),
-                "%s"
-                % (
-                    op.basename(self.inputs.roi).split(".")[0] + "_"
-                    if self.inputs.roi is not None
-                    else ""
-                ),
-                self.inputs.conn_model,
-                "_",
-                "%s"
-                % (
-                    "%s%s" % (self.inputs.node_size, "mm")
-                    if (
-                        (self.inputs.node_size != "parc")
-                        and (self.inputs.node_size is not None)
-                    )
-                    else "parc"
-                ),
-                ".hdf5",
-            )
-
             gtab_file_tmp_path = fname_presuffix(
                 self.inputs.gtab_file, suffix="_tmp", newpath=runtime.cwd
             )
@@ -2974,42 +2658,19 @@ class Tracking(SimpleInterface):
 
             gtab = load_pickle(gtab_file_tmp_path)
 
-            # Only re-run the reconstruction if we have to
-            if not os.path.isfile(f"{namer_dir}/{op.basename(recon_path)}"):
-                import h5py
-                model, _ = reconstruction(
-                    self.inputs.conn_model,
-                    gtab,
-                    dwi_data,
-                    B0_mask_tmp_path,
-                )
-                with h5py.File(recon_path, 'w') as hf:
-                    hf.create_dataset("reconstruction",
-                                      data=model.astype('float32'), dtype='f4')
-                hf.close()
-
-                copyfile(
-                    recon_path,
-                    f"{namer_dir}/{op.basename(recon_path)}",
-                    copy=True,
-                    use_hardlink=False,
-                )
-                time.sleep(1)
-                del model
-            else:
-                print(
-                    f"Found existing reconstruction with "
-                    f"{self.inputs.conn_model}. Loading...")
-                copyfile(
-                    f"{namer_dir}/{op.basename(recon_path)}",
-                    recon_path,
-                    copy=True,
-                    use_hardlink=False,
-                )
-                time.sleep(1)
+            # Fit diffusion model, or reuse the subject's existing fit of the
+            # same data, model, and spherical harmonics order
+            recon_path = cached_reconstruction(
+                self.inputs.conn_model,
+                gtab,
+                self.inputs.dwi_file,
+                self.inputs.B0_mask,
+                f"{namer_dir}/reconstructions",
+                sh_order=sh_order,
+                nthreads=nthreads,
+            )
 
             dwi_img.uncache()
-            del dwi_data
 
             # Load atlas wm-gm interface reduced version for seeding
             labels_im_file_tmp_path_wm_gm_int = fname_presuffix(
@@ -3262,7 +2923,7 @@ class Tracking(SimpleInterface):
         self._results["labels_im_file"] = labels_im_file_tmp_path
         self._results["min_length"] = self.inputs.min_length
 
-        tmp_files = [B0_mask_tmp_path, dwi_file_tmp_path, recon_path]
+        tmp_files = [B0_mask_tmp_path, dwi_file_tmp_path]
 
         for j in tmp_files:
             if j is not None:
@@ -3298,13 +2959,12 @@ class MakeGtabBmask(SimpleInterface):
 
     def _run_interface(self, runtime):
         import os
-        import time
         from dipy.io import save_pickle
         from dipy.io import read_bvals_bvecs
         from dipy.core.gradients import gradient_table
         from nipype.utils.filemanip import copyfile, fname_presuffix
         # from dipy.segment.mask import median_otsu
-        from pynets.registration.utils import median
+        from pynets.registration.utils import median, run_fsl
         from pynets.dmri.utils import normalize_gradients, extract_b0
 
         B0_bet = f"{runtime.cwd}/mean_B0_bet.nii.gz"
@@ -3394,9 +3054,7 @@ class MakeGtabBmask(SimpleInterface):
         #                 hdr).to_filename(B0_mask)
 
         # Get mean B0 brain mask
-        cmd = f"bet {med_b0_file} {B0_bet} -m -f 0.2"
-        os.system(cmd)
-        time.sleep(2)
+        run_fsl(f"bet {med_b0_file} {B0_bet} -m -f 0.2")
 
         self._results["gtab_file"] = gtab_file
         self._results["B0_bet"] = B0_bet
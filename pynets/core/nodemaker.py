@@ -46,19 +46,443 @@ def get_sphere(coords, r, vox_dims, dims):
      automated synthesis of human functional neuroimaging data.
      Frontiers in Neuroinformatics.
     """
-    r = float(r)
-    xx, yy, zz = [slice(-r / vox_dims[i], r / vox_dims[i] + 0.01, 1)
-                  for i in range(len(coords))]
-    cube = np.vstack([row.ravel() for row in np.mgrid[xx, yy, zz]])
-    sphere = cube[:, np.sum(
-        np.dot(np.diag(vox_dims), cube) ** 2, 0) ** 0.5 <= r]
-    sphere = np.round(sphere.T + coords)
+    sphere = np.round(get_sphere_kernel(r, vox_dims) + coords)
     neighbors = sphere[(np.min(sphere, 1) >= 0) & (
         np.max(np.subtract(sphere, dims), 1) <= -1), :].astype(int)
 
     return neighbors
 
 
+def get_sphere_kernel(r, vox_dims):
+    """
+    Return the voxel offsets of a sphere of radius r mm, to be added to a
+    sphere center in voxel space.
+
+    Parameters
+    ----------
+    r : int
+        Radius for sphere.
+    vox_dims : array/tuple
+        1D vector (x, y, z) of mm voxel resolution for sphere.
+
+    Returns
+    -------
+    kernel : ndarray
+        (n_offsets, 3) array of voxel offsets.
+    """
+    r = float(r)
+    xx, yy, zz = [slice(-r / vox_dims[i], r / vox_dims[i] + 0.01, 1)
+                  for i in range(3)]
+    cube = np.vstack([row.ravel() for row in np.mgrid[xx, yy, zz]])
+    return cube[:, np.sum(
+        np.dot(np.diag(vox_dims), cube) ** 2, 0) ** 0.5 <= r].T
+
+
+def get_spheres(coords, r, vox_dims, dims):
+    """
+    Vectorized version of `get_sphere` for many sphere centers at once, using
+    a single precomputed sphere kernel.
+
+    Parameters
+    ----------
+    coords : list
+        List of (x, y, z) sphere centers in voxel space.
+    r : int
+        Radius for sphere.
+    vox_dims : array/tuple
+        1D vector (x, y, z) of mm voxel resolution for sphere.
+    dims : array/tuple
+        1D vector (x, y, z) of image dimensions for sphere.
+
+    Returns
+    -------
+    sphere_ix : ndarray
+        Index into `coords` of the sphere each neighbor belongs to.
+    neighbors : ndarray
+        Flat (C-order) indices, within the dimensions of the image, of the
+        voxels falling within each sphere. Each (sphere_ix, neighbors) pair
+        is unique.
+    """
+    dims = tuple(int(i) for i in dims[:3])
+    n_vox = int(np.prod(dims))
+    kernel = get_sphere_kernel(r, vox_dims)
+    coords = np.asarray(coords, dtype="float64").reshape(-1, 3)
+
+    sphere = np.round(kernel[np.newaxis, :, :] + coords[:, np.newaxis, :]
+                      ).reshape(-1, 3)
+    sphere_ix = np.repeat(np.arange(len(coords)), len(kernel))
+    inside = np.all((sphere >= 0) & (sphere < dims), axis=1)
+    neighbors = np.ravel_multi_index(
+        tuple(sphere[inside].astype("int64").T), dims)
+
+    key = np.unique(sphere_ix[inside] * n_vox + neighbors)
+    return key // n_vox, key % n_vox
+
+
+class ParcelMembership(object):
+    """
+    Sparse parcel-by-voxel membership operator.
+
+    Stores a set of (possibly overlapping) parcels as a boolean CSR matrix
+    with one row per parcel and one column per voxel of a reference grid, so
+    that masking, dropping, relabeling and centroid computation can be
+    performed without materializing a full volume for each parcel.
+
+    Parameters
+    ----------
+    matrix : sparse matrix or ndarray
+        Boolean membership matrix of shape (n_parcels, n_voxels), with voxels
+        raveled in C-order.
+    affine : ndarray
+        4x4 voxel-to-mm affine of the reference grid.
+    shape : tuple
+        3D shape of the reference grid.
+    label_intensities : array-like
+        Label intensity of each parcel. Default is 1..n_parcels.
+    """
+
+    def __init__(self, matrix, affine, shape, label_intensities=None):
+        from scipy.sparse import csr_matrix
+
+        self.matrix = csr_matrix(matrix, dtype=bool)
+        self.matrix.sort_indices()
+        self.affine = np.asarray(affine)
+        self.shape = tuple(int(i) for i in shape[:3])
+        if label_intensities is None:
+            label_intensities = np.arange(1, self.matrix.shape[0] + 1)
+        self.label_intensities = np.asarray(label_intensities)
+
+        if self.matrix.shape != (len(self.label_intensities),
+                                 int(np.prod(self.shape))):
+            raise ValueError(
+                f"Membership matrix of shape {self.matrix.shape} is "
+                f"inconsistent with {len(self.label_intensities)} labels on "
+                f"a {self.shape} grid.")
+
+    @classmethod
+    def from_img(cls, img, background_label=0):
+        """
+        Build a membership operator from a 3D label image, or from a 4D
+        image with one binarized parcel per volume.
+
+        Parameters
+        ----------
+        img : str or Nifti1Image
+            Atlas parcellation image, or a path to it.
+        background_label : int
+            Intensity of the background. Default is 0.
+        """
+        from scipy.sparse import csr_matrix
+
+        if isinstance(img, str):
+            img = nib.load(img)
+
+        if len(img.shape) == 4:
+            indices = [np.flatnonzero(np.asarray(img.dataobj[..., i]))
+                       for i in range(img.shape[-1])]
+            indptr = np.cumsum([0] + [len(i) for i in indices])
+            matrix = csr_matrix((np.ones(indptr[-1], dtype=bool),
+                                 np.concatenate(indices), indptr),
+                                shape=(len(indices),
+                                       int(np.prod(img.shape[:3]))))
+            return cls(matrix, img.affine, img.shape[:3])
+
+        return cls.from_label_data(
+            np.around(np.asarray(img.dataobj)).astype("int64"), img.affine,
+            background_label=background_label)
+
+    @classmethod
+    def from_label_data(cls, labels_data, affine, label_intensities=None,
+                        background_label=0):
+        """
+        Build a membership operator from a 3D integer label array.
+
+        Parameters
+        ----------
+        labels_data : ndarray
+            3D array of integer label intensities.
+        affine : ndarray
+            4x4 voxel-to-mm affine of `labels_data`.
+        label_intensities : array-like
+            Sorted intensities to create a parcel for, in order. Intensities
+            absent from `labels_data` yield empty parcels, and voxels with
+            other intensities are ignored. Default is all unique
+            non-background intensities.
+        background_label : int
+            Intensity of the background. Default is 0.
+        """
+        from scipy.sparse import coo_matrix
+
+        labels_data = np.asarray(labels_data)
+        flat = labels_data.ravel()
+        vox = np.flatnonzero(flat != background_label)
+        if label_intensities is None:
+            vals = flat[vox]
+            if vals.dtype.kind in "iu" and vals.size > 0 and \
+                    vals.min() >= 0 and vals.max() < 2 ** 24:
+                # Sort-free inventory of non-negative integer labels
+                vals = vals.astype("int64", copy=False)
+                present = np.bincount(vals) > 0
+                label_intensities = np.flatnonzero(present)
+                rows = (np.cumsum(present) - 1)[vals]
+            else:
+                label_intensities, rows = np.unique(vals,
+                                                    return_inverse=True)
+                rows = rows.ravel()
+        else:
+            label_intensities = np.asarray(label_intensities)
+            rows = np.searchsorted(label_intensities, flat[vox])
+            valid = rows < len(label_intensities)
+            valid[valid] = label_intensities[rows[valid]] == \
+                flat[vox][valid]
+            vox, rows = vox[valid], rows[valid]
+
+        matrix = coo_matrix((np.ones(len(vox), dtype=bool), (rows, vox)),
+                            shape=(len(label_intensities), flat.size)).tocsr()
+        return cls(matrix, affine, labels_data.shape, label_intensities)
+
+    @classmethod
+    def from_imgs(cls, imgs):
+        """
+        Build a membership operator from an iterable of binarized parcel
+        images sharing one grid. Images are consumed one at a time.
+
+        Parameters
+        ----------
+        imgs : iterable
+            Binarized Nifti1Images, or paths to them, corresponding to ROI
+            masks.
+        """
+        from scipy.sparse import csr_matrix
+
+        indices = []
+        ref = None
+        for img in imgs:
+            if isinstance(img, str):
+                img = nib.load(img)
+            if ref is None:
+                ref = img
+            elif img.shape[:3] != ref.shape[:3]:
+                raise ValueError(
+                    f"Parcel of shape {img.shape} does not match the "
+                    f"reference grid {ref.shape}.")
+            indices.append(np.flatnonzero(np.asarray(img.dataobj)))
+        if ref is None:
+            raise ValueError("No parcels supplied!")
+
+        indptr = np.cumsum([0] + [len(i) for i in indices])
+        matrix = csr_matrix((np.ones(indptr[-1], dtype=bool),
+                             np.concatenate(indices), indptr),
+                            shape=(len(indices),
+                                   int(np.prod(ref.shape[:3]))))
+        return cls(matrix, ref.affine, ref.shape)
+
+    @classmethod
+    def from_parcel_list(cls, parcel_list):
+        """
+        Coerce any of the parcel representations passed between nodes (a
+        ParcelMembership, a 3D label or 4D parcel image path, a Nifti1Image,
+        or an iterable of binarized parcel images) into a ParcelMembership.
+        """
+        if isinstance(parcel_list, cls):
+            return parcel_list
+        if isinstance(parcel_list, (str, nib.spatialimages.SpatialImage)):
+            return cls.from_img(parcel_list)
+        return cls.from_imgs(parcel_list)
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def __getitem__(self, idx):
+        idx = np.atleast_1d(np.arange(len(self))[idx])
+        return self.__class__(self.matrix[idx], self.affine, self.shape,
+                              self.label_intensities[idx])
+
+    def _rows(self):
+        return np.repeat(np.arange(len(self)), np.diff(self.matrix.indptr))
+
+    def drop(self, indices):
+        """Return a copy with the parcels at `indices` removed."""
+        return self[np.setdiff1d(np.arange(len(self)),
+                                 np.asarray(indices, dtype=int))]
+
+    def voxel_counts(self):
+        """Number of voxels in each parcel."""
+        return np.diff(self.matrix.indptr)
+
+    def overlap(self, mask):
+        """
+        Fraction of each parcel's voxels falling within a mask defined on the
+        same grid.
+
+        Parameters
+        ----------
+        mask : ndarray or Nifti1Image
+            3D boolean mask.
+
+        Returns
+        -------
+        overlap : ndarray
+            Value 0-1 for each parcel. Empty parcels have an overlap of 0.
+        """
+        if isinstance(mask, nib.spatialimages.SpatialImage):
+            mask = np.asarray(mask.dataobj)
+        mask = np.asarray(mask).astype("bool").ravel()
+        overlap_count = np.bincount(self._rows(),
+                                    weights=mask[self.matrix.indices],
+                                    minlength=len(self))
+        total_count = self.voxel_counts()
+        return np.divide(overlap_count, total_count,
+                         out=np.zeros(len(self)), where=total_count > 0)
+
+    def resample_to_img(self, target_img):
+        """
+        Nearest-neighbor resampling of every parcel onto the grid of
+        `target_img`, one target slice at a time.
+
+        Parameters
+        ----------
+        target_img : str or Nifti1Image
+            Image whose affine and shape define the new grid.
+        """
+        from scipy.sparse import coo_matrix
+
+        if isinstance(target_img, str):
+            target_img = nib.load(target_img)
+        target_shape = tuple(int(i) for i in target_img.shape[:3])
+        if target_shape == self.shape and np.allclose(target_img.affine,
+                                                      self.affine):
+            return self
+
+        support = np.zeros(int(np.prod(self.shape)), dtype=bool)
+        support[self.matrix.indices] = True
+        vox2vox = np.linalg.inv(self.affine).dot(target_img.affine)
+        i, j = np.meshgrid(np.arange(target_shape[0]),
+                           np.arange(target_shape[1]), indexing="ij")
+        i, j = i.ravel(), j.ravel()
+
+        src_ix = []
+        tgt_ix = []
+        for k in range(target_shape[2]):
+            ijk = np.column_stack([i, j, np.full(len(i), k)])
+            # Same sampling rule as scipy.ndimage (order=0, mode='constant')
+            src = nib.affines.apply_affine(vox2vox, ijk)
+            valid = np.all((src >= 0) & (src <= np.subtract(self.shape, 1)),
+                           axis=1)
+            src = np.floor(src[valid] + 0.5).astype("int64")
+            src = np.ravel_multi_index(tuple(src.T), self.shape)
+            hit = support[src]
+            src_ix.append(src[hit])
+            tgt_ix.append(np.ravel_multi_index(
+                (i[valid][hit], j[valid][hit], np.full(hit.sum(), k)),
+                target_shape))
+        src_ix = np.concatenate(src_ix)
+        tgt_ix = np.concatenate(tgt_ix)
+
+        selection = coo_matrix(
+            (np.ones(len(src_ix), dtype="int32"), (src_ix, tgt_ix)),
+            shape=(len(support), int(np.prod(target_shape)))).tocsc()
+        matrix = self.matrix.astype("int32").dot(selection)
+        return self.__class__(matrix, target_img.affine, target_shape,
+                              self.label_intensities)
+
+    def to_img(self, label_intensities=None, dtype="uint16"):
+        """
+        Collapse the parcels into a 3D label image. Voxels claimed by more
+        than one parcel are set to zero.
+
+        Parameters
+        ----------
+        label_intensities : array-like
+            Intensity to assign each parcel. Default is the stored label
+            intensities.
+        dtype : str
+            Data type of the label image. Default is 'uint16'.
+        """
+        if label_intensities is None:
+            label_intensities = self.label_intensities
+        label_intensities = np.asarray(label_intensities)
+
+        rows = self._rows()
+        cols = self.matrix.indices
+        n_vox = int(np.prod(self.shape))
+        data = np.zeros(n_vox, dtype=dtype)
+        data[cols] = label_intensities[rows]
+
+        # Set overlapping cases to zero.
+        data[np.bincount(cols, minlength=n_vox) > 1] = 0
+        return nib.Nifti1Image(data.reshape(self.shape), affine=self.affine)
+
+    def centroids(self):
+        """
+        Center-of-mass of each parcel in mm-space.
+
+        Returns
+        -------
+        coords : ndarray
+            (n_parcels, 3) array of (x, y, z) coordinates.
+        """
+        rows = self._rows()
+        ijk = np.unravel_index(self.matrix.indices, self.shape)
+        counts = self.voxel_counts().astype("float64")
+        com = np.column_stack([np.bincount(rows, weights=ax,
+                                           minlength=len(self))
+                               for ax in ijk]) / counts[:, np.newaxis]
+        return nib.affines.apply_affine(self.affine, com)
+
+    def iter_imgs(self):
+        """Lazily yield a binarized Nifti1Image for each parcel."""
+        for row in range(len(self)):
+            data = np.zeros(int(np.prod(self.shape)), dtype="uint16")
+            data[self.matrix.indices[self.matrix.indptr[row]:
+                                     self.matrix.indptr[row + 1]]] = 1
+            yield nib.Nifti1Image(data.reshape(self.shape),
+                                  affine=self.affine)
+
+
+def get_coords_mask_affinity(coords_vox, mask_data, error, vox_dims):
+    """
+    Evaluate, for many voxel coordinates at once, whether each falls within a
+    mask or within a spherical neighborhood of it.
+
+    Parameters
+    ----------
+    coords_vox : list
+        List of (x, y, z) integer tuples in voxel-space.
+    mask_data : ndarray
+        3D boolean mask.
+    error : int
+        Radius, in mm, of the spherical neighborhood.
+    vox_dims : array/tuple
+        1D vector (x, y, z) of mm voxel resolution.
+
+    Returns
+    -------
+    in_mask : ndarray
+        Whether each coordinate itself falls within the mask.
+    near_mask : ndarray
+        Whether any voxel within `error` mm of each coordinate falls within
+        the mask.
+    """
+    from pynets.core.nodemaker import get_spheres
+
+    mask_data = np.asarray(mask_data).astype("bool")
+    coords_vox = np.asarray(coords_vox, dtype="int64").reshape(-1, 3)
+
+    inside = np.all((coords_vox >= 0) & (coords_vox < mask_data.shape),
+                    axis=1)
+    in_mask = np.zeros(len(coords_vox), dtype=bool)
+    in_mask[inside] = mask_data[tuple(coords_vox[inside].T)]
+
+    [sphere_ix, sphere_vox] = get_spheres(coords_vox, error, vox_dims,
+                                          mask_data.shape)
+    near_mask = np.bincount(sphere_ix,
+                            weights=mask_data.ravel()[sphere_vox],
+                            minlength=len(coords_vox)) > 0
+
+    return in_mask, near_mask
+
+
 def create_parcel_atlas(parcel_list, label_intensities=None):
     """
     Create a 3D Nifti1Image atlas parcellation of consecutive integer
@@ -66,55 +490,30 @@ def create_parcel_atlas(parcel_list, label_intensities=None):
 
     Parameters
     ----------
-    parcel_list : list
-        List of 3D boolean numpy arrays or binarized Nifti1Images
-        corresponding to ROI masks.
+    parcel_list : list or ParcelMembership
+        List of binarized Nifti1Images corresponding to ROI masks, a
+        ParcelMembership, or a file path to a label/4D parcel image.
 
     Returns
     -------
     net_parcels_map_nifti : Nifti1Image
         A nibabel-based nifti image consisting of a 3D array with integer voxel
         intensities corresponding to ROI membership.
-    parcel_list_exp : list
-        List of 3D boolean numpy arrays or binarized Nifti1Images corresponding
-        to ROI masks, prepended with a background image of zeros.
+    parcel_list_exp : ndarray
+        Label intensities assigned to each ROI, prepended with a background
+        intensity of zero.
     """
-    import gc
-    import types
-    from nilearn.image import new_img_like, concat_imgs
-
-    if isinstance(parcel_list, types.GeneratorType):
-        parcel_list = [i for i in parcel_list]
-
-    parcel_list_exp = [
-        new_img_like(
-            parcel_list[0],
-            np.zeros(
-                parcel_list[0].shape,
-                dtype=bool))] + parcel_list
-    concatted_parcels = concat_imgs(parcel_list_exp, dtype=np.float32)
+    from pynets.core.nodemaker import ParcelMembership
+
+    parcels = ParcelMembership.from_parcel_list(parcel_list)
+
     if label_intensities is not None:
-        parcel_list_exp = np.array([0] + label_intensities).astype("float32")
-    else:
-        parcel_list_exp = np.array(range(len(parcel_list_exp))
+        parcel_list_exp = np.array([0] + list(label_intensities)
                                    ).astype("float32")
-    parcel_sum = np.sum(
-        parcel_list_exp *
-        np.asarray(
-            concatted_parcels.dataobj),
-        axis=3,
-        dtype=np.uint16)
-    par_max = np.max(parcel_list_exp)
-    outs = np.unique(parcel_sum[parcel_sum > par_max])
-
-    # Set overlapping cases to zero.
-    for out in outs:
-        parcel_sum[parcel_sum == out] = 0
-    net_parcels_map_nifti = nib.Nifti1Image(
-        parcel_sum, affine=parcel_list[0].affine)
-
-    del concatted_parcels, parcel_sum, parcel_list
-    gc.collect()
+    else:
+        parcel_list_exp = np.array(range(len(parcels) + 1)).astype("float32")
+
+    net_parcels_map_nifti = parcels.to_img(parcel_list_exp[1:])
 
     return net_parcels_map_nifti, parcel_list_exp
 
@@ -257,6 +656,507 @@ def nilearn_atlas_helper(atlas, parc):
     return labels, networks_list, uatlas
 
 
+def fetch_nodes_and_labels(atlas, uatlas, ref_txt, parc, out_dir,
+                           use_parcel_naming=False, vox_size="2mm",
+                           clustering=False):
+    """
+    Fetch the nodes and labels of a nilearn, local, or user-specified atlas.
+
+    Parameters
+    ----------
+    atlas : str
+        Name of a Nilearn-hosted coordinate or parcellation/label-based atlas
+        supported for fetching, or of an atlas in the local repository.
+    uatlas : str
+        File path to atlas parcellation Nifti1Image in MNI template space, or
+        None to fetch `atlas` by name.
+    ref_txt : str
+        Path to an atlas reference .txt file that maps labels to
+        intensities corresponding to uatlas.
+    parc : bool
+        Indicates whether to use parcels instead of coordinates as ROI nodes.
+    out_dir : str
+        Directory in which the fetched and relabeled atlas is written.
+    use_parcel_naming : bool
+        Whether to name nodes by multi-atlas lookup when no reference labels
+        are available. Default is False.
+    vox_size : str
+        Voxel resolution (`1mm` or `2mm` stored as strings with units) used
+        for multi-atlas lookup. Default is '2mm'.
+    clustering : bool
+        Whether the atlas was produced by clustering, in which case its
+        labels are left as they are. Default is False.
+
+    Returns
+    -------
+    labels : list
+        List of string labels corresponding to ROI nodes.
+    coords : list
+        List of (x, y, z) tuples corresponding to the center-of-mass of each
+        parcellation node, or to a coordinate atlas.
+    atlas : str
+        Name of the atlas.
+    networks_list : list
+        List of RSN's and their associated cooordinates, if predefined for
+        the atlas.
+    par_max : int
+        The maximum label intensity in the parcellation image.
+    uatlas : str
+        File path to the atlas parcellation Nifti1Image with hemispherically
+        distinct and consecutive labels.
+    label_intensities : list
+        A list of integer label intensity values from the parcellation.
+    """
+    import os.path as op
+    import glob
+    import time
+    import pandas as pd
+    from nipype.utils.filemanip import fname_presuffix, copyfile
+    from pynets.core import utils
+
+    base_path = utils.get_file()
+    # Test if atlas is a nilearn atlas. If so, fetch coords, labels, and/or
+    # networks.
+    nilearn_parc_atlases = [
+        "atlas_harvard_oxford",
+        "atlas_aal",
+        "atlas_destrieux_2009",
+        "atlas_talairach_gyrus",
+        "atlas_talairach_ba",
+        "atlas_talairach_lobe",
+    ]
+    nilearn_coords_atlases = ["coords_power_2011", "coords_dosenbach_2010"]
+    nilearn_prob_atlases = ["atlas_msdl", "atlas_pauli_2017"]
+    local_atlases = [
+        op.basename(i).split(".nii")[0]
+        for i in glob.glob(f"{str(Path(base_path).parent)}"
+                           f"/atlases/*.nii.gz")
+        if "_4d" not in i
+    ]
+
+    if uatlas is None and atlas in nilearn_parc_atlases:
+        [labels, networks_list, uatlas] = nilearn_atlas_helper(atlas, parc)
+        if uatlas:
+            if not isinstance(uatlas, str):
+                nib.save(uatlas, f"{out_dir}/{atlas}.nii.gz")
+                uatlas = f"{out_dir}/{atlas}.nii.gz"
+            if clustering is False:
+                [uatlas, labels] = enforce_hem_distinct_consecutive_labels(
+                    uatlas, label_names=labels)
+            [coords, _, par_max, label_intensities] = \
+                get_names_and_coords_of_parcels(uatlas)
+        else:
+            raise FileNotFoundError(
+                f"\nAtlas file for {atlas} not found!"
+            )
+
+    elif (
+        uatlas is None
+        and parc is False
+        and atlas in nilearn_coords_atlases
+    ):
+        print(
+            "Fetching coords and labels from nilearn coordinate-based"
+            " atlas library..."
+        )
+        # Fetch nilearn atlas coords
+        [coords, _, networks_list,
+         labels] = fetch_nilearn_atlas_coords(atlas)
+        par_max = None
+        uatlas = None
+        label_intensities = None
+    elif (
+        uatlas is None
+        and parc is False
+        and atlas in nilearn_prob_atlases
+    ):
+        from nilearn.plotting import find_probabilistic_atlas_cut_coords
+
+        print(
+            "Fetching coords and labels from nilearn probabilistic atlas"
+            " library..."
+        )
+        # Fetch nilearn atlas coords
+        [labels, networks_list, uatlas] = nilearn_atlas_helper(atlas, parc)
+        coords = find_probabilistic_atlas_cut_coords(maps_img=uatlas)
+        if uatlas:
+            if not isinstance(uatlas, str):
+                nib.save(uatlas, f"{out_dir}/{atlas}.nii.gz")
+                uatlas = f"{out_dir}/{atlas}.nii.gz"
+            if clustering is False:
+                [uatlas, labels] = enforce_hem_distinct_consecutive_labels(
+                    uatlas, label_names=labels)
+        else:
+            raise FileNotFoundError(
+                f"\nAtlas file for {atlas} not found!")
+
+        par_max = None
+        label_intensities = None
+    elif uatlas is None and atlas in local_atlases:
+        uatlas_pre = (
+            f"{str(Path(base_path).parent)}/atlases/{atlas}.nii.gz"
+        )
+        uatlas = fname_presuffix(uatlas_pre, newpath=out_dir)
+        copyfile(uatlas_pre, uatlas, copy=True, use_hardlink=False)
+        try:
+            par_img = nib.load(uatlas)
+        except indexed_gzip.ZranError as e:
+            print(e,
+                  "\nCannot load RSN reference image. Do you have git-lfs "
+                  "installed?")
+        try:
+            if clustering is False:
+                [uatlas, _] = enforce_hem_distinct_consecutive_labels(uatlas)
+
+            # Fetch user-specified atlas coords
+            [coords, _, par_max, label_intensities] = \
+                get_names_and_coords_of_parcels(uatlas)
+            # Describe user atlas coords
+            print(f"\n{atlas} comes with {par_max} parcels\n")
+        except ValueError as e:
+            print(e,
+                  "Either you have specified the name of an atlas that "
+                  "does not exist in the nilearn or local repository or "
+                  "you have not supplied a 3d atlas parcellation image!")
+        labels = None
+        networks_list = None
+    elif uatlas:
+        if clustering is True:
+            while True:
+                if op.isfile(uatlas):
+                    break
+                else:
+                    print("Waiting for atlas file...")
+                    time.sleep(5)
+
+        try:
+            uatlas_tmp_path = fname_presuffix(uatlas, newpath=out_dir)
+            copyfile(uatlas, uatlas_tmp_path, copy=True, use_hardlink=False)
+            # Fetch user-specified atlas coords
+            if clustering is False:
+                [uatlas, _] = enforce_hem_distinct_consecutive_labels(
+                    uatlas_tmp_path)
+            else:
+                uatlas = uatlas_tmp_path
+            [coords, atlas, par_max, label_intensities] = \
+                get_names_and_coords_of_parcels(uatlas)
+
+            atlas = utils.prune_suffices(atlas)
+
+            # Describe user atlas coords
+            print(f"\n{atlas} comes with {par_max} parcels\n")
+        except ValueError as e:
+            print(e,
+                  "Either you have specified the name of an atlas that "
+                  "does not exist in the nilearn or local repository or "
+                  "you have not supplied a 3d atlas parcellation image!")
+        labels = None
+        networks_list = None
+    else:
+        raise ValueError(
+            "Either you have specified the name of an atlas that does"
+            " not exist in the nilearn or local repository or you have"
+            " not supplied a 3d atlas parcellation image!")
+
+    # Labels prep
+    if atlas and not labels:
+        if ref_txt is not None and op.exists(ref_txt):
+            labels = pd.read_csv(
+                ref_txt, sep=" ", header=None, names=[
+                    "Index", "Region"])["Region"].tolist()
+        else:
+            if atlas in local_atlases:
+                ref_txt = (
+                    f"{str(Path(base_path).parent)}/labelcharts/"
+                    f"{atlas}.txt"
+                )
+            if ref_txt is not None:
+                try:
+                    labels = pd.read_csv(
+                        ref_txt, sep=" ", header=None, names=[
+                            "Index", "Region"])["Region"].tolist()
+                except BaseException:
+                    if use_parcel_naming is True:
+                        try:
+                            labels = parcel_naming(coords, vox_size)
+                        except BaseException:
+                            print("AAL reference labeling failed!")
+                            labels = np.arange(len(coords) + 1)[
+                                np.arange(len(coords) + 1) != 0
+                            ].tolist()
+                    else:
+                        print("Using generic index labels...")
+                        labels = np.arange(len(coords) + 1)[
+                            np.arange(len(coords) + 1) != 0
+                        ].tolist()
+            else:
+                if use_parcel_naming is True:
+                    try:
+                        labels = parcel_naming(coords, vox_size)
+                    except BaseException:
+                        print("AAL reference labeling failed!")
+                        labels = np.arange(len(coords) + 1)[
+                            np.arange(len(coords) + 1) != 0
+                        ].tolist()
+                else:
+                    print("Using generic index labels...")
+                    labels = np.arange(len(coords) + 1)[
+                        np.arange(len(coords) + 1) != 0
+                    ].tolist()
+
+    if len(coords) != len(labels):
+        labels = [i for i in labels if (i != 'Unknown' and
+                                        i != 'Background')]
+        if len(coords) != len(labels):
+            print("Length of coordinates is not equal to length of "
+                  "label names...")
+            if use_parcel_naming is True:
+                try:
+                    print("Attempting consensus parcel naming instead...")
+                    labels = parcel_naming(coords, vox_size)
+                except BaseException:
+                    print("Reverting to integer labels instead...")
+                    labels = np.arange(len(coords) + 1)[
+                        np.arange(len(coords) + 1) != 0
+                    ].tolist()
+            else:
+                print("Reverting to integer labels instead...")
+                labels = np.arange(len(coords) + 1)[
+                    np.arange(len(coords) + 1) != 0
+                ].tolist()
+
+    return labels, coords, atlas, networks_list, par_max, uatlas, \
+        label_intensities
+
+
+def atlas_library_dir(vox_size="2mm", library_dir=None):
+    """
+    Directory of the local atlas library for the template of runconfig.yaml
+    at a given resolution, versioned by the PyNets release.
+
+    Parameters
+    ----------
+    vox_size : str
+        Voxel resolution (`1mm` or `2mm` stored as strings with units).
+        Default is '2mm'.
+    library_dir : str
+        Root of the atlas library. Default is the `atlas_library` setting of
+        runconfig.yaml, or ~/.pynets/atlas_library.
+
+    Returns
+    -------
+    library_dir : str
+        Directory of the library for the template and resolution.
+    """
+    import os
+    from pynets.__about__ import __version__
+    from pynets.core.utils import load_runconfig
+
+    hardcoded_params = load_runconfig()
+    template_name = hardcoded_params["template"][0]
+    if library_dir is None:
+        library_dir = hardcoded_params.get("atlas_library", [None])[0]
+    if library_dir is None:
+        library_dir = f"{os.path.expanduser('~')}/.pynets/atlas_library"
+
+    return f"{library_dir}/{__version__}/{template_name}/{vox_size}"
+
+
+def atlas_library_entry(atlas, uatlas, ref_txt, parc,
+                        use_parcel_naming=False, vox_size="2mm",
+                        library_dir=None):
+    """
+    Directory of an atlas in the local atlas library.
+
+    Entries are versioned by the PyNets release, grouped by template and
+    resolution, and keyed by a digest of the atlas and reference label files
+    and of the settings that its nodes and labels depend on.
+
+    Parameters
+    ----------
+    atlas : str
+        Name of a nilearn or local atlas. Ignored when `uatlas` is given.
+    uatlas : str
+        File path to atlas parcellation Nifti1Image in MNI template space, or
+        None for atlases fetched by name.
+    ref_txt : str
+        Path to an atlas reference .txt file that maps labels to
+        intensities corresponding to uatlas.
+    parc : bool
+        Indicates whether to use parcels instead of coordinates as ROI nodes.
+    use_parcel_naming : bool
+        Whether nodes are named by multi-atlas lookup. Default is False.
+    vox_size : str
+        Voxel resolution (`1mm` or `2mm` stored as strings with units).
+        Default is '2mm'.
+    library_dir : str
+        Root of the atlas library. See `atlas_library_dir`.
+
+    Returns
+    -------
+    entry_dir : str
+        Directory of the library entry.
+    """
+    import os
+    import hashlib
+
+    if isinstance(uatlas, str):
+        name = os.path.basename(uatlas).split(".nii")[0]
+    else:
+        name = atlas
+    digest = hashlib.sha1(
+        f"{name}_{bool(parc)}_{bool(use_parcel_naming)}".encode())
+    for file_ in [uatlas, ref_txt]:
+        digest.update(b"\0")
+        if isinstance(file_, str) and os.path.isfile(file_):
+            with open(file_, "rb") as f:
+                for chunk in iter(lambda: f.read(2 ** 20), b""):
+                    digest.update(chunk)
+
+    return f"{atlas_library_dir(vox_size, library_dir)}/" \
+        f"{name}_{digest.hexdigest()[:12]}"
+
+
+def build_atlas_library_entry(atlas, uatlas, ref_txt, parc,
+                              use_parcel_naming=False, vox_size="2mm",
+                              library_dir=None):
+    """
+    Precompute the nodes and labels of an atlas into the atlas library.
+
+    The atlas with hemispherically distinct and consecutive labels, its
+    node coordinates, label intensities, and label names (see
+    `fetch_nodes_and_labels`) depend only on the atlas and template, and are
+    stored once so that subject runs can load them instead of recomputing
+    them. Existing entries are left as they are.
+
+    Parameters
+    ----------
+    atlas : str
+        Name of a nilearn or local atlas.
+    uatlas : str
+        File path to atlas parcellation Nifti1Image in MNI template space, or
+        None to fetch `atlas` by name.
+    ref_txt : str
+        Path to an atlas reference .txt file that maps labels to
+        intensities corresponding to uatlas.
+    parc : bool
+        Indicates whether to use parcels instead of coordinates as ROI nodes.
+    use_parcel_naming : bool
+        Whether to name nodes by multi-atlas lookup. Default is False.
+    vox_size : str
+        Voxel resolution (`1mm` or `2mm` stored as strings with units).
+        Default is '2mm'.
+    library_dir : str
+        Root of the atlas library. See `atlas_library_dir`.
+
+    Returns
+    -------
+    entry_dir : str
+        Directory of the library entry.
+    """
+    import os
+    import shutil
+    import pickle
+    from filelock import SoftFileLock
+    from nipype.utils.filemanip import copyfile
+
+    entry_dir = atlas_library_entry(atlas, uatlas, ref_txt, parc,
+                                    use_parcel_naming, vox_size, library_dir)
+    os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+
+    with SoftFileLock(f"{entry_dir}.lock"):
+        if os.path.isfile(f"{entry_dir}/nodes.pkl"):
+            print(f"Found existing atlas library entry {entry_dir}")
+            return entry_dir
+
+        tmp_dir = f"{entry_dir}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        [labels, coords, atlas, networks_list, par_max, uatlas,
+         label_intensities] = fetch_nodes_and_labels(
+            atlas, uatlas, ref_txt, parc, tmp_dir,
+            use_parcel_naming=use_parcel_naming, vox_size=vox_size)
+
+        # Nilearn atlases may be relabeled in their data directory
+        if uatlas is not None:
+            if os.path.dirname(os.path.abspath(uatlas)) != \
+                    os.path.abspath(tmp_dir):
+                copyfile(uatlas, f"{tmp_dir}/{os.path.basename(uatlas)}",
+                         copy=True, use_hardlink=False)
+            uatlas = os.path.basename(uatlas)
+
+        with open(f"{tmp_dir}/nodes.pkl", "wb") as f:
+            pickle.dump({
+                "labels": labels,
+                "coords": coords,
+                "atlas": atlas,
+                "networks_list": networks_list,
+                "par_max": par_max,
+                "uatlas": uatlas,
+                "label_intensities": label_intensities,
+            }, f, protocol=2)
+        os.replace(tmp_dir, entry_dir)
+
+    return entry_dir
+
+
+def load_atlas_library_entry(atlas, uatlas, ref_txt, parc, out_dir,
+                             use_parcel_naming=False, vox_size="2mm",
+                             library_dir=None):
+    """
+    Load the nodes and labels of an atlas from the atlas library.
+
+    Parameters
+    ----------
+    atlas : str
+        Name of a nilearn or local atlas.
+    uatlas : str
+        File path to atlas parcellation Nifti1Image in MNI template space, or
+        None for atlases fetched by name.
+    ref_txt : str
+        Path to an atlas reference .txt file that maps labels to
+        intensities corresponding to uatlas.
+    parc : bool
+        Indicates whether to use parcels instead of coordinates as ROI nodes.
+    out_dir : str
+        Directory into which the library's atlas parcellation is copied.
+    use_parcel_naming : bool
+        Whether nodes are named by multi-atlas lookup. Default is False.
+    vox_size : str
+        Voxel resolution (`1mm` or `2mm` stored as strings with units).
+        Default is '2mm'.
+    library_dir : str
+        Root of the atlas library. See `atlas_library_dir`.
+
+    Returns
+    -------
+    nodes : tuple
+        The outputs of `fetch_nodes_and_labels`, or None if the atlas has not
+        been built into the library.
+    """
+    import os
+    import pickle
+    from nipype.utils.filemanip import copyfile
+
+    entry_dir = atlas_library_entry(atlas, uatlas, ref_txt, parc,
+                                    use_parcel_naming, vox_size, library_dir)
+    if not os.path.isfile(f"{entry_dir}/nodes.pkl"):
+        return None
+
+    with open(f"{entry_dir}/nodes.pkl", "rb") as f:
+        nodes = pickle.load(f)
+    uatlas = nodes["uatlas"]
+    if uatlas is not None:
+        uatlas = f"{out_dir}/{nodes['uatlas']}"
+        copyfile(f"{entry_dir}/{nodes['uatlas']}", uatlas, copy=True,
+                 use_hardlink=False)
+    print(f"Loaded {nodes['atlas']} from the atlas library: {entry_dir}")
+
+    return nodes["labels"], nodes["coords"], nodes["atlas"], \
+        nodes["networks_list"], nodes["par_max"], uatlas, \
+        nodes["label_intensities"]
+
+
 def mmToVox(img_affine, mmcoords):
     """
     Function to convert a list of mm coordinates to voxel coordinates.
@@ -287,6 +1187,96 @@ def VoxTomm(img_affine, voxcoords):
     return nib.affines.apply_affine(img_affine, voxcoords)
 
 
+def network_membership_table(parcel_list, template_img, rsn_file):
+    """
+    Voxel overlap of every parcel with every resting-state network.
+
+    Parcels and the RSN reference are resampled to the template once, and
+    the voxels of each parcel are counted per network with a single
+    `np.bincount` over the joint (parcel, network) labels. When `parcel_list`
+    is a file, the table is cached next to it, keyed by the contents of the
+    parcels and of the RSN reference and by the template grid, so that
+    every network iterable of an atlas reuses it.
+
+    Parameters
+    ----------
+    parcel_list : str or ParcelMembership
+        File path to a label/4D parcel image, or a ParcelMembership.
+    template_img : Nifti1Image
+        Image whose affine and shape define the grid on which overlap is
+        evaluated. Typically, this is an MNI-space template image.
+    rsn_file : str
+        File path to a 4D RSN reference image with one binary volume per
+        network.
+
+    Returns
+    -------
+    counts : ndarray
+        (n_parcels, n_networks) number of voxels of each parcel within each
+        network.
+    voxel_counts : ndarray
+        Number of voxels of each parcel.
+    """
+    import os
+    import hashlib
+    from filelock import SoftFileLock
+    from nilearn.image import resample_to_img
+
+    cache_path = None
+    if isinstance(parcel_list, str):
+        digest = hashlib.sha1()
+        digest.update(np.asarray(template_img.shape[:3],
+                                 dtype="int64").tobytes())
+        digest.update(np.asarray(template_img.affine,
+                                 dtype="float64").tobytes())
+        for file_ in [parcel_list, rsn_file]:
+            with open(file_, "rb") as f:
+                for chunk in iter(lambda: f.read(2 ** 20), b""):
+                    digest.update(chunk)
+        cache_path = f"{parcel_list.split('.nii')[0]}_rsnmembership_" \
+                     f"{digest.hexdigest()[:12]}.npz"
+        if os.path.isfile(cache_path):
+            with np.load(cache_path) as cached:
+                return cached["counts"], cached["voxel_counts"]
+
+    parcels = ParcelMembership.from_parcel_list(
+        parcel_list).resample_to_img(template_img)
+    rsn_data = np.asarray(resample_to_img(
+        nib.load(rsn_file), template_img,
+        interpolation="nearest").dataobj).astype("bool")
+    rsn_data = rsn_data.reshape(-1, rsn_data.shape[-1])
+    n_nets = rsn_data.shape[1]
+
+    rows = parcels._rows()
+    cols = parcels.matrix.indices
+    if np.max(np.sum(rsn_data, axis=1), initial=0) <= 1:
+        # Networks are disjoint, so each voxel carries a single network
+        # label, with n_nets for voxels outside every network
+        net = np.where(np.any(rsn_data, axis=1),
+                       np.argmax(rsn_data, axis=1), n_nets)
+        counts = np.bincount(rows * (n_nets + 1) + net[cols],
+                             minlength=len(parcels) * (n_nets + 1)
+                             ).reshape(-1, n_nets + 1)[:, :n_nets]
+    else:
+        counts = np.column_stack([
+            np.bincount(rows, weights=rsn_data[cols, k],
+                        minlength=len(parcels)).astype("int64")
+            for k in range(n_nets)])
+    voxel_counts = parcels.voxel_counts()
+
+    if cache_path is not None:
+        try:
+            with SoftFileLock(f"{cache_path}.lock", timeout=60):
+                tmp_path = f"{cache_path[:-len('.npz')]}.tmp.npz"
+                np.savez(tmp_path, counts=counts, voxel_counts=voxel_counts)
+                os.replace(tmp_path, cache_path)
+        except BaseException as e:
+            print(e, f"\nCould not cache the RSN membership of "
+                     f"{parcel_list}")
+
+    return counts, voxel_counts
+
+
 def get_node_membership(
         network,
         infile,
@@ -317,9 +1307,9 @@ def get_node_membership(
         List of string labels corresponding to ROI nodes.
     parc : bool
         Indicates whether to use parcels instead of coordinates as ROI nodes.
-    parcel_list : list
-        List of 3D boolean numpy arrays or binarized Nifti1Images
-        corresponding to ROI masks.
+    parcel_list : list or ParcelMembership
+        List of binarized Nifti1Images corresponding to ROI masks, a
+        ParcelMembership, or a file path to a label/4D parcel image.
     perc_overlap : float
         Value 0-1 indicating a threshold of spatial overlap to use as a
         spatial error cushion in the case of evaluating RSN membership from a
@@ -334,10 +1324,9 @@ def get_node_membership(
     coords_mm : list
         Filtered list of (x, y, z) tuples in mm-space with a spatial affinity
          for the specified RSN.
-    RSN_parcels : list
-        Filtered list of 3D boolean numpy arrays or binarized Nifti1Images
-         corresponding to ROI masks with a spatial affinity for the
-         specified RSN.
+    RSN_parcels : ParcelMembership
+        Filtered parcels, resampled to `infile`, with a spatial affinity for
+        the specified RSN.
     net_labels : list
         Filtered list of string labels corresponding to ROI nodes with a
         spatial affinity for the specified RSN.
@@ -360,10 +1349,9 @@ def get_node_membership(
     import pkg_resources
     import pandas as pd
     import sys
-    import tempfile
-    from nilearn.image import resample_to_img, index_img
-    from pynets.core.nodemaker import get_sphere, mmToVox, VoxTomm, \
-        create_parcel_atlas, gen_img_list
+    from nilearn.image import resample_to_img
+    from pynets.core.nodemaker import get_coords_mask_affinity, mmToVox, \
+        VoxTomm, ParcelMembership, network_membership_table
 
     if sys.platform.startswith('win') is False:
         try:
@@ -385,23 +1373,6 @@ def get_node_membership(
     y_vox = np.diagonal(bna_aff[:3, 0:3])[1]
     z_vox = np.diagonal(bna_aff[:3, 0:3])[2]
 
-    if parc is True:
-        if isinstance(parcel_list, str):
-            parcel_list_img = nib.load(parcel_list)
-            parcel_list = list([index_img(parcel_list_img, i) for i in
-                                range(parcel_list_img.shape[-1])])
-            parcel_atlas = create_parcel_atlas(parcel_list)[0]
-        else:
-            parcel_atlas = create_parcel_atlas(parcel_list)[0]
-        parcel_atlas_img_res = resample_to_img(
-            parcel_atlas, template_img, interpolation="nearest"
-        )
-        par_tmp = tempfile.NamedTemporaryFile(mode='w+', suffix='.nii.gz').name
-        nib.save(parcel_atlas_img_res, par_tmp)
-        parcel_list_res = gen_img_list(par_tmp)
-    else:
-        parcel_list_res = None
-
     # Determine whether input is from 17-networks or 7-networks
     seven_nets = [
         "Vis",
@@ -484,26 +1455,7 @@ def get_node_membership(
     dict_df.Region.unique().tolist()
     ref_dict = {v: k for v, k in enumerate(dict_df.Region.unique().tolist())}
 
-    if sys.platform.startswith('win') is False:
-        try:
-            rsn_img = nib.load(par_file)
-        except indexed_gzip.ZranError as e:
-            print(e,
-                  f"\nCannot load RSN reference image. Do you have git-lfs "
-                  f"installed?")
-    else:
-        try:
-            rsn_img = nib.load(par_file)
-        except ImportError as e:
-            print(e, f"\nCannot load RSN reference image. Do you have git-lfs "
-                  f"installed?")
-
-    rsn_img_res = resample_to_img(
-        rsn_img, template_img, interpolation="nearest"
-    )
-
     RSN_ix = list(ref_dict.keys())[list(ref_dict.values()).index(network)]
-    RSNmask = np.asarray(rsn_img_res.dataobj)[:, :, :, RSN_ix]
 
     coords_vox = []
     for i in coords:
@@ -515,67 +1467,63 @@ def get_node_membership(
 
     # coords_vox = list(set(list(tuple(x) for x in coords_vox)))
     if parc is False:
-        i = -1
+        if sys.platform.startswith('win') is False:
+            try:
+                rsn_img = nib.load(par_file)
+            except indexed_gzip.ZranError as e:
+                print(e,
+                      f"\nCannot load RSN reference image. Do you have "
+                      f"git-lfs installed?")
+        else:
+            try:
+                rsn_img = nib.load(par_file)
+            except ImportError as e:
+                print(e, f"\nCannot load RSN reference image. Do you have "
+                      f"git-lfs installed?")
+
+        rsn_img_res = resample_to_img(
+            rsn_img, template_img, interpolation="nearest"
+        )
+        RSNmask = np.asarray(rsn_img_res.dataobj)[:, :, :, RSN_ix]
+        rsn_img.uncache()
+
         RSN_parcels = None
         RSN_coords_vox = []
         net_labels = []
-        for coords in coords_vox:
-            sphere_vol = np.zeros(RSNmask.shape, dtype=bool)
-            sphere_vol[tuple(coords)] = 1
-            i = i + 1
-            if (RSNmask.astype("bool") & sphere_vol).any():
+        [in_mask, near_mask] = get_coords_mask_affinity(
+            coords_vox, RSNmask, error, (np.abs(x_vox), y_vox, z_vox))
+        for i, coords in enumerate(coords_vox):
+            if in_mask[i]:
                 print(f"{coords}{' coords falls within '}{network}{'...'}")
-                RSN_coords_vox.append(coords)
-                net_labels.append(labels[i])
-                continue
-            else:
-                inds = get_sphere(
-                    coords, error, (np.abs(x_vox), y_vox, z_vox), RSNmask.shape
+            elif near_mask[i]:
+                print(
+                    f"{coords} coords is within a + or - "
+                    f"{float(error):.2f} mm neighborhood of {network}..."
                 )
-                sphere_vol[tuple(inds.T)] = 1
-                if (RSNmask.astype("bool") & sphere_vol).any():
-                    print(
-                        f"{coords} coords is within a + or - "
-                        f"{float(error):.2f} mm neighborhood of {network}..."
-                    )
-                    RSN_coords_vox.append(coords)
-                    net_labels.append(labels[i])
+            else:
+                continue
+            RSN_coords_vox.append(coords)
+            net_labels.append(labels[i])
 
         coords_mm = []
         for i in RSN_coords_vox:
             coords_mm.append(VoxTomm(bna_aff, i))
         coords_mm = list(set(list(tuple(x) for x in coords_mm)))
     else:
-        i = 0
-        RSN_parcels = []
-        coords_with_parc = []
-        net_labels = []
-        for parcel in parcel_list_res:
-            parcel_vol = np.asarray(parcel.dataobj).astype('bool')
-
-            # Count number of unique voxels where overlap of parcel and mask
-            # occurs
-            overlap_count = len(
-                np.unique(
-                    np.where(
-                        (RSNmask.astype("uint16") == 1)
-                        & (parcel_vol.astype("uint16") == 1)
-                    )
-                )
-            )
-
-            # Count number of total unique voxels within the parcel
-            total_count = len(
-                np.unique(
-                    np.where(
-                        (parcel_vol.astype("uint16") == 1))))
-
-            # Calculate % overlap
-            if overlap_count > 0:
-                overlap = float(overlap_count / total_count)
-            else:
+        if not isinstance(parcel_list, str):
+            parcel_list = ParcelMembership.from_parcel_list(parcel_list)
+
+        # Fraction of each parcel's voxels falling within the RSN mask,
+        # looked up in the atlas' table of overlap with every network
+        counts, voxel_counts = network_membership_table(
+            parcel_list, template_img, par_file)
+        overlaps = np.divide(counts[:, RSN_ix], voxel_counts,
+                             out=np.zeros(len(voxel_counts)),
+                             where=voxel_counts > 0)
+        keep = []
+        for i, overlap in enumerate(overlaps):
+            if overlap == 0:
                 print(f"No overlap of parcel {i} with rsn mask...")
-                i += 1
                 continue
 
             if overlap >= perc_overlap:
@@ -583,13 +1531,13 @@ def get_node_membership(
                     f"{100 * overlap:.2f}% of parcel {labels[i]} falls within"
                     f" {str(network)} mask..."
                 )
-                RSN_parcels.append(parcel)
-                coords_with_parc.append(coords[i])
-                net_labels.append(labels[i])
-            i += 1
+                keep.append(i)
+        RSN_parcels = ParcelMembership.from_parcel_list(
+            parcel_list)[keep].resample_to_img(template_img)
+        coords_with_parc = [coords[i] for i in keep]
+        net_labels = [labels[i] for i in keep]
         coords_mm = list(set(list(tuple(x) for x in coords_with_parc)))
 
-    rsn_img.uncache()
     template_img.uncache()
 
     if len(coords_mm) <= 1:
@@ -598,7 +1546,7 @@ def get_node_membership(
             f" {network} network."
         )
 
-    if RSN_parcels:
+    if RSN_parcels is not None:
         assert len(coords_mm) == len(net_labels) == len(RSN_parcels)
     else:
         assert len(coords_mm) == len(net_labels)
@@ -619,7 +1567,7 @@ def drop_badixs_from_parcellation(uatlas, bad_idxs):
     parlist_img_data = parcellation_img.get_fdata()
     for val in bad_idxs:
         print(f"Removing: {str(val)}...")
-        parlist_img_data[np.where(parlist_img_data == val)] = 0
+    parlist_img_data[np.isin(parlist_img_data, bad_idxs)] = 0
 
     parcellation = fname_presuffix(
         uatlas, suffix="_pruned",
@@ -629,7 +1577,8 @@ def drop_badixs_from_parcellation(uatlas, bad_idxs):
                         affine=parcellation_img.affine),
         parcellation)
 
-    print(f"{len(np.unique(parlist_img_data))} parcels remaining")
+    print(f"{len(label_inventory(parcellation)['labels'])} parcels "
+          f"remaining")
     parcellation = enforce_hem_distinct_consecutive_labels(parcellation)[0]
     return parcellation
 
@@ -655,9 +1604,9 @@ def parcel_masker(
         List of (x, y, z) tuples in mm-space corresponding to a coordinate
         atlas used or which represent the center-of-mass of each
         parcellation node.
-    parcel_list : list
-        List of 3D boolean numpy arrays or binarized Nifti1Images corresponding
-         to ROI masks.
+    parcel_list : list or ParcelMembership
+        List of binarized Nifti1Images corresponding to ROI masks, a
+        ParcelMembership, or a file path to a label/4D parcel image.
     labels : list
         List of string labels corresponding to ROI nodes.
     dir_path : str
@@ -677,15 +1626,12 @@ def parcel_masker(
     labels_adj : list
         Filtered list of string labels corresponding to ROI nodes with a
         spatial affinity for the specified ROI mask.
-    parcel_list_adj : list
-        Filtered list of 3D boolean numpy arrays or binarized Nifti1Images
-        corresponding to ROI masks with a spatial affinity to the specified
-        ROI mask.
+    parcel_list_adj : ParcelMembership
+        Filtered parcels with a spatial affinity to the specified ROI mask.
     """
     from nilearn.image import resample_to_img
     from nilearn.image import math_img
-    from nilearn.image import index_img
-    import types
+    from pynets.core.nodemaker import ParcelMembership
     from pynets.core.utils import load_runconfig
     import pkg_resources
     import sys
@@ -724,47 +1670,19 @@ def parcel_masker(
 
     mask_data = mask_img_res.get_fdata().astype('bool')
 
-    if isinstance(parcel_list, types.GeneratorType):
-        parcel_list = [i for i in parcel_list]
-    elif isinstance(parcel_list, str):
-        parcel_list_img = nib.load(parcel_list)
-        parcel_list = [index_img(parcel_list_img, i) for i in
-                       range(parcel_list_img.shape[-1])]
+    parcel_list = ParcelMembership.from_parcel_list(parcel_list)
 
-    i = 0
-    indices = []
-    for parcel in parcel_list:
-        parcel = resample_to_img(parcel, template_img, interpolation='nearest')
-        # Count number of unique voxels where overlap of parcel and mask occurs
-        overlap_count = len(
-            np.unique(
-                np.where(
-                    (mask_data.astype("uint16") == 1)
-                    & (np.asarray(parcel.dataobj
-                                  ).astype('bool').astype("uint16") == 1)
-                )
-            )
-        )
+    # Fraction of each parcel's voxels falling within the mask, evaluated
+    # for all parcels at once on the template grid
+    overlaps = parcel_list.resample_to_img(template_img).overlap(mask_data)
 
-        # Count number of total unique voxels within the parcel
-        total_count = len(
-            np.unique(
-                np.where(
-                    (np.asarray(parcel.dataobj
-                                ).astype('bool').astype("uint16") == 1)
-                )
-            )
-        )
-
-        # Calculate % overlap
-        if overlap_count > 0:
-            overlap = float(overlap_count / total_count)
-        else:
+    indices = []
+    for i, overlap in enumerate(overlaps):
+        if overlap == 0:
             print(
                 f"No overlap of parcel {labels[i]} with roi"
                 f" mask...")
             indices.append(i)
-            i += 1
             continue
 
         if overlap >= perc_overlap:
@@ -774,20 +1692,13 @@ def parcel_masker(
             )
         else:
             indices.append(i)
-        i += 1
 
     labels_adj = list(labels)
     coords_adj = list(tuple(x) for x in coords)
-    parcel_list_adj = parcel_list
-    try:
-        for ix in sorted(indices, reverse=True):
-            print(f"{'Removing: '}{labels_adj[ix]}{' at '}{coords_adj[ix]}")
-            del labels_adj[ix], coords_adj[ix], parcel_list_adj[ix]
-    except RuntimeError as e:
-        print(e,
-              "Restrictive masking. No parcels remain after masking with"
-              " brain mask/roi..."
-              )
+    for ix in sorted(indices, reverse=True):
+        print(f"{'Removing: '}{labels_adj[ix]}{' at '}{coords_adj[ix]}")
+        del labels_adj[ix], coords_adj[ix]
+    parcel_list_adj = parcel_list.drop(indices)
 
     if not coords_adj:
         raise ValueError(
@@ -831,7 +1742,7 @@ def coords_masker(roi, coords, labels, error, vox_size='2mm'):
     """
     import nibabel as nib
     from nilearn.image import math_img
-    from pynets.core.nodemaker import mmToVox
+    from pynets.core.nodemaker import mmToVox, get_coords_mask_affinity
     import pkg_resources
     import sys
     from nilearn.image import resample_to_img
@@ -886,29 +1797,19 @@ def coords_masker(roi, coords, labels, error, vox_size='2mm'):
         for x in coords_vox
     )
     # coords_vox = list(set(list(tuple(x) for x in coords_vox)))
-    bad_coords = []
-    for coord_vox in coords_vox:
-        sphere_vol = np.zeros(mask_data.shape, dtype=bool)
-        sphere_vol[tuple(coord_vox)] = 1
-        if (mask_data & sphere_vol).any():
+    [in_mask, near_mask] = get_coords_mask_affinity(
+        coords_vox, mask_data, error, (np.abs(x_vox), y_vox, z_vox))
+    indices = []
+    for i, coord_vox in enumerate(coords_vox):
+        if in_mask[i]:
             print(f"{coord_vox}{' falls within mask...'}")
-            continue
-        inds = get_sphere(
-            coord_vox, error, (np.abs(x_vox), y_vox, z_vox), mask_data.shape
-        )
-        sphere_vol[tuple(inds.T)] = 1
-        if (mask_data & sphere_vol).any():
+        elif near_mask[i]:
             print(
                 f"{coord_vox}{' is within a + or - '}{float(error):.2f} mm"
                 f" neighborhood..."
             )
-            continue
-        bad_coords.append(coord_vox)
-
-    bad_coords = [x for x in bad_coords if x is not None]
-    indices = []
-    for bad_coords in bad_coords:
-        indices.append(coords_vox.index(bad_coords))
+        else:
+            indices.append(i)
 
     labels = list(labels)
     coords = list(tuple(x) for x in coords)
@@ -975,6 +1876,159 @@ def get_names_and_coords_of_parcels(uatlas, background_label=0):
     return coords, atlas, par_max, label_intensities
 
 
+def label_statistics(labels_data, affine=np.eye(4), background_label=0):
+    """
+    Inventory of the labels of a 3D parcellation array.
+
+    Voxel counts, centroids, and bounding boxes of every label are computed
+    with `np.bincount` on an integer view of the volume, in a single pass
+    over the labeled voxels.
+
+    Parameters
+    ----------
+    labels_data : ndarray
+        3D array of label intensities.
+    affine : ndarray
+        4x4 voxel-to-mm affine of `labels_data`. Default is the identity.
+    background_label : int
+        Intensity of the background. Default is 0.
+
+    Returns
+    -------
+    inventory : dict
+        'labels', the sorted non-background label intensities; 'counts', the
+        number of voxels of each label; 'centroids', the (n_labels, 3)
+        center-of-mass of each label in mm-space; and 'bboxes', the
+        (n_labels, 2, 3) first and last voxel indices spanned by each label.
+    """
+    labels_data = np.asarray(labels_data)
+    if labels_data.dtype.kind not in "iu" or labels_data.dtype == "uint64":
+        labels_data = np.around(labels_data).astype("int64")
+    shape = labels_data.shape[:3]
+    flat = labels_data.ravel()
+
+    offset = min(int(flat.min()), 0) if flat.size > 0 else 0
+    counts = np.bincount(flat - offset if offset < 0 else flat)
+    if 0 <= background_label - offset < len(counts):
+        counts[background_label - offset] = 0
+    labels = np.flatnonzero(counts)
+    lut = np.zeros(len(counts), dtype="int64")
+    lut[labels] = np.arange(len(labels))
+    counts = counts[labels]
+    labels = labels + offset
+
+    vox = np.flatnonzero(flat != background_label)
+    ix = lut[flat[vox] - offset]
+    com = np.zeros((len(labels), 3))
+    bboxes = np.zeros((len(labels), 2, 3), dtype="int64")
+    for ax, (coord, dim) in enumerate(zip(np.unravel_index(vox, shape),
+                                          shape)):
+        # Histogram of each label along this axis
+        hist = np.bincount(ix * dim + coord,
+                           minlength=len(labels) * dim).reshape(-1, dim)
+        com[:, ax] = np.dot(hist, np.arange(dim)) / np.maximum(counts, 1)
+        bboxes[:, 0, ax] = np.argmax(hist > 0, axis=1)
+        bboxes[:, 1, ax] = dim - 1 - np.argmax(hist[:, ::-1] > 0, axis=1)
+
+    return {
+        "labels": labels,
+        "counts": counts,
+        "centroids": nib.affines.apply_affine(affine, com),
+        "bboxes": bboxes,
+    }
+
+
+def label_inventory(uatlas, background_label=0, labels_data=None,
+                    cache_dir=None):
+    """
+    Cached inventory of the labels of a 3D parcellation image.
+
+    The inventory (see `label_statistics`) is stored in a cache directory of
+    the local atlas library under a digest of the image file, so that it is
+    computed once and then reused by registration, node generation, and
+    graph construction. Nothing is written next to the image. If the cache
+    directory is not writable, the inventory is computed in memory.
+
+    Parameters
+    ----------
+    uatlas : str
+        File path to atlas parcellation Nifti1Image.
+    background_label : int
+        Intensity of the background. Default is 0.
+    labels_data : ndarray
+        Optional label array already loaded from `uatlas`, used instead of
+        reading the image again when the inventory is not cached.
+    cache_dir : str
+        Directory of the cache. Default is `label_inventory` under the
+        versioned root of the atlas library (see `atlas_library_dir`).
+
+    Returns
+    -------
+    inventory : dict
+        'labels', 'counts', 'centroids', and 'bboxes' of the parcellation.
+    """
+    import os
+    import hashlib
+    from filelock import SoftFileLock
+
+    digest = hashlib.sha1(str(int(background_label)).encode())
+    with open(uatlas, "rb") as f:
+        for chunk in iter(lambda: f.read(2 ** 20), b""):
+            digest.update(chunk)
+    key = digest.hexdigest()
+
+    if cache_dir is None:
+        # Shared across templates and resolutions of the library
+        library_root = os.path.dirname(os.path.dirname(atlas_library_dir()))
+        cache_dir = f"{library_root}/label_inventory"
+    cache_path = f"{cache_dir}/{key}.npz"
+
+    if os.path.isfile(cache_path):
+        try:
+            with np.load(cache_path) as cached:
+                return {i: cached[i] for i in
+                        ["labels", "counts", "centroids", "bboxes"]}
+        except BaseException:
+            pass
+
+    img = nib.load(uatlas)
+    if labels_data is None:
+        labels_data = np.asarray(img.dataobj)
+    inventory = label_statistics(labels_data, img.affine,
+                                 background_label=background_label)
+    img.uncache()
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with SoftFileLock(f"{cache_path}.lock", timeout=60):
+            tmp_path = f"{cache_dir}/{key}.{os.getpid()}.tmp.npz"
+            np.savez(tmp_path, **inventory)
+            os.replace(tmp_path, cache_path)
+    except BaseException as e:
+        # Computed in memory when the cache is not writable
+        print(e, f"\nCould not cache the label inventory of {uatlas}")
+
+    return inventory
+
+    img = nib.load(uatlas)
+    if labels_data is None:
+        labels_data = np.asarray(img.dataobj)
+    inventory = label_statistics(labels_data, img.affine,
+                                 background_label=background_label)
+    img.uncache()
+
+    try:
+        with SoftFileLock(f"{cache_path}.lock", timeout=60):
+            tmp_path = f"{base}_labels.tmp.npz"
+            np.savez(tmp_path, key=key, **inventory)
+            os.replace(tmp_path, cache_path)
+    except BaseException as e:
+        # Read-only atlas directories are not cached
+        print(e, f"\nCould not cache the label inventory of {uatlas}")
+
+    return inventory
+
+
 def gen_img_list(uatlas):
     """
     Return list of boolean nifti masks where each masks corresponds to a unique
@@ -989,45 +2043,18 @@ def gen_img_list(uatlas):
     Returns
     -------
     img_list : Iterator of NiftiImages
-        List of binarized Nifti1Images corresponding to ROI masks for each
-        unique atlas label.
+        Lazily-generated binarized Nifti1Images corresponding to ROI masks for
+        each unique atlas label.
     """
-    import sys
-    import gc
-    from nilearn.image import iter_img
     import os.path as op
-    from nilearn.image import new_img_like
+    from pynets.core.nodemaker import ParcelMembership
 
     if not op.isfile(uatlas):
         raise ValueError(
             "\nUser-specified atlas input not found! Check that the"
             " file(s) specified with the -ua flag exist(s)")
 
-    bna_img = nib.load(uatlas)
-    bna_data = np.around(np.asarray(bna_img.dataobj)).astype("uint16")
-
-    # Get an array of unique parcels
-    bna_data_for_coords_uniq = np.unique(bna_data)
-
-    # Number of parcels:
-    par_max = len(bna_data_for_coords_uniq) - 1
-    img_stack = []
-    for idx in range(1, par_max + 1):
-        roi_img = bna_data.astype("uint16") == \
-            bna_data_for_coords_uniq[idx].astype("uint16")
-        img_stack.append(roi_img.astype("uint16"))
-    img_stack = np.array(img_stack)
-
-    img_list = []
-    for idy in range(par_max):
-        img_list.append(new_img_like(bna_img, img_stack[idy]))
-
-    del img_stack
-
-    bna_img.uncache()
-    gc.collect()
-
-    return iter_img(img_list)
+    return ParcelMembership.from_img(uatlas).iter_imgs()
 
 
 def enforce_hem_distinct_consecutive_labels(uatlas, label_names=None,
@@ -1050,55 +2077,51 @@ def enforce_hem_distinct_consecutive_labels(uatlas, label_names=None,
     label_names : list
         List of string label names corresponding to ROI nodes.
     """
+    from scipy.sparse import csr_matrix
     from nilearn.image.resampling import coord_transform
-    from nilearn.image import new_img_like, reorder_img
+    from nilearn.image import reorder_img
+    from pynets.core.nodemaker import ParcelMembership
 
     labels_img = reorder_img(nib.load(uatlas))
-    labels_data = labels_img.get_fdata()
-    labels_affine = labels_img.affine
-
-    # Grab number of unique values in 3d image
-    unique_labels = set(np.unique(labels_data)) - set([background_label])
-    x, y, z = coord_transform(0, 0, 0, np.linalg.inv(labels_affine))
-    new_labs = []
-    if label_names is not None:
-        new_lab_names = []
-    ix = 0
-    for lab in unique_labels:
-        cur_dat = labels_data == lab
-        left_lab = cur_dat.copy()
-        right_lab = cur_dat.copy()
-
-        # Grab hemispheres separately
-        left_hemi = labels_data.copy() == lab
-        right_hemi = labels_data.copy() == lab
-        left_hemi[int(x):] = 0
-        right_hemi[:int(x)] = 0
-
-        # Two connected components in both hemispheres
-        if not np.all(left_hemi == False) or np.all(right_hemi == False):
-            left_lab[int(x):] = 0
-            right_lab[:int(x)] = 0
-            new_labs.append(left_lab)
-            new_labs.append(right_lab)
-            if label_names is not None:
-                new_lab_names.append(f"{label_names[ix]}_Left")
-                new_lab_names.append(f"{label_names[ix]}_Right")
-        else:
-            new_labs.append(cur_dat)
-            if label_names is not None:
-                new_lab_names.append(label_names[ix])
-        del left_lab, right_lab, left_hemi, right_hemi
-
-    del labels_data
-
-    img_list = [new_img_like(labels_img, i) for i in new_labs]
+    labels_data = np.asarray(labels_img.dataobj)
+    x, y, z = coord_transform(0, 0, 0, np.linalg.inv(labels_img.affine))
+
+    # Grab unique values in 3d image, and the hemisphere of each labeled voxel
+    vox = np.flatnonzero(labels_data != background_label)
+    unique_labels, lab_ix = np.unique(labels_data.ravel()[vox],
+                                      return_inverse=True)
+    lab_ix = lab_ix.ravel()
+    right = np.unravel_index(vox, labels_data.shape)[0] >= int(x)
+    in_left = np.bincount(lab_ix, weights=~right,
+                          minlength=len(unique_labels)) > 0
+    in_right = np.bincount(lab_ix, weights=right,
+                           minlength=len(unique_labels)) > 0
+
+    # Labels are visited in set order, and every label other than those
+    # found only in the right hemisphere is given a left and a right parcel
+    # (the latter possibly empty).
+    all_labels = unique_labels if len(vox) == labels_data.size else \
+        np.union1d(unique_labels, [background_label])
+    order = np.searchsorted(unique_labels, np.array(
+        list(set(all_labels) - set([background_label])),
+        dtype=unique_labels.dtype)).astype("int64")
+    split = np.zeros(len(unique_labels), dtype=bool)
+    split[order] = in_left[order] | ~in_right[order]
+    n_parcels = np.zeros(len(unique_labels), dtype="int64")
+    n_parcels[order] = 1 + split[order]
+    first = np.zeros(len(unique_labels), dtype="int64")
+    first[order] = np.cumsum(n_parcels[order]) - n_parcels[order]
+
+    rows = first[lab_ix] + (split[lab_ix] & right)
+    parcel_list = ParcelMembership(
+        csr_matrix((np.ones(len(vox), dtype=bool), (rows, vox)),
+                   shape=(int(np.sum(n_parcels)), labels_data.size)),
+        labels_img.affine, labels_data.shape)
 
     # Enforce consecutive labelings
-    atlas_img_corr = create_parcel_atlas(img_list)[0]
-    nib.save(atlas_img_corr, uatlas)
+    nib.save(parcel_list.to_img(), uatlas)
 
-    del img_list, atlas_img_corr, new_labs, labels_img
+    del labels_data, parcel_list, labels_img
     return uatlas, label_names
 
 
@@ -1111,8 +2134,7 @@ def drop_coords_labels_from_restricted_parcellation(parcellation, coords,
     print('Checking parcellation for consistency...')
 
     parcellation_img = nib.load(parcellation)
-    intensities = [i for i in list(np.unique(
-        np.asarray(parcellation_img.dataobj).astype("int"))) if i != 0]
+    intensities = list(label_inventory(parcellation)["labels"])
 
     # Correct coords and labels
     # bad_idxs = missing_elements(intensities)
@@ -1151,8 +2173,7 @@ def drop_coords_labels_from_restricted_parcellation(parcellation, coords,
                                 affine=parcellation_img.affine),
                 parcellation)
 
-            intensity_count = len([i for i in np.unique(
-                parlist_img_data.astype("int")) if str(i) != '0'])
+            intensity_count = len(label_inventory(parcellation)["labels"])
         else:
             intensity_count = len(intensities)
     else:
@@ -1193,35 +2214,24 @@ def gen_network_parcels(uatlas, network, labels, dir_path):
     out_path : str
         File path to a new, RSN-filtered atlas parcellation Nifti1Image.
     """
-    import gc
-    import sys
-    from nilearn.image import concat_imgs
-    from pynets.core import nodemaker
     import os.path as op
+    from pynets.core.nodemaker import ParcelMembership
 
     if not op.isfile(uatlas):
         raise ValueError(
             "\nUser-specified atlas input not found! Check that "
             "the file(s) specified with the -ua flag exist(s)")
 
-    img_list = nodemaker.gen_img_list(uatlas)
+    parcels = ParcelMembership.from_img(uatlas)
     print(
         f"\nExtracting parcels associated with {network} "
         f"network locations...\n")
-    net_parcels = [i for j, i in enumerate(img_list) if j in labels]
-    net_parcels_concatted = concat_imgs(net_parcels)
-    net_parcels_sum = np.sum(
-        (np.array(range(len(net_parcels))) + 1)
-        * np.asarray(net_parcels_concatted.dataobj),
-        axis=3,
-        dtype=np.uint16,
-    )
+    net_parcels = parcels[[j for j in range(len(parcels)) if j in labels]]
     out_path = f"{dir_path}" \
                f"/{op.basename(uatlas).split(op.splitext(uatlas)[1])[0]}_" \
                f"{network}_parcels.nii.gz"
-    nib.save(nib.Nifti1Image(net_parcels_sum, affine=np.eye(4)), out_path)
-    del net_parcels_concatted, img_list
-    gc.collect()
+    nib.save(net_parcels.to_img(np.arange(1, len(net_parcels) + 1)),
+             out_path)
 
     return out_path
 
@@ -1261,11 +2271,62 @@ def parcel_naming(coords, vox_size):
       NeuroImage. 15 (1): 273–289. doi:10.1006/nimg.2001.0978.
 
     """
+    labeling_atlases, data, affine, luts = load_labeling_atlases(vox_size)
+
+    # Look up every coordinate in every labeling atlas at once
+    coords_vox = np.round(mmToVox(affine, np.asarray(coords, dtype="float64"
+                                                     ).reshape(-1, 3)))
+    coords_vox = coords_vox.astype("int64")
+    inside = np.all((coords_vox >= 0) & (coords_vox < data.shape[1:]),
+                    axis=1)
+    intensities = np.zeros((len(labeling_atlases), len(coords_vox)),
+                           dtype="int64")
+    intensities[:, inside] = data[(slice(None),) + tuple(coords_vox[inside].T)]
+
+    names = [np.where(inside, lut[intensity], "Unlabeled")
+             for lut, intensity in zip(luts, intensities)]
+    labels = [dict(zip(labeling_atlases, i)) for i in zip(*names)]
+
+    assert len(labels) == len(coords)
+
+    return labels
+
+
+def load_labeling_atlases(vox_size, library_dir=None):
+    """
+    Load the labeling atlases of runconfig.yaml resampled to the template,
+    stacked into a single integer array, with a lookup table of label names
+    for each.
+
+    The stack is computed once per template and resolution and cached in the
+    atlas library (see `atlas_library_dir`), from which it is memory-mapped.
+
+    Parameters
+    ----------
+    vox_size : str
+        Voxel resolution (`1mm` or `2mm` stored as strings with units).
+    library_dir : str
+        Root of the atlas library. See `atlas_library_dir`.
+
+    Returns
+    -------
+    labeling_atlases : list
+        Names of the labeling atlases.
+    data : ndarray
+        (n_atlases, x, y, z) array of label intensities on the template grid.
+    affine : ndarray
+        4x4 voxel-to-mm affine of the template.
+    luts : list
+        Array of label names indexed by intensity for each labeling atlas,
+        with 'Unlabeled' for intensities without a name.
+    """
+    import os
     import sys
+    import pickle
+    import hashlib
     import pkg_resources
     import pandas as pd
-    import nibabel as nib
-    from collections import defaultdict
+    from filelock import SoftFileLock
     from nilearn.image import resample_to_img
     from pynets.core.utils import load_runconfig
 
@@ -1283,95 +2344,77 @@ def parcel_naming(coords, vox_size):
               "No template specified in runconfig.yaml"
               )
 
-    template_brain = pkg_resources.resource_filename(
-        "pynets", f"templates/{template_name}_brain_{vox_size}.nii.gz"
-    )
+    cache_dir = atlas_library_dir(vox_size, library_dir)
+    key = hashlib.sha1("\0".join(labeling_atlases).encode()).hexdigest()
+    cache_path = f"{cache_dir}/labeling_atlases_{key[:12]}"
+    os.makedirs(cache_dir, exist_ok=True)
 
-    if sys.platform.startswith('win') is False:
-        try:
-            template_img = nib.load(template_brain)
-        except indexed_gzip.ZranError as e:
-            print(e,
-                  f"\nCannot load MNI template. Do you have git-lfs "
-                  f"installed?")
-    else:
-        try:
-            template_img = nib.load(template_brain)
-        except ImportError as e:
-            print(e, f"\nCannot load MNI template. Do you have git-lfs "
-                  f"installed?")
+    with SoftFileLock(f"{cache_path}.lock"):
+        if os.path.isfile(f"{cache_path}.pkl"):
+            with open(f"{cache_path}.pkl", "rb") as f:
+                [affine, luts] = pickle.load(f)
+            data = np.load(f"{cache_path}.npy", mmap_mode="r")
+            return labeling_atlases, data, affine, luts
 
-    coords_vox = []
-    for i in coords:
-        coords_vox.append(mmToVox(template_img.affine, i))
-    coords_vox = list(
-        tuple(map(lambda y: isinstance(y, float) and int(round(y, 0)), x))
-        for x in coords_vox
-    )
-
-    label_img_dict = defaultdict()
-    for label_atlas in labeling_atlases:
-        label_img_dict[label_atlas] = {}
-        label_path = pkg_resources.resource_filename("pynets",
-                                                     f"/core/labelcharts/"
-                                                     f"{label_atlas}.txt")
-        label_img_path = pkg_resources.resource_filename("pynets",
-                                                         f"/core/atlases/"
-                                                         f"{label_atlas}"
-                                                         f".nii.gz")
-
-        label_img = nib.load(label_img_path)
-
-        label_img_res = resample_to_img(
-            label_img, template_img, interpolation="nearest", copy=False
+        template_brain = pkg_resources.resource_filename(
+            "pynets", f"templates/{template_name}_brain_{vox_size}.nii.gz"
         )
-        label_img_dict[label_atlas]['affine'] = label_img_res.affine
-        label_img_dict[label_atlas]['data'] = np.asarray(
-            label_img_res.dataobj, dtype='uint8')
-        df = pd.read_csv(label_path, sep=' ', names=['region_index', 'label'])
-        if df['label'].isna().all():
-            df = pd.read_csv(label_path, names=['label'])
-            df = df[(df.label != 'Background')]
-            df['region_index'] = np.arange(1, len(df) + 1)
-        df = df[~((df.label == 'Background') & (df.region_index == 0))]
-        df = df[~((df.label == 'Unknown') & (df.region_index == 0))]
-        label_img_dict[label_atlas]['reference'] = df
-
-    # Create a consensus labeling dictionary
-    label_dict = defaultdict()
-    for coord in coords_vox:
-        label_dict[coord] = {}
-        for label_atlas in label_img_dict.keys():
-            label_dict[coord][label_atlas] = {}
-            label_dict[coord][label_atlas]['intensity'] = label_img_dict[
-                label_atlas]['data'][coord]
-            df_ref = label_img_dict[label_atlas]['reference']
-            try:
-                label_dict[
-                    coord][
-                    label_atlas][
-                    'label'] = df_ref.loc[
-                    df_ref[
-                        'region_index'] ==
-                    int(label_dict[coord][label_atlas][
-                        'intensity'])]['label'].values[0]
-            except BaseException:
-                label_dict[coord][label_atlas]['label'] = "Unlabeled"
 
-    labels = []
-    for coord in label_dict.keys():
-        coord_dict = {}
-        for atlas, i in list(zip(label_dict[coord].keys(),
-                                 label_dict[coord].values())):
+        if sys.platform.startswith('win') is False:
             try:
-                coord_dict[atlas] = i['label']
-            except BaseException:
-                continue
-        labels.append(coord_dict)
-
-    assert len(labels) == len(coords)
-
-    return labels
+                template_img = nib.load(template_brain)
+            except indexed_gzip.ZranError as e:
+                print(e,
+                      f"\nCannot load MNI template. Do you have git-lfs "
+                      f"installed?")
+        else:
+            try:
+                template_img = nib.load(template_brain)
+            except ImportError as e:
+                print(e, f"\nCannot load MNI template. Do you have git-lfs "
+                      f"installed?")
+
+        data = np.zeros((len(labeling_atlases),) + template_img.shape[:3],
+                        dtype="uint16")
+        luts = []
+        for i, label_atlas in enumerate(labeling_atlases):
+            label_path = pkg_resources.resource_filename(
+                "pynets", f"/core/labelcharts/{label_atlas}.txt")
+            label_img_path = pkg_resources.resource_filename(
+                "pynets", f"/core/atlases/{label_atlas}.nii.gz")
+
+            label_img_res = resample_to_img(
+                nib.load(label_img_path), template_img,
+                interpolation="nearest", copy=False
+            )
+            data[i] = np.around(np.asarray(label_img_res.dataobj))
+
+            df = pd.read_csv(label_path, sep=' ',
+                             names=['region_index', 'label'])
+            if df['label'].isna().all():
+                df = pd.read_csv(label_path, names=['label'])
+                df = df[(df.label != 'Background')]
+                df['region_index'] = np.arange(1, len(df) + 1)
+            df = df[~((df.label == 'Background') & (df.region_index == 0))]
+            df = df[~((df.label == 'Unknown') & (df.region_index == 0))]
+            index = pd.to_numeric(df['region_index'], errors='coerce')
+            df = df[(index >= 0) & (index <= np.iinfo("uint16").max)]
+            index = index.loc[df.index].astype("int64").values
+
+            # The first entry of an intensity names it
+            lut = np.full(int(max(index.max(initial=0),
+                                  data[i].max())) + 1, "Unlabeled",
+                          dtype=object)
+            lut[index[::-1]] = df['label'].values[::-1]
+            luts.append(lut)
+
+        np.save(f"{cache_path}.tmp.npy", data)
+        os.replace(f"{cache_path}.tmp.npy", f"{cache_path}.npy")
+        with open(f"{cache_path}.pkl.tmp", "wb") as f:
+            pickle.dump([template_img.affine, luts], f, protocol=2)
+        os.replace(f"{cache_path}.pkl.tmp", f"{cache_path}.pkl")
+
+    return labeling_atlases, data, template_img.affine, luts
 
 
 def get_brainnetome_node_attributes(node_files, emb_shape):
@@ -1577,9 +2620,9 @@ def node_gen_masking(
         List of (x, y, z) tuples in mm-space corresponding to a coordinate
         atlas used or which represent the center-of-mass of each
         parcellation node.
-    parcel_list : list
-        List of 3D boolean numpy arrays or binarized Nifti1Images corresponding
-         to ROI masks.
+    parcel_list : list or ParcelMembership
+        List of binarized Nifti1Images corresponding to ROI masks, a
+        ParcelMembership, or a file path to a label/4D parcel image.
     labels : list
         List of string labels corresponding to ROI nodes.
     dir_path : str
@@ -1623,13 +2666,9 @@ def node_gen_masking(
     dir_path : str
         Path to directory containing subject derivative data for given run.
     """
-    from nilearn.image import index_img
     from pynets.core import nodemaker
 
-    if isinstance(parcel_list, str):
-        parcel_list_img = nib.load(parcel_list)
-        parcel_list = [index_img(parcel_list_img, i) for i in
-                       range(parcel_list_img.shape[-1])]
+    parcel_list = nodemaker.ParcelMembership.from_parcel_list(parcel_list)
 
     # For parcel masking, specify overlap thresh and error cushion in mm voxels
     [coords, labels, parcel_list_masked] = nodemaker.parcel_masker(
@@ -1649,8 +2688,8 @@ def node_gen_masking(
     assert (
         len(coords)
         == len(labels)
-        == len([i for i in np.unique(np.asarray(net_parcels_map_nifti.dataobj)
-                                     ) if i != 0])
+        == len(nodemaker.label_statistics(
+            np.asarray(net_parcels_map_nifti.dataobj))["labels"])
     )
 
     return net_parcels_map_nifti, coords, labels, atlas, uatlas, dir_path
@@ -1667,9 +2706,9 @@ def node_gen(coords, parcel_list, labels, dir_path, ID, parc, atlas, uatlas):
         List of (x, y, z) tuples in mm-space corresponding to a coordinate
         atlas used or which represent the center-of-mass of each
         parcellation node.
-    parcel_list : list
-        List of 3D boolean numpy arrays or binarized Nifti1Images corresponding
-         to ROI masks.
+    parcel_list : list or ParcelMembership
+        List of binarized Nifti1Images corresponding to ROI masks, a
+        ParcelMembership, or a file path to a label/4D parcel image.
     labels : list
         List of string labels corresponding to ROI nodes.
     dir_path : str
@@ -1705,13 +2744,9 @@ def node_gen(coords, parcel_list, labels, dir_path, ID, parc, atlas, uatlas):
     dir_path : str
         Path to directory containing subject derivative data for given run.
     """
-    from nilearn.image import index_img
     from pynets.core import nodemaker
 
-    if isinstance(parcel_list, str):
-        parcel_list_img = nib.load(parcel_list)
-        parcel_list = [index_img(parcel_list_img, i) for i in
-                       range(parcel_list_img.shape[-1])]
+    parcel_list = nodemaker.ParcelMembership.from_parcel_list(parcel_list)
 
     if any(isinstance(sub, tuple) for sub in labels):
         label_intensities = [i[1] for i in labels]
@@ -1728,8 +2763,8 @@ def node_gen(coords, parcel_list, labels, dir_path, ID, parc, atlas, uatlas):
     assert (
         len(coords)
         == len(labels)
-        == len([i for i in np.unique(np.asarray(net_parcels_map_nifti.dataobj)
-                                     ) if i != 0])
+        == len(nodemaker.label_statistics(
+            np.asarray(net_parcels_map_nifti.dataobj))["labels"])
     )
 
     return net_parcels_map_nifti, coords, labels, atlas, uatlas, dir_path
@@ -1812,9 +2847,10 @@ def create_spherical_roi_volumes(node_size, coords, template_mask):
 
     Returns
     -------
-    parcel_list : list
-        List of 3D boolean numpy arrays or binarized Nifti1Images corresponding
-         to ROI masks.
+    parcel_list : ParcelMembership
+        Spherical ROI masks, one (possibly overlapping) parcel per unique
+        coordinate in input order. Voxels in the intersection of all spheres
+        are excluded.
     par_max : int
         The maximum label intensity in the parcellation image.
     node_size : int
@@ -1824,13 +2860,13 @@ def create_spherical_roi_volumes(node_size, coords, template_mask):
         Indicates whether to use the raw parcels as ROI nodes instead of
         coordinates at their center-of-mass.
     """
-    from pynets.core.nodemaker import get_sphere, mmToVox
-    from nilearn.masking import intersect_masks
-    from nilearn.image import iter_img
+    from scipy.sparse import csr_matrix
+    from pynets.core.nodemaker import get_spheres, mmToVox, \
+        ParcelMembership
 
     mask_img = nib.load(template_mask)
     mask_aff = mask_img.affine
-    mask_shape = mask_img.shape
+    mask_shape = mask_img.shape[:3]
     mask_img.uncache()
 
     print(f"Creating spherical ROI atlas with radius: {node_size}")
@@ -1838,43 +2874,27 @@ def create_spherical_roi_volumes(node_size, coords, template_mask):
     coords_vox = []
     for i in coords:
         coords_vox.append(mmToVox(mask_aff, i))
-    coords_vox = list(set(list(tuple(x) for x in coords_vox)))
+    coords_vox = list(dict.fromkeys(tuple(x) for x in coords_vox))
 
     x_vox = np.diagonal(mask_aff[:3, 0:3])[0]
     y_vox = np.diagonal(mask_aff[:3, 0:3])[1]
     z_vox = np.diagonal(mask_aff[:3, 0:3])[2]
 
-    parcel_list_all = []
-    i = 1
-    for coord in coords_vox:
-        sphere_vol = np.zeros(mask_shape, dtype=bool)
-        sphere_vol[
-            tuple(
-                get_sphere(
-                    coord, node_size, (np.abs(x_vox), y_vox, z_vox), mask_shape
-                ).T
-            )
-        ] = (i * 1)
-        parcel_list_all.append(
-            nib.Nifti1Image(
-                sphere_vol.astype("bool").astype("uint16"),
-                affine=mask_aff))
-        i += 1
-
-    # remove the intersection
-    parcel_intersect = np.invert(
-        np.asarray(
-            intersect_masks(
-                parcel_list_all,
-                threshold=1).dataobj).astype("bool"))
-
-    parcel_list = []
-    for mask in parcel_list_all:
-        non_ovlp = np.asarray(mask.dataobj) * parcel_intersect
-        parcel_list.append(
-            nib.Nifti1Image(
-                non_ovlp.astype("bool").astype("uint16"),
-                affine=mask_aff))
+    [sphere_ix, sphere_vox] = get_spheres(
+        coords_vox, node_size, (np.abs(x_vox), y_vox, z_vox), mask_shape
+    )
+
+    # Remove the intersection of all spheres, using a count of the spheres
+    # claiming each voxel
+    n_vox = int(np.prod(mask_shape))
+    sphere_counts = np.bincount(sphere_vox, minlength=n_vox)
+    keep = sphere_counts[sphere_vox] < len(coords_vox)
+
+    parcel_list = ParcelMembership(
+        csr_matrix((np.ones(int(np.sum(keep)), dtype=bool),
+                    (sphere_ix[keep], sphere_vox[keep])),
+                   shape=(len(coords_vox), n_vox)),
+        mask_aff, mask_shape, np.arange(1, len(coords_vox) + 1))
 
     par_max = len(coords)
     if par_max > 0:
@@ -1882,4 +2902,4 @@ def create_spherical_roi_volumes(node_size, coords, template_mask):
     else:
         raise ValueError("Number of nodes is zero.")
 
-    return iter_img(parcel_list), par_max, node_size, parc
+    return parcel_list, par_max, node_size, parc
@@ -1419,6 +1419,164 @@ def load_runconfig():
     return hardcoded_params
 
 
+def hash_content(value, digest=None):
+    """
+    Hash a value by its content rather than by its identity, such that file
+    paths are represented by the bytes of the files they point to and arrays
+    by their dtype, shape, and data.
+
+    Parameters
+    ----------
+    value : object
+        A file path, array, Nifti1Image, scalar, or (nested) list, tuple or
+        dict of these. Other objects are hashed by their pickled bytes.
+    digest : hashlib hash object
+        Digest to update. Default is a new sha1 digest.
+
+    Returns
+    -------
+    digest : hashlib hash object
+        The updated digest.
+    """
+    import hashlib
+    import pickle
+
+    if digest is None:
+        digest = hashlib.sha1()
+
+    if value is None or isinstance(value, (bool, int, float, np.generic)):
+        digest.update(f"{type(value).__name__}:{value!r};".encode())
+    elif isinstance(value, str):
+        if op.isfile(value):
+            digest.update(b"file;")
+            with open(value, "rb") as f:
+                for chunk in iter(lambda: f.read(2 ** 20), b""):
+                    digest.update(chunk)
+        else:
+            digest.update(f"str:{value};".encode())
+    elif isinstance(value, bytes):
+        digest.update(b"bytes;" + value)
+    elif isinstance(value, np.ndarray):
+        digest.update(f"ndarray:{value.dtype.str}:{value.shape};".encode())
+        if value.dtype.hasobject:
+            hash_content(value.tolist(), digest)
+        else:
+            digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, nib.spatialimages.SpatialImage):
+        digest.update(f"{type(value).__name__};".encode())
+        hash_content(np.asarray(value.affine), digest)
+        hash_content(np.asarray(value.dataobj), digest)
+    elif isinstance(value, (list, tuple)):
+        digest.update(f"{type(value).__name__}:{len(value)};".encode())
+        for i in value:
+            hash_content(i, digest)
+    elif isinstance(value, dict):
+        digest.update(f"dict:{len(value)};".encode())
+        for k in sorted(value, key=repr):
+            hash_content(k, digest)
+            hash_content(value[k], digest)
+    else:
+        digest.update(f"{type(value).__name__};".encode())
+        digest.update(pickle.dumps(value, protocol=4))
+
+    return digest
+
+
+def memoize(func, ignore=(), depends=(), cache_dir=None):
+    """
+    Wrap a pure function such that its results are cached on disk, keyed by
+    the content of its inputs.
+
+    The key combines the PyNets version, the function's name and source code,
+    the source code of the functions it depends on, and the content hashes
+    (see `hash_content`) of all arguments except those listed in `ignore`.
+    Results are therefore shared across output directories, subjects, and
+    re-runs that differ only in other parameters, such that adding a model
+    or error margin to a run only computes the new results.
+
+    Parameters
+    ----------
+    func : callable
+        A function whose return value depends only on its arguments. The
+        return value must be picklable.
+    ignore : tuple
+        Names of arguments that do not affect the result (e.g. the number of
+        threads), and are excluded from the key.
+    depends : tuple
+        Functions called by `func` whose source code is included in the key,
+        such that changes to them invalidate cached results.
+    cache_dir : str
+        Root directory of the cache. Default is the `function_cache` setting
+        of runconfig.yaml, or ~/.pynets/function_cache.
+
+    Returns
+    -------
+    memoized : callable
+        The wrapped function, or `func` itself unless the `memoize` setting of
+        runconfig.yaml is True.
+    """
+    import functools
+    import hashlib
+    import inspect
+    import pickle
+    from filelock import SoftFileLock
+    from pynets.__about__ import __version__
+
+    hardcoded_params = load_runconfig()
+    if hardcoded_params.get("memoize", [False])[0] is not True:
+        return func
+    if cache_dir is None:
+        cache_dir = hardcoded_params.get("function_cache", [None])[0]
+    if cache_dir is None:
+        cache_dir = f"{os.path.expanduser('~')}/.pynets/function_cache"
+
+    name = f"{func.__module__}.{func.__qualname__}"
+    source = ""
+    for i in (func,) + tuple(depends):
+        try:
+            source += inspect.getsource(i)
+        except (OSError, TypeError):
+            source += f"{i.__module__}.{i.__qualname__}"
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def memoized(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+
+        digest = hashlib.sha1(f"{__version__}\0{name}\0{source}".encode())
+        for arg, value in bound.arguments.items():
+            if arg in ignore:
+                continue
+            hash_content(arg, digest)
+            hash_content(value, digest)
+        key = digest.hexdigest()
+        cache_path = f"{cache_dir}/{name}/{key[:2]}/{key}.pkl"
+
+        if op.isfile(cache_path):
+            try:
+                with open(cache_path, "rb") as f:
+                    return pickle.load(f)
+            except BaseException:
+                pass
+
+        result = func(*args, **kwargs)
+
+        try:
+            os.makedirs(op.dirname(cache_path), exist_ok=True)
+            with SoftFileLock(f"{cache_path}.lock", timeout=60):
+                tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    pickle.dump(result, f, protocol=4)
+                os.replace(tmp_path, cache_path)
+        except BaseException as e:
+            print(e, f"\nCould not cache the result of {name}")
+
+        return result
+
+    return memoized
+
+
 def save_coords_and_labels_to_json(coords, labels, dir_path,
                                    network='all_nodes', indices=None):
     """
@@ -1949,6 +2107,27 @@ def save_3d_to_4d(in_files):
     return out_file
 
 
+def save_memmap(data, out_file):
+    """
+    Save an array to a .npy file and reopen it as a read-only memmap, so that
+    it can be shared across worker processes without copying.
+
+    Parameters
+    ----------
+    data : ndarray
+        Array to share.
+    out_file : str
+        File path to the .npy file to create.
+
+    Returns
+    -------
+    data_mmap : memmap
+        Read-only memory-map of `out_file`.
+    """
+    np.save(out_file, np.asarray(data))
+    return np.load(out_file, mmap_mode="r")
+
+
 def kill_process_family(parent_pid):
     import os
     import psutil
@@ -3838,6 +3838,10 @@ def fmri_connectometry(
         # Don't forget that this setting exists
         clustering_node.synchronize = True
 
+        # Derive every k of a sweep from a single clustering fit
+        if k_list:
+            clustering_node.inputs.k_list = k_list
+
         # clustering_node iterables and names
         if k_clustering == 1:
             mask_name = op.basename(clust_mask).split(".nii")[0]
@@ -208,7 +208,103 @@ def tens_mod_est(gtab, data, B0_mask):
     return mod_odf, model
 
 
-def csa_mod_est(gtab, data, B0_mask, sh_order=8):
+def fit_shm_block(model, signals, coords, out, start, stop):
+    """
+    Fit a spherical harmonics model to one block of brain voxels.
+
+    Parameters
+    ----------
+    model : obj
+        DiPy reconstruction model exposing a `shm_coeff` fit (e.g. csa, csd).
+    signals : ndarray
+        N x M array of the diffusion signal of all N masked voxels.
+    coords : ndarray
+        N x 3 array of the voxel coordinates of the rows of `signals`.
+    out : ndarray
+        4D array of spherical harmonics coefficients into which the fitted
+        block is written.
+    start : int
+        First row of the block.
+    stop : int
+        Row after the last row of the block.
+
+    """
+    fit = model.fit(np.asarray(signals[start:stop]))
+    out[tuple(np.asarray(coords[start:stop]).T)] = fit.shm_coeff
+    del fit
+    return
+
+
+def fit_shm_blocks(model, data, mask, nthreads=1, block_size=5000):
+    """
+    Fit a spherical harmonics model to dwi data in parallel voxel blocks.
+
+    The masked diffusion signal is shared read-only with the workers, and
+    each block writes its coefficients directly into a preallocated,
+    memory-mapped output volume. Any model-level estimation (e.g. the csd
+    response function) is done once by the caller and shared by all blocks.
+
+    Parameters
+    ----------
+    model : obj
+        DiPy reconstruction model exposing a `shm_coeff` fit (e.g. csa, csd).
+    data : array
+        4D numpy array of diffusion image data.
+    mask : ndarray
+        3D boolean brain mask.
+    nthreads : int
+        Number of worker processes. Default is 1, which fits the whole mask
+        in-process.
+    block_size : int
+        Maximum number of voxels per block. Default is 5000.
+
+    Returns
+    -------
+    shm_coeff : ndarray
+        4D array of spherical harmonics coefficients, zero outside the mask.
+
+    """
+    import shutil
+    import tempfile
+    from joblib import Parallel, delayed
+    from pynets.dmri.estimation import fit_shm_block
+
+    if int(nthreads) <= 1:
+        return model.fit(data, mask=mask).shm_coeff
+
+    coords = np.argwhere(mask)
+    n_vox = len(coords)
+    if n_vox == 0:
+        return model.fit(data, mask=mask).shm_coeff
+    # Keep several blocks per worker to balance uneven fitting times
+    block_size = int(max(1, min(block_size, np.ceil(
+        n_vox / (4 * int(nthreads))))))
+
+    cache_dir = tempfile.mkdtemp()
+    np.save(f"{cache_dir}/signals.npy", data[mask])
+    signals = np.load(f"{cache_dir}/signals.npy", mmap_mode="r")
+    np.save(f"{cache_dir}/coords.npy", coords)
+    coords = np.load(f"{cache_dir}/coords.npy", mmap_mode="r")
+    n_coeffs = model.fit(np.asarray(signals[:1])).shm_coeff.shape[-1]
+    out = np.lib.format.open_memmap(
+        f"{cache_dir}/shm_coeff.npy", mode="w+", dtype="float64",
+        shape=mask.shape + (n_coeffs,))
+
+    print(f"Fitting {n_vox} voxels in blocks of {block_size} with "
+          f"{nthreads} workers...")
+    with Parallel(n_jobs=int(nthreads), backend='loky', mmap_mode='r+',
+                  temp_folder=cache_dir) as parallel:
+        parallel(delayed(fit_shm_block)(model, signals, coords, out, start,
+                                        min(start + block_size, n_vox))
+                 for start in range(0, n_vox, block_size))
+
+    shm_coeff = np.array(out)
+    del signals, coords, out
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    return shm_coeff
+
+
+def csa_mod_est(gtab, data, B0_mask, sh_order=8, nthreads=1):
     """
     Estimate a Constant Solid Angle (CSA) model from dwi data.
 
@@ -222,6 +318,9 @@ def csa_mod_est(gtab, data, B0_mask, sh_order=8):
         File path to B0 brain mask.
     sh_order : int
         The order of the SH model. Default is 8.
+    nthreads : int
+        Number of processes across which blocks of voxels are fit. Default
+        is 1.
 
     Returns
     -------
@@ -242,14 +341,14 @@ def csa_mod_est(gtab, data, B0_mask, sh_order=8):
     model = CsaOdfModel(gtab, sh_order=sh_order)
     B0_mask_data = np.nan_to_num(np.asarray(
         nib.load(B0_mask).dataobj)).astype("bool")
-    csa_mod = model.fit(data, B0_mask_data).shm_coeff
+    csa_mod = fit_shm_blocks(model, data, B0_mask_data, nthreads=nthreads)
     # Clip any negative values
     csa_mod = np.clip(csa_mod, 0, np.max(csa_mod, -1)[..., None])
     del B0_mask_data
     return csa_mod, model
 
 
-def csd_mod_est(gtab, data, B0_mask, sh_order=8):
+def csd_mod_est(gtab, data, B0_mask, sh_order=8, nthreads=1):
     """
     Estimate a Constrained Spherical Deconvolution (CSD) model from dwi data.
 
@@ -263,6 +362,10 @@ def csd_mod_est(gtab, data, B0_mask, sh_order=8):
         File path to B0 brain mask.
     sh_order : int
         The order of the SH model. Default is 8.
+    nthreads : int
+        Number of processes across which blocks of voxels are fit. The
+        response function is estimated once and shared by all blocks.
+        Default is 1.
 
     Returns
     -------
@@ -309,7 +412,7 @@ def csd_mod_est(gtab, data, B0_mask, sh_order=8):
     )
     print(f"CSD Reponse: {response}")
     model = ConstrainedSphericalDeconvModel(gtab, response, sh_order=sh_order)
-    csd_mod = model.fit(data, B0_mask_data).shm_coeff
+    csd_mod = fit_shm_blocks(model, data, B0_mask_data, nthreads=nthreads)
     del response, B0_mask_data
     return csd_mod, model
 
@@ -362,6 +465,300 @@ def sfm_mod_est(gtab, data, B0_mask):
     return sf_odf, model
 
 
+def streams2edges(streamlines, atlas_data, node_lut, roi_zooms, error_margin,
+                  overlap_thr, fa_weights=None):
+    """
+    Map a chunk of streamlines to compact per-edge summaries of the
+    structural connectome.
+
+    Parameters
+    ----------
+    streamlines : list
+        List of (n_points, 3) arrays of streamline points in voxel-space.
+    atlas_data : ndarray
+        3D array of integer atlas label intensities.
+    node_lut : ndarray
+        Lookup from label intensity to node number (1-based, 0 for
+        background).
+    roi_zooms : array/tuple
+        1D vector (x, y, z) of mm voxel resolution of `atlas_data`.
+    error_margin : int
+        Euclidean margin of error for classifying a streamline as a connection
+         to an ROI.
+    overlap_thr : int
+        Minimum ROI-streamline overlap, in units of voxels.
+    fa_weights : array
+        Normalized mean FA of each streamline. Default is None.
+
+    Returns
+    -------
+    edge_ids : ndarray
+        Unique edge ids, ``u * n_nodes + v`` for 0-based nodes u < v.
+    counts : ndarray
+        Number of streamlines along each edge.
+    length_sums : ndarray
+        Sum of the lengths, in points, of the streamlines along each edge.
+    fa_sums : ndarray
+        Sum of the non-NaN `fa_weights` of the streamlines along each edge.
+    fa_counts : ndarray
+        Number of non-NaN `fa_weights` summed into `fa_sums`.
+    """
+    from pynets.dmri.utils import streamline_label_counts
+
+    n_nodes = int(node_lut.max())
+    [sl_ix, sl_labs, sl_counts, sl_lengths] = streamline_label_counts(
+        streamlines, atlas_data, roi_zooms, error_margin)
+
+    # End nodes of each streamline, sorted ascending within a streamline
+    hit = sl_counts >= overlap_thr
+    sl_ix = sl_ix[hit]
+    end_nodes = node_lut[sl_labs[hit]] - 1
+    n_end = np.bincount(sl_ix, minlength=len(streamlines))
+    first = np.cumsum(n_end) - n_end
+
+    # All pairwise combinations of end nodes, batched over streamlines with
+    # the same number of end nodes
+    edge_ids = []
+    edge_sls = []
+    for k in np.unique(n_end[n_end > 1]):
+        sls = np.flatnonzero(n_end == k)
+        nodes = end_nodes[first[sls][:, np.newaxis] + np.arange(k)]
+        iu, ju = np.triu_indices(k, 1)
+        edge_ids.append((nodes[:, iu] * n_nodes + nodes[:, ju]).ravel())
+        edge_sls.append(np.repeat(sls, len(iu)))
+
+    if len(edge_ids) == 0:
+        empty = np.array([], dtype="int64")
+        return empty, empty, empty.astype("float64"), \
+            empty.astype("float64"), empty
+
+    edge_sls = np.concatenate(edge_sls)
+    edge_ids, inv = np.unique(np.concatenate(edge_ids), return_inverse=True)
+    inv = inv.ravel()
+    counts = np.bincount(inv, minlength=len(edge_ids))
+    length_sums = np.bincount(inv, weights=sl_lengths[edge_sls],
+                              minlength=len(edge_ids))
+    if fa_weights is not None:
+        fa = np.asarray(fa_weights, dtype="float64")[edge_sls]
+        valid = ~np.isnan(fa)
+        fa_sums = np.bincount(inv[valid], weights=fa[valid],
+                              minlength=len(edge_ids))
+        fa_counts = np.bincount(inv[valid], minlength=len(edge_ids))
+    else:
+        fa_sums = np.zeros(len(edge_ids))
+        fa_counts = np.zeros(len(edge_ids), dtype="int64")
+
+    return edge_ids, counts, length_sums, fa_sums, fa_counts
+
+
+def streams2edges_batch(streamlines, atlas_data, node_lut, roi_zooms,
+                        error_margin, overlap_thr, fa_data=None):
+    """
+    Map a batch of streamlines to compact per-edge summaries of the
+    structural connectome, along with running statistics of FA.
+
+    Edge FA sums are returned unnormalized, together with the minimum
+    (positive) and maximum FA sampled along the batch, so that global FA
+    normalization can be applied after all batches have been reduced.
+
+    Parameters
+    ----------
+    streamlines : list
+        List of (n_points, 3) arrays of streamline points in voxel-space.
+    atlas_data : ndarray
+        3D array of integer atlas label intensities.
+    node_lut : ndarray
+        Lookup from label intensity to node number (1-based, 0 for
+        background).
+    roi_zooms : array/tuple
+        1D vector (x, y, z) of mm voxel resolution of `atlas_data`.
+    error_margin : int
+        Euclidean margin of error for classifying a streamline as a connection
+         to an ROI.
+    overlap_thr : int
+        Minimum ROI-streamline overlap, in units of voxels.
+    fa_data : ndarray
+        3D array of FA values. Default is None.
+
+    Returns
+    -------
+    edge_summary : tuple
+        The outputs of `streams2edges`, with `fa_sums` accumulated over the
+        raw mean FA of each streamline.
+    fa_min : float
+        Minimum positive FA sampled along the batch (inf if none).
+    fa_max : float
+        Maximum FA sampled along the batch (-inf if none).
+    """
+    from dipy.tracking.streamline import values_from_volume
+    from pynets.dmri.estimation import streams2edges
+
+    fa_min = np.inf
+    fa_max = -np.inf
+    fa_weights = None
+    if fa_data is not None:
+        fa_vals = values_from_volume(fa_data, streamlines, np.eye(4))
+        fa_weights = np.array([np.nanmean(i) for i in fa_vals])
+        fa_vals = np.concatenate(fa_vals)
+        if np.any(fa_vals > 0):
+            fa_min = float(np.min(fa_vals[fa_vals > 0]))
+        if len(fa_vals) > 0:
+            fa_max = float(np.max(fa_vals))
+
+    return streams2edges(streamlines, atlas_data, node_lut, roi_zooms,
+                         error_margin, overlap_thr, fa_weights), \
+        fa_min, fa_max
+
+
+def streams2conn_matrix(atlas_for_streams, streams, warped_fa, error_margin,
+                        overlap_thr, fa_wei=False, fiber_density=False,
+                        streams_batch_size=5000, nthreads=1):
+    """
+    Estimate a raw structural connectivity matrix from the intersections of
+    tracked streamlines with the nodes of a parcellation.
+
+    Parameters
+    ----------
+    atlas_for_streams : str
+        File path to atlas parcellation Nifti1Image in T1w-conformed space.
+    streams : str
+        File path to streamline array sequence in .trk format.
+    warped_fa : str
+        File path to MNI-space warped FA Nifti1Image.
+    error_margin : int
+        Euclidean margin of error for classifying a streamline as a connection
+         to an ROI.
+    overlap_thr : int
+        Minimum ROI-streamline overlap, in units of voxels.
+    fa_wei : bool
+        Indicates whether to weight edges by their normalized mean FA.
+        Default is False.
+    fiber_density : bool
+        Indicates whether to redefine edges on the basis of fiber density.
+        Default is False.
+    streams_batch_size : int
+        Number of streamlines loaded and processed at a time. Default is
+        5000.
+    nthreads : int
+        Number of parallel workers. Default is 1.
+
+    Returns
+    -------
+    conn_matrix : array
+        Symmetric adjacency matrix stored as an m x n array of nodes and
+        edges.
+    """
+    import shutil
+    import tempfile
+    from joblib import Parallel, delayed
+    from pynets.dmri.estimation import streams2edges_batch
+    from pynets.dmri.utils import iter_streamline_batches
+    from pynets.core.nodemaker import label_inventory
+
+    # Load FA
+    fa_img = nib.load(warped_fa)
+
+    # Load parcellation
+    roi_img = nib.load(atlas_for_streams)
+    atlas_data = np.around(np.asarray(roi_img.dataobj))
+    roi_zooms = roi_img.header.get_zooms()
+    inventory = label_inventory(atlas_for_streams, labels_data=atlas_data)
+    roi_labels = inventory["labels"] > 0
+    roi_img.uncache()
+
+    # Lookup from label intensity to node
+    atlas_data = atlas_data.astype("int32")
+    unique_labels = inventory["labels"][roi_labels]
+    mx = len(unique_labels)
+    node_lut = np.zeros(int(atlas_data.max()) + 1, dtype="int64")
+    node_lut[unique_labels] = np.arange(mx) + 1
+    roi_volumes = inventory["counts"][roi_labels]
+
+    # Share the volumes read-only with the workers through memmaps
+    cache_dir = tempfile.mkdtemp()
+    np.save(f"{cache_dir}/atlas_data.npy", atlas_data)
+    atlas_data = np.load(f"{cache_dir}/atlas_data.npy", mmap_mode="r")
+    if fa_wei is True:
+        np.save(f"{cache_dir}/fa_data.npy",
+                np.asarray(fa_img.dataobj, dtype=np.float32))
+        fa_data = np.load(f"{cache_dir}/fa_data.npy", mmap_mode="r")
+    else:
+        fa_data = None
+
+    # Stream the tractogram from disk in fixed-size batches, mapping each
+    # batch to compact edge summaries in parallel. Only a bounded number
+    # of batches is dispatched ahead of the workers.
+    with Parallel(n_jobs=nthreads, backend='loky', max_nbytes='1M',
+                  mmap_mode='r', pre_dispatch='2*n_jobs') as parallel:
+        out = parallel(
+            delayed(streams2edges_batch)(
+                batch, atlas_data, node_lut, roi_zooms, error_margin,
+                overlap_thr, fa_data)
+            for batch in iter_streamline_batches(
+                streams, fa_img, batch_size=streams_batch_size))
+    del atlas_data, fa_data
+    shutil.rmtree(cache_dir, ignore_errors=True)
+
+    # Running statistics of FA across batches
+    min_global_fa_wei = min([np.inf] + [i[1] for i in out])
+    max_global_fa_wei = max([-np.inf] + [i[2] for i in out])
+    out = [i[0] for i in out] + [
+        (np.array([], dtype="int64"),) * 2 + (np.array([]),) * 3]
+
+    # Reduce into N x N count, mean-length and mean-FA matrices
+    edge_ids = np.concatenate([i[0] for i in out])
+    counts = np.bincount(edge_ids, weights=np.concatenate(
+        [i[1] for i in out]), minlength=mx * mx).reshape(mx, mx)
+    length_sums = np.bincount(edge_ids, weights=np.concatenate(
+        [i[2] for i in out]), minlength=mx * mx).reshape(mx, mx)
+    fa_sums = np.bincount(edge_ids, weights=np.concatenate(
+        [i[3] for i in out]), minlength=mx * mx).reshape(mx, mx)
+    fa_counts = np.bincount(edge_ids, weights=np.concatenate(
+        [i[4] for i in out]), minlength=mx * mx).reshape(mx, mx)
+    del out, edge_ids
+
+    edges = counts > 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_lengths = np.where(edges, length_sums / counts, np.nan)
+        # Here we normalize by global FA
+        mean_fa = np.where(
+            fa_counts > 0, (fa_sums / fa_counts - min_global_fa_wei) /
+            (max_global_fa_wei - min_global_fa_wei), np.nan)
+
+    # Add fiber density attributes for each edge
+    # Adapted from the nnormalized fiber-density estimation routines of
+    # Sebastian Tourbier.
+    if fiber_density is True:
+        print("Redefining edges on the basis of fiber density...")
+        # Summarize total fibers and total label volumes
+        total_fibers = np.sum(edges)
+        total_volume = np.sum(roi_volumes[np.any(edges, axis=1)])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            fiber_densities = np.where(
+                edges, ((counts / total_fibers) / mean_lengths) *
+                ((2.0 * total_volume) /
+                 np.add.outer(roi_volumes, roi_volumes)) * 1000, 0)
+
+    if fa_wei is True:
+        print("Re-weighting edges by FA...")
+
+    # Summarize weights
+    if fa_wei is True and fiber_density is True:
+        final_weights = mean_fa * fiber_densities
+    elif fiber_density is True and fa_wei is False:
+        final_weights = fiber_densities
+    elif fa_wei is True and fiber_density is False:
+        final_weights = mean_fa * counts
+    else:
+        final_weights = counts
+    conn_matrix_raw = np.where(edges, final_weights, 0)
+
+    # Enforce symmetry
+    conn_matrix = np.maximum(conn_matrix_raw, conn_matrix_raw.T)
+
+    return conn_matrix
+
+
 def streams2graph(
     atlas_for_streams,
     streams,
@@ -531,19 +928,13 @@ def streams2graph(
       Analysis in Diffusion Tensor Imaging. Brain Connectivity.
       https://doi.org/10.1089/brain.2016.0481
     """
-    import gc
-    import os
     import time
-    from dipy.tracking.streamline import Streamlines, values_from_volume
-    from dipy.tracking._utils import _mapping_to_voxel, _to_voxel_coordinates
-    import networkx as nx
-    from itertools import combinations
-    from collections import defaultdict
-    from pynets.core import utils, nodemaker
-    from pynets.dmri.utils import generate_sl
-    from dipy.io.streamline import load_tractogram
-    from dipy.io.stateful_tractogram import Space, Origin
+    from pynets.core import utils
+    from pynets.dmri.estimation import streams2conn_matrix, \
+        streams2edges_batch, streams2edges
+    from pynets.dmri.utils import iter_streamline_batches
     from pynets.core.utils import load_runconfig
+    from pynets.core.nodemaker import label_inventory, label_statistics
 
     hardcoded_params = load_runconfig()
     fa_wei = hardcoded_params[
@@ -552,6 +943,9 @@ def streams2graph(
         "StructuralNetworkWeighting"]["fiber_density"][0]
     overlap_thr = hardcoded_params[
         "StructuralNetworkWeighting"]["overlap_thr"][0]
+    streams_batch_size = hardcoded_params[
+        "StructuralNetworkWeighting"]["streams_batch_size"][0]
+    nthreads = hardcoded_params["nthreads"][0]
     roi_neighborhood_tol = \
         hardcoded_params['tracking']["roi_neighborhood_tol"][0]
 
@@ -564,223 +958,22 @@ def streams2graph(
     else:
         print(f"Using fiber-roi intersection tolerance: {error_margin}...")
 
-    # Load FA
-    fa_img = nib.load(warped_fa)
-
-    # Load parcellation
-    roi_img = nib.load(atlas_for_streams)
-    atlas_data = np.around(np.asarray(roi_img.dataobj))
-    roi_zooms = roi_img.header.get_zooms()
-    roi_shape = roi_img.shape
-
-    # Read Streamlines
     if streams is not None:
-        streamlines = [
-            i.astype(np.float32)
-            for i in Streamlines(
-                load_tractogram(
-                    streams,
-                    fa_img,
-                    to_origin=Origin.NIFTI,
-                    to_space=Space.VOXMM
-                ).streamlines
-            )
-        ]
-
-        # from fury import actor, window
-        # renderer = window.Renderer()
-        # template_actor = actor.contour_from_roi(roi_img.get_fdata(),
-        #                                         color=(50, 50, 50),
-        #                                         opacity=0.05)
-        # renderer.add(template_actor)
-        # lines_actor = actor.streamtube(streamlines, window.colors.orange,
-        #                                linewidth=0.3)
-        # renderer.add(lines_actor)
-        # window.show(renderer)
-
-        roi_img.uncache()
-
-        if fa_wei is True:
-            fa_weights = values_from_volume(
-                np.asarray(fa_img.dataobj, dtype=np.float32),
-                streamlines, np.eye(4)
-            )
-            global_fa_weights = list(utils.flatten(fa_weights))
-            min_global_fa_wei = min([i for i in global_fa_weights if i > 0])
-            max_global_fa_wei = max(global_fa_weights)
-            fa_weights_norm = []
-            # Here we normalize by global FA
-            for val_list in fa_weights:
-                fa_weights_norm.append(
-                    np.nanmean(
-                        (val_list - min_global_fa_wei)
-                        / (max_global_fa_wei - min_global_fa_wei)
-                    )
-                )
-
-        # Make streamlines into generators to keep memory at a minimum
-        total_streamlines = len(streamlines)
-        sl = [generate_sl(i) for i in streamlines]
-        del streamlines
-
-        # Instantiate empty networkX graph object & dictionary and create
-        # voxel-affine mapping
-        lin_T, offset = _mapping_to_voxel(np.eye(4))
-        mx = len(np.unique(atlas_data.astype("uint16"))) - 1
-        g = nx.Graph(ecount=0, vcount=mx)
-        edge_dict = defaultdict(int)
-        node_dict = dict(
-            zip(np.unique(atlas_data.astype("uint16"))[1:], np.arange(mx) + 1))
-
-        # Add empty vertices with label volume attributes
-        for node in range(1, mx + 1):
-            g.add_node(node, roi_volume=np.sum(
-                atlas_data.astype("uint16") == node)
-            )
-
-        # Build graph
-        pc = 0
-        bad_idxs = []
-        fiberlengths = {}
-        fa_weights_dict = {}
         print(f"Quantifying fiber-ROI intersection for {atlas}:")
-        for ix, s in enumerate(sl):
-            # Percent counter
-            pcN = int(round(100*float(ix / total_streamlines)))
-            if pcN % 10 == 0 and ix > 0 and pcN > pc:
-                pc = pcN
-                print(f"{pcN}%")
-
-            # Map the streamlines coordinates to voxel coordinates and get
-            # labels for label_volume
-            vox_coords = _to_voxel_coordinates(Streamlines(s), lin_T, offset)
-
-            lab_coords = [
-                nodemaker.get_sphere(coord, error_margin, roi_zooms, roi_shape)
-                for coord in vox_coords
-            ]
-            [i, j, k] = np.vstack(np.array(lab_coords)).T
-
-            # get labels for label_volume
-            lab_arr = atlas_data[i, j, k]
-            # print(lab_arr)
-            endlabels = []
-            for jx, lab in enumerate(np.unique(lab_arr).astype("uint32")):
-                if (lab > 0) and (np.sum(lab_arr == lab) >= overlap_thr):
-                    try:
-                        endlabels.append(node_dict[lab])
-                    except BaseException:
-                        bad_idxs.append(jx)
-                        print(
-                            f"Label {lab} missing from parcellation. Check "
-                            f"registration and ensure valid input "
-                            f"parcellation file.")
-
-            edges = combinations(endlabels, 2)
-            for edge in edges:
-                # Get fiber lengths along edge
-                if fiber_density is True:
-                    if not (edge[0], edge[1]) in fiberlengths.keys():
-                        fiberlengths[(edge[0], edge[1])] = [len(vox_coords)]
-                    else:
-                        fiberlengths[(edge[0],
-                                      edge[1])].append(len(vox_coords))
-
-                # Get FA values along edge
-                if fa_wei is True:
-                    if not (edge[0], edge[1]) in fa_weights_dict.keys():
-                        fa_weights_dict[(edge[0],
-                                         edge[1])] = [fa_weights_norm[ix]]
-                    else:
-                        fa_weights_dict[(edge[0],
-                                         edge[1])].append(fa_weights_norm[ix])
-
-                lst = tuple([int(node) for node in edge])
-                edge_dict[tuple(sorted(lst))] += 1
-
-            edge_list = [(k[0], k[1], count) for k, count in edge_dict.items()]
-
-            g.add_weighted_edges_from(edge_list)
-
-            del lab_coords, lab_arr, endlabels, edges, edge_list
-
-        gc.collect()
-
-        # Add fiber density attributes for each edge
-        # Adapted from the nnormalized fiber-density estimation routines of
-        # Sebastian Tourbier.
-        if fiber_density is True:
-            print("Redefining edges on the basis of fiber density...")
-            # Summarize total fibers and total label volumes
-            total_fibers = 0
-            total_volume = 0
-            u_start = -1
-            for u, v, d in g.edges(data=True):
-                total_fibers += len(d)
-                if u != u_start:
-                    total_volume += g.nodes[int(u)]['roi_volume']
-                u_start = u
-
-            ix = 0
-            for u, v, d in g.edges(data=True):
-                if d['weight'] > 0:
-                    edge_fiberlength_mean = np.nanmean(fiberlengths[(u, v)])
-                    fiber_density = (float(((float(d['weight']) /
-                                             float(total_fibers)) /
-                                            float(edge_fiberlength_mean)) *
-                                           ((2.0 * float(total_volume)) /
-                                            (g.nodes[int(u)]['roi_volume'] +
-                                               g.nodes[int(v)]['roi_volume']))
-                                           )) * 1000
-                else:
-                    fiber_density = 0
-                g.edges[u, v].update({"fiber_density": fiber_density})
-                ix += 1
-
-        if fa_wei is True:
-            print("Re-weighting edges by FA...")
-            # Add FA attributes for each edge
-            ix = 0
-            for u, v, d in g.edges(data=True):
-                if d['weight'] > 0:
-                    edge_average_fa = np.nanmean(fa_weights_dict[(u, v)])
-                else:
-                    edge_average_fa = np.nan
-                g.edges[u, v].update({"fa_weight": edge_average_fa})
-                ix += 1
-
-        # Summarize weights
-        if fa_wei is True and fiber_density is True:
-            for u, v, d in g.edges(data=True):
-                g.edges[u, v].update({"final_weight":
-                                      (d['fa_weight'])*d['fiber_density']})
-        elif fiber_density is True and fa_wei is False:
-            for u, v, d in g.edges(data=True):
-                g.edges[u, v].update({"final_weight": d['fiber_density']})
-        elif fa_wei is True and fiber_density is False:
-            for u, v, d in g.edges(data=True):
-                g.edges[u, v].update({"final_weight":
-                                      d['fa_weight']*d['weight']})
-        else:
-            for u, v, d in g.edges(data=True):
-                g.edges[u, v].update({"final_weight": d['weight']})
-
-        # Convert weighted graph to numpy matrix
-        conn_matrix_raw = nx.to_numpy_array(g, weight='final_weight')
-
-        # Enforce symmetry
-        conn_matrix = np.maximum(conn_matrix_raw, conn_matrix_raw.T)
-
+        conn_matrix = utils.memoize(
+            streams2conn_matrix, ignore=("streams_batch_size", "nthreads"),
+            depends=(streams2edges_batch, streams2edges,
+                     iter_streamline_batches, label_inventory,
+                     label_statistics))(
+            atlas_for_streams, streams, warped_fa, error_margin, overlap_thr,
+            fa_wei, fiber_density, streams_batch_size, nthreads)
         print("Structural graph completed:\n", str(time.time() - start))
-
-        if len(bad_idxs) > 0:
-            bad_idxs = sorted(list(set(bad_idxs)), reverse=True)
-            for j in bad_idxs:
-                del labels[j], coords[j]
     else:
         print(UserWarning('No valid streamlines detected. '
                           'Proceeding with an empty graph...'))
-        mx = len(np.unique(atlas_data.astype("uint16"))) - 1
+        atlas_data = np.around(np.asarray(nib.load(atlas_for_streams).dataobj))
+        inventory = label_inventory(atlas_for_streams, labels_data=atlas_data)
+        mx = int(np.sum(inventory["labels"] > 0))
         conn_matrix = np.zeros((mx, mx))
 
     assert len(coords) == len(labels) == conn_matrix.shape[0]
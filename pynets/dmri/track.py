@@ -15,7 +15,8 @@ if sys.platform.startswith('win') is False:
 warnings.filterwarnings("ignore")
 
 
-def reconstruction(conn_model, gtab, dwi_data, B0_mask):
+def reconstruction(conn_model, gtab, dwi_data, B0_mask, sh_order=8,
+                   nthreads=1):
     """
     Estimate a tensor model from dwi data.
 
@@ -30,6 +31,12 @@ def reconstruction(conn_model, gtab, dwi_data, B0_mask):
         4D array of dwi data.
     B0_mask : str
         File path to B0 brain mask.
+    sh_order : int
+        Spherical harmonics order used by the 'csa' and 'csd' models.
+        Default is 8.
+    nthreads : int
+        Number of processes across which the 'csa' and 'csd' models are fit
+        in blocks of voxels. Default is 1.
 
     Returns
     -------
@@ -53,9 +60,11 @@ def reconstruction(conn_model, gtab, dwi_data, B0_mask):
     )
 
     if conn_model == "csa" or conn_model == "CSA":
-        [mod_fit, mod] = csa_mod_est(gtab, dwi_data, B0_mask)
+        [mod_fit, mod] = csa_mod_est(gtab, dwi_data, B0_mask,
+                                     sh_order=sh_order, nthreads=nthreads)
     elif conn_model == "csd" or conn_model == "CSD":
-        [mod_fit, mod] = csd_mod_est(gtab, dwi_data, B0_mask)
+        [mod_fit, mod] = csd_mod_est(gtab, dwi_data, B0_mask,
+                                     sh_order=sh_order, nthreads=nthreads)
     elif conn_model == "sfm" or conn_model == "SFM":
         [mod_fit, mod] = sfm_mod_est(gtab, dwi_data, B0_mask)
     elif conn_model == "ten" or conn_model == "tensor" or \
@@ -72,16 +81,128 @@ def reconstruction(conn_model, gtab, dwi_data, B0_mask):
     return mod_fit, mod
 
 
-def prep_tissues(
+def reconstruction_key(conn_model, gtab, dwi_file, B0_mask, sh_order=8):
+    """
+    Content hash identifying a diffusion reconstruction.
+
+    Parameters
+    ----------
+    conn_model : str
+        Connectivity reconstruction method (e.g. 'csa', 'tensor', 'csd',
+        'sfm').
+    gtab : Obj
+        DiPy object storing diffusion gradient information.
+    dwi_file : str
+        File path to diffusion weighted image.
+    B0_mask : str
+        File path to B0 brain mask.
+    sh_order : int
+        Spherical harmonics order used by the 'csa' and 'csd' models.
+
+    Returns
+    -------
+    key : str
+        Model name followed by a digest of the dwi and B0 mask contents, the
+        gradient table, and the spherical harmonics order.
+
+    """
+    import hashlib
+
+    conn_model = conn_model.lower()
+    if conn_model == "tensor":
+        conn_model = "ten"
+
+    digest = hashlib.sha1()
+    for file_ in [dwi_file, B0_mask]:
+        with open(file_, "rb") as f:
+            for chunk in iter(lambda: f.read(2 ** 20), b""):
+                digest.update(chunk)
+    digest.update(np.asarray(gtab.bvals, dtype="float64").tobytes())
+    digest.update(np.asarray(gtab.bvecs, dtype="float64").tobytes())
+    digest.update(str(float(gtab.b0_threshold)).encode())
+    digest.update(conn_model.encode())
+    if conn_model in ["csa", "csd"]:
+        digest.update(str(int(sh_order)).encode())
+
+    return f"{conn_model}_{digest.hexdigest()}"
+
+
+def cached_reconstruction(conn_model, gtab, dwi_file, B0_mask, cache_dir,
+                          sh_order=8, nthreads=1):
+    """
+    Fit a diffusion model once and reuse it across tracking iterables.
+
+    Reconstructions are stored in `cache_dir` under a content-addressed name
+    (see `reconstruction_key`), so that every tracking node of a subject that
+    shares the same dwi, gradient table, mask, model, and spherical harmonics
+    order reads a single fit. Concurrent nodes are serialized by a file lock.
+
+    Parameters
+    ----------
+    conn_model : str
+        Connectivity reconstruction method (e.g. 'csa', 'tensor', 'csd',
+        'sfm').
+    gtab : Obj
+        DiPy object storing diffusion gradient information.
+    dwi_file : str
+        File path to diffusion weighted image.
+    B0_mask : str
+        File path to B0 brain mask.
+    cache_dir : str
+        Subject-level directory in which reconstructions are stored.
+    sh_order : int
+        Spherical harmonics order used by the 'csa' and 'csd' models.
+        Default is 8.
+    nthreads : int
+        Number of processes used to fit the model when it is not cached.
+        Default is 1.
+
+    Returns
+    -------
+    recon_path : str
+        File path to the hdf5 file storing the fitted reconstruction.
+
+    """
+    import os
+    import h5py
+    from filelock import SoftFileLock
+
+    os.makedirs(cache_dir, exist_ok=True)
+    key = reconstruction_key(conn_model, gtab, dwi_file, B0_mask, sh_order)
+    recon_path = f"{cache_dir}/reconstruction_{key}.hdf5"
+
+    with SoftFileLock(f"{recon_path}.lock"):
+        if os.path.isfile(recon_path):
+            print(f"Found existing reconstruction with {conn_model}. "
+                  f"Loading...")
+            return recon_path
+
+        dwi_img = nib.load(dwi_file, mmap=True)
+        dwi_data = dwi_img.get_fdata(dtype=np.float32)
+        model, _ = reconstruction(conn_model, gtab, dwi_data, B0_mask,
+                                  sh_order=sh_order, nthreads=nthreads)
+        dwi_img.uncache()
+        del dwi_data
+
+        tmp_path = f"{recon_path}.tmp"
+        with h5py.File(tmp_path, "w") as hf:
+            hf.create_dataset("reconstruction",
+                              data=model.astype("float32"), dtype="f4")
+        os.replace(tmp_path, recon_path)
+        del model
+
+    return recon_path
+
+
+def prep_tissue_maps(
         t1_mask,
         gm_in_dwi,
         vent_csf_in_dwi,
         wm_in_dwi,
         tiss_class,
-        B0_mask,
-        cmc_step_size=0.2):
+        B0_mask):
     """
-    Estimate a tissue classifier for tractography.
+    Prepare the tissue volumes from which a tissue classifier is constructed.
 
     Parameters
     ----------
@@ -95,30 +216,13 @@ def prep_tissues(
         White-matter tissue segmentation Nifti1Image.
     tiss_class : str
         Tissue classification method.
-    cmc_step_size : float
-        Step size from CMC tissue classification method.
 
     Returns
     -------
-    tiss_classifier : obj
-        Tissue classifier object.
-
-    References
-    ----------
-    .. [1] Zhang, Y., Brady, M. and Smith, S. Segmentation of Brain MR Images
-      Through a Hidden Markov Random Field Model and the
-      Expectation-Maximization Algorithm IEEE Transactions on Medical Imaging,
-      20(1): 45-56, 2001
-    .. [2] Avants, B. B., Tustison, N. J., Wu, J., Cook, P. A. and Gee, J. C.
-      An open source multivariate framework for n-tissue segmentation with
-      evaluation on public data. Neuroinformatics, 9(4): 381-400, 2011.
-
+    tissue_maps : dict
+        Dictionary of the 3D arrays (and, for 'cmc', the average voxel size)
+        consumed by `tissue_classifier_from_maps`.
     """
-    from dipy.tracking.stopping_criterion import (
-        ActStoppingCriterion,
-        CmcStoppingCriterion,
-        BinaryStoppingCriterion,
-    )
     from nilearn.masking import intersect_masks
     from nilearn.image import math_img
 
@@ -140,56 +244,141 @@ def prep_tissues(
         background[(gm_data + wm_data +
                     vent_csf_in_dwi_data) > 0] = 0
         gm_data[background > 0] = 1
-        tiss_classifier = ActStoppingCriterion(
-            gm_data, vent_csf_in_dwi_data)
+        tissue_maps = {"include_map": gm_data,
+                       "exclude_map": vent_csf_in_dwi_data}
         del background
     elif tiss_class == "wm":
-        tiss_classifier = BinaryStoppingCriterion(
-            np.asarray(
-                intersect_masks(
-                    [
-                        mask_img,
-                        wm_mask_img,
-                        B0_mask_img,
-                    ],
-                    threshold=1,
-                    connected=False,
-                ).dataobj
-            )
-        )
+        tissue_maps = {"mask": np.asarray(
+            intersect_masks(
+                [
+                    mask_img,
+                    wm_mask_img,
+                    B0_mask_img,
+                ],
+                threshold=1,
+                connected=False,
+            ).dataobj
+        ).astype("bool")}
+    elif tiss_class == "cmc":
+        tissue_maps = {"wm_map": wm_data, "gm_map": gm_data,
+                       "csf_map": vent_csf_in_dwi_data,
+                       "voxel_size": float(np.average(
+                           mask_img.header["pixdim"][1:4]))}
+    elif tiss_class == "wb":
+        tissue_maps = {"mask": np.asarray(
+            intersect_masks(
+                [
+                    mask_img,
+                    B0_mask_img,
+                    nib.Nifti1Image(np.invert(
+                        vent_csf_in_dwi_data.astype('bool')).astype(
+                        'int'), affine=mask_img.affine),
+                ],
+                threshold=1,
+                connected=False,
+            ).dataobj
+        ).astype("bool")}
+    else:
+        raise ValueError("Tissue classifier cannot be none.")
+
+    return tissue_maps
+
+
+def tissue_classifier_from_maps(tissue_maps, tiss_class, cmc_step_size=0.2):
+    """
+    Construct a tissue classifier for tractography from prepared tissue
+    volumes.
+
+    Parameters
+    ----------
+    tissue_maps : dict
+        Dictionary of tissue volumes returned by `prep_tissue_maps`.
+    tiss_class : str
+        Tissue classification method.
+    cmc_step_size : float
+        Step size from CMC tissue classification method.
+
+    Returns
+    -------
+    tiss_classifier : obj
+        Tissue classifier object.
+    """
+    from dipy.tracking.stopping_criterion import (
+        ActStoppingCriterion,
+        CmcStoppingCriterion,
+        BinaryStoppingCriterion,
+    )
+
+    if tiss_class == "act":
+        tiss_classifier = ActStoppingCriterion(
+            tissue_maps["include_map"], tissue_maps["exclude_map"])
+    elif tiss_class == "wm" or tiss_class == "wb":
+        tiss_classifier = BinaryStoppingCriterion(tissue_maps["mask"])
     elif tiss_class == "cmc":
-        voxel_size = np.average(mask_img.header["pixdim"][1:4])
         tiss_classifier = CmcStoppingCriterion.from_pve(
-            wm_data,
-            gm_data,
-            vent_csf_in_dwi_data,
+            tissue_maps["wm_map"],
+            tissue_maps["gm_map"],
+            tissue_maps["csf_map"],
             step_size=cmc_step_size,
-            average_voxel_size=voxel_size,
-        )
-    elif tiss_class == "wb":
-        tiss_classifier = BinaryStoppingCriterion(
-            np.asarray(
-                intersect_masks(
-                    [
-                        mask_img,
-                        B0_mask_img,
-                        nib.Nifti1Image(np.invert(
-                            vent_csf_in_dwi_data.astype('bool')).astype(
-                            'int'), affine=mask_img.affine),
-                    ],
-                    threshold=1,
-                    connected=False,
-                ).dataobj
-            )
+            average_voxel_size=tissue_maps["voxel_size"],
         )
     else:
         raise ValueError("Tissue classifier cannot be none.")
 
-    del gm_data, wm_data, vent_csf_in_dwi_data
-
     return tiss_classifier
 
 
+def prep_tissues(
+        t1_mask,
+        gm_in_dwi,
+        vent_csf_in_dwi,
+        wm_in_dwi,
+        tiss_class,
+        B0_mask,
+        cmc_step_size=0.2):
+    """
+    Estimate a tissue classifier for tractography.
+
+    Parameters
+    ----------
+    t1_mask : Nifti1Image
+        T1w mask img.
+    gm_in_dwi : Nifti1Image
+        Grey-matter tissue segmentation Nifti1Image.
+    vent_csf_in_dwi : Nifti1Image
+        Ventricular CSF tissue segmentation Nifti1Image.
+    wm_in_dwi : Nifti1Image
+        White-matter tissue segmentation Nifti1Image.
+    tiss_class : str
+        Tissue classification method.
+    cmc_step_size : float
+        Step size from CMC tissue classification method.
+
+    Returns
+    -------
+    tiss_classifier : obj
+        Tissue classifier object.
+
+    References
+    ----------
+    .. [1] Zhang, Y., Brady, M. and Smith, S. Segmentation of Brain MR Images
+      Through a Hidden Markov Random Field Model and the
+      Expectation-Maximization Algorithm IEEE Transactions on Medical Imaging,
+      20(1): 45-56, 2001
+    .. [2] Avants, B. B., Tustison, N. J., Wu, J., Cook, P. A. and Gee, J. C.
+      An open source multivariate framework for n-tissue segmentation with
+      evaluation on public data. Neuroinformatics, 9(4): 381-400, 2011.
+
+    """
+    from pynets.dmri.track import prep_tissue_maps, \
+        tissue_classifier_from_maps
+
+    return tissue_classifier_from_maps(
+        prep_tissue_maps(t1_mask, gm_in_dwi, vent_csf_in_dwi, wm_in_dwi,
+                         tiss_class, B0_mask),
+        tiss_class, cmc_step_size=cmc_step_size)
+
+
 def create_density_map(
     fa_img,
     dir_path,
@@ -251,23 +440,17 @@ def create_density_map(
         File path to fiber density map Nifti1Image.
     """
     import os.path as op
-    from dipy.tracking import utils
-    from dipy.tracking._utils import _mapping_to_voxel
+    from pynets.dmri.utils import (
+        positive_voxel_streamlines,
+        streamline_density_map,
+    )
 
     # Remove streamlines with negative voxel indices
-    lin_T, offset = _mapping_to_voxel(np.eye(4))
-    streams_filt = []
-    for sl in streamlines:
-        inds = np.dot(sl, lin_T)
-        inds += offset
-        if not inds.min().round(decimals=6) < 0:
-            streams_filt.append(sl)
+    streamlines = nib.streamlines.ArraySequence(streamlines)
+    streams_filt = streamlines[positive_voxel_streamlines(streamlines)]
 
     # Create density map
-    dm = utils.density_map(
-        streams_filt,
-        affine=np.eye(4),
-        vol_dims=fa_img.shape)
+    dm = streamline_density_map(streams_filt, fa_img.shape)
 
     # Save density map
     dm_img = nib.Nifti1Image(dm.astype("float32"), fa_img.affine)
@@ -306,6 +489,65 @@ def create_density_map(
     return dir_path, dm_path
 
 
+def allocate_seeds(n_accepted, n_seeded, n_seeds_per_iter,
+                   seed_share_cap=2.0, min_seeds=100):
+    """
+    Allocate the seeds of an ensemble tractography sampling round across
+    (step, curvature) combinations, in proportion to the yield of accepted
+    streamlines of each combination on previous rounds.
+
+    Parameters
+    ----------
+    n_accepted : array
+        Number of streamlines accepted so far from each combination.
+    n_seeded : array
+        Number of seeds tracked so far from each combination.
+    n_seeds_per_iter : int
+        Number of seeds per combination under a uniform allocation. The
+        round's total budget is `n_seeds_per_iter` times the number of
+        combinations.
+    seed_share_cap : float
+        Maximal factor by which the share of seeds of any combination can
+        exceed, or fall short of, its uniform share. A value of 1 always
+        yields a uniform allocation. Default is 2.0.
+    min_seeds : int
+        Minimal number of seeds allocated to any combination, so that no
+        combination falls below the seed count required by `run_tracking`.
+        Default is 100.
+
+    Returns
+    -------
+    n_seeds : ndarray
+        Number of seeds allocated to each combination.
+    """
+    n_accepted = np.asarray(n_accepted, dtype="float64")
+    n_seeded = np.asarray(n_seeded, dtype="float64")
+    n_combs = len(n_accepted)
+    seed_share_cap = max(float(seed_share_cap), 1.0)
+
+    # Yield of each combination, smoothed towards one accepted streamline
+    # per round so that combinations that have not been sampled yet, or only
+    # briefly, are still explored
+    yields = (n_accepted + 1.0) / (n_seeded + float(n_seeds_per_iter))
+    shares = yields / np.sum(yields)
+
+    # Clip the shares to the balance bounds, redistributing the surplus or
+    # deficit among the combinations that remain within them
+    lower = 1.0 / (seed_share_cap * n_combs)
+    upper = seed_share_cap / n_combs
+    for _ in range(n_combs):
+        shares = np.clip(shares, lower, upper)
+        residual = 1.0 - np.sum(shares)
+        free = (shares > lower) & (shares < upper) if residual < 0 else \
+            shares < upper
+        if np.isclose(residual, 0) or not np.any(free):
+            break
+        shares[free] += residual * shares[free] / np.sum(shares[free])
+
+    return np.maximum(np.round(shares * n_seeds_per_iter * n_combs),
+                      max(int(min_seeds), 1)).astype("int64")
+
+
 def track_ensemble(
     target_samples,
     atlas_data_wm_gm_int,
@@ -407,21 +649,21 @@ def track_ensemble(
     import gc
     import time
     import warnings
+    import uuid
+    import h5py
     from joblib import Parallel, delayed
     import itertools
-    from pynets.dmri.track import run_tracking
+    from pynets.dmri.track import run_tracking, prep_tissue_maps
     from colorama import Fore, Style
-    from pynets.dmri.utils import generate_sl
+    from pynets.dmri.utils import generate_sl, nearest_mask_voxels
     from nibabel.streamlines.array_sequence import concatenate, ArraySequence
-    from pynets.core.utils import save_3d_to_4d
+    from pynets.core.utils import save_memmap
     from nilearn.masking import intersect_masks
     from nilearn.image import math_img
     from pynets.core.utils import load_runconfig
     warnings.filterwarnings("ignore")
 
-    tmp_files_dir = f"{cache_dir}/tmp_files"
     joblib_dir = f"{cache_dir}/joblib_tracking"
-    os.makedirs(tmp_files_dir, exist_ok=True)
     os.makedirs(joblib_dir, exist_ok=True)
 
     hardcoded_params = load_runconfig()
@@ -442,11 +684,12 @@ def track_ensemble(
         hardcoded_params['tracking']["min_streams"][0]
     seeding_mask_thr = hardcoded_params['tracking']["seeding_mask_thr"][0]
     timeout = hardcoded_params['tracking']["track_timeout"][0]
+    seed_share_cap = hardcoded_params['tracking']["seed_share_cap"][0]
+    min_seeds = 100
 
     all_combs = list(itertools.product(step_list, curv_thr_list))
 
     # Construct seeding mask
-    seeding_mask = f"{tmp_files_dir}/seeding_mask.nii.gz"
     if waymask is not None and os.path.isfile(waymask):
         waymask_img = math_img(f"img > {seeding_mask_thr}",
                                img=nib.load(waymask))
@@ -460,7 +703,9 @@ def track_ensemble(
             threshold=1,
             connected=False,
         )
-        nib.save(atlas_data_wm_gm_int_img, seeding_mask)
+        waymask_nearest = save_memmap(
+            nearest_mask_voxels(np.asarray(waymask_img.dataobj)),
+            f"{joblib_dir}/waymask_nearest.npy")
     else:
         atlas_data_wm_gm_int_img = intersect_masks(
             [
@@ -470,33 +715,100 @@ def track_ensemble(
             threshold=1,
             connected=False,
         )
-        nib.save(atlas_data_wm_gm_int_img, seeding_mask)
-
-    tissues4d = save_3d_to_4d([B0_mask, labels_im_file, seeding_mask,
-                               t1w2dwi, gm_in_dwi, vent_csf_in_dwi, wm_in_dwi])
+        waymask_nearest = None
+
+    # Load the reconstruction, tissue maps and parcel label volume once, and
+    # share them read-only with the tracking workers as memory-maps. For ROI
+    # filtering, a single distance transform maps every voxel to its nearest
+    # parcel voxel.
+    parcel_nearest = nearest_mask_voxels(
+        np.asarray(nib.load(labels_im_file).dataobj).astype("uint16") > 0)
+    if parcel_nearest is not None:
+        parcel_nearest = save_memmap(parcel_nearest,
+                                     f"{joblib_dir}/parcel_nearest.npy")
+    with h5py.File(recon_path, 'r') as hf:
+        mod_fit = save_memmap(hf['reconstruction'][:].astype('float32'),
+                              f"{joblib_dir}/mod_fit.npy")
+
+    tissue_maps = prep_tissue_maps(
+        nib.load(t1w2dwi), nib.load(gm_in_dwi), nib.load(vent_csf_in_dwi),
+        nib.load(wm_in_dwi), tiss_class, nib.load(B0_mask))
+    for key, val in tissue_maps.items():
+        if isinstance(val, np.ndarray):
+            tissue_maps[key] = save_memmap(val, f"{joblib_dir}/{key}.npy")
+
+    tracking_data = {
+        "uid": uuid.uuid4().hex,
+        "mod_fit": mod_fit,
+        "tissue_maps": tissue_maps,
+        "B0_mask": save_memmap(
+            np.asarray(nib.load(B0_mask).dataobj).astype("bool"),
+            f"{joblib_dir}/B0_mask.npy"),
+        "seeding_mask": save_memmap(
+            np.asarray(atlas_data_wm_gm_int_img.dataobj).astype("bool"),
+            f"{joblib_dir}/seeding_mask.npy"),
+        "parcel_nearest": parcel_nearest,
+        "waymask_nearest": waymask_nearest,
+    }
+    del mod_fit, tissue_maps, parcel_nearest, waymask_nearest, \
+        atlas_data_wm_gm_int_img
 
     # Commence Ensemble Tractography
     start = time.time()
     stream_counter = 0
+    n_dispatched = 0
+
+    # Accepted-streamline yield of each combination, and shared counts of
+    # the streamlines accepted and the seeds tracked by the workers during a
+    # round
+    n_accepted = np.zeros(len(all_combs), dtype="int64")
+    n_seeded = np.zeros(len(all_combs), dtype="int64")
+    progress = np.lib.format.open_memmap(
+        f"{joblib_dir}/progress.npy", mode="w+", dtype="int64",
+        shape=(len(all_combs),))
+    seeds_tracked = np.lib.format.open_memmap(
+        f"{joblib_dir}/seeds_tracked.npy", mode="w+", dtype="int64",
+        shape=(len(all_combs),))
 
     all_streams = []
     ix = 0
 
     try:
-        while float(stream_counter) < float(target_samples) and \
-                float(ix) < 0.50*float(len(all_combs)):
-            with Parallel(n_jobs=nthreads, backend='loky',
-                          mmap_mode='r+', temp_folder=joblib_dir,
-                          verbose=0, timeout=timeout) as parallel:
+        # A single pool of tracking workers serves every sampling round, so
+        # that each worker builds its direction getters only once
+        with Parallel(n_jobs=nthreads, backend='loky',
+                      mmap_mode='r+', temp_folder=joblib_dir,
+                      verbose=0, timeout=timeout) as parallel:
+            while float(stream_counter) < float(target_samples) and \
+                    float(ix) < 0.50*float(len(all_combs)):
+                # Reallocate seeds towards productive combinations. Workers
+                # stop as soon as the round yields the remaining target.
+                n_seeds = allocate_seeds(n_accepted, n_seeded,
+                                         n_seeds_per_iter, seed_share_cap,
+                                         min_seeds=min_seeds)
+                progress[:] = 0
+                progress.flush()
+                seeds_tracked[:] = 0
+                seeds_tracked.flush()
                 out_streams = parallel(
                     delayed(run_tracking)(
-                        i, recon_path, n_seeds_per_iter, directget,
+                        i, tracking_data, n_seeds[j], directget,
                         maxcrossing, max_length, pft_back_tracking_dist,
                         pft_front_tracking_dist, particle_count,
-                        roi_neighborhood_tol, waymask, min_length,
-                        track_type, min_separation_angle, sphere, tiss_class,
-                        tissues4d, tmp_files_dir) for i in
-                    all_combs)
+                        roi_neighborhood_tol, min_length, track_type,
+                        min_separation_angle, sphere, tiss_class,
+                        random_seed=n_dispatched + j, min_seeds=min_seeds,
+                        progress=progress, task_ix=j,
+                        n_remaining=int(target_samples) - stream_counter,
+                        seeds_tracked=seeds_tracked)
+                    for j, i in enumerate(all_combs))
+                n_dispatched += len(all_combs)
+
+                n_accepted += [len(i) if i is not None else 0 for i in
+                               out_streams]
+                # Only charge combinations for the seeds that they tracked
+                # before the round stopped
+                n_seeded += np.asarray(seeds_tracked)
 
                 out_streams = [i for i in out_streams if i is not None and i is
                                not ArraySequence() and len(i) > 0]
@@ -509,8 +821,8 @@ def track_ensemble(
                     print(f"Fewer than {min_streams} streamlines tracked "
                           f"on last iteration with cache directory: "
                           f"{cache_dir}. Loosening tolerance and "
-                          f"anatomical constraints. Check {tissues4d} or "
-                          f"{recon_path} for errors...")
+                          f"anatomical constraints. Check {labels_im_file} "
+                          f"or {recon_path} for errors...")
                     # if track_type != 'particle':
                     #     tiss_class = 'wb'
                     roi_neighborhood_tol = float(roi_neighborhood_tol) * 1.25
@@ -538,17 +850,17 @@ def track_ensemble(
                 print(Style.RESET_ALL)
         os.system(f"rm -rf {joblib_dir}/*")
     except BaseException:
-        os.system(f"rm -rf {tmp_files_dir} &")
+        os.system(f"rm -rf {joblib_dir} &")
         return None
 
     if ix >= 0.75*len(all_combs) and \
             float(stream_counter) < float(target_samples):
         print(f"Tractography failed. >{len(all_combs)} consecutive sampling "
               f"iterations with few streamlines.")
-        os.system(f"rm -rf {tmp_files_dir} &")
+        os.system(f"rm -rf {joblib_dir} &")
         return None
     else:
-        os.system(f"rm -rf {tmp_files_dir} &")
+        os.system(f"rm -rf {joblib_dir} &")
         print("Tracking Complete: ", str(time.time() - start))
 
     del parallel, all_combs
@@ -562,286 +874,206 @@ def track_ensemble(
         return None
 
 
-def run_tracking(step_curv_combinations, recon_path,
-                 n_seeds_per_iter, directget, maxcrossing, max_length,
-                 pft_back_tracking_dist, pft_front_tracking_dist,
-                 particle_count, roi_neighborhood_tol, waymask, min_length,
-                 track_type, min_separation_angle, sphere, tiss_class,
-                 tissues4d, cache_dir, min_seeds=100):
+# Direction getters and tissue classifiers built by a tracking worker process,
+# reused across all of the tasks that it serves
+_tracking_cache = {}
 
-    import gc
-    import os
-    import h5py
-    from dipy.tracking import utils
-    from dipy.tracking.streamline import select_by_rois
-    from dipy.tracking.local_tracking import LocalTracking, \
-        ParticleFilteringTracking
+
+def get_tracking_objects(tracking_data, directget, curv_thr, sphere,
+                         min_separation_angle, tiss_class):
+    """
+    Get the direction getter and tissue classifier of a tracking worker,
+    building them only once per worker process.
+
+    The discretized SH coefficients are shared by the direction getters of
+    all curvature thresholds, and all objects are cached until the worker
+    serves a different ensemble.
+
+    Parameters
+    ----------
+    tracking_data : dict
+        Shared reconstruction and tissue volumes prepared by
+        `track_ensemble`.
+    directget : str
+        The statistical approach to tracking. Options are: det (deterministic),
+        closest (clos), and prob (probabilistic).
+    curv_thr : float
+        Curvature threshold, i.e. maximum angle between tracking steps.
+    sphere : obj
+        DiPy object for modeling diffusion directions on a sphere.
+    min_separation_angle : float
+        The minimum angle between directions [0, 90].
+    tiss_class : str
+        Tissue classification method.
+
+    Returns
+    -------
+    dg : obj
+        DiPy direction getter.
+    tiss_classifier : obj
+        Tissue classifier object.
+    """
+    from dipy.direction.pmf import SHCoeffPmfGen
     from dipy.direction import (
         ProbabilisticDirectionGetter,
         ClosestPeakDirectionGetter,
         DeterministicMaximumDirectionGetter
     )
-    from nilearn.image import index_img
-    from pynets.dmri.track import prep_tissues
-    from nibabel.streamlines.array_sequence import ArraySequence
-    from nipype.utils.filemanip import copyfile, fname_presuffix
-    import uuid
-    from time import strftime
+    from pynets.dmri.track import tissue_classifier_from_maps
 
-    run_uuid = f"{strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4()}"
+    if _tracking_cache.get("uid") != tracking_data["uid"]:
+        _tracking_cache.clear()
+        _tracking_cache["uid"] = tracking_data["uid"]
 
-    recon_path_tmp_path = fname_presuffix(
-        recon_path,
-        suffix=f"_{'_'.join([str(i) for i in step_curv_combinations])}_"
-               f"{run_uuid}",
-        newpath=cache_dir
-    )
-    copyfile(
-        recon_path,
-        recon_path_tmp_path,
-        copy=True,
-        use_hardlink=False)
-
-    tissues4d_tmp_path = fname_presuffix(
-        tissues4d,
-        suffix=f"_{'_'.join([str(i) for i in step_curv_combinations])}_"
-               f"{run_uuid}",
-        newpath=cache_dir
-    )
-    copyfile(
-        tissues4d,
-        tissues4d_tmp_path,
-        copy=True,
-        use_hardlink=False)
-
-    if waymask is not None:
-        waymask_tmp_path = fname_presuffix(
-            waymask,
-            suffix=f"_{'_'.join([str(i) for i in step_curv_combinations])}_"
-                   f"{run_uuid}",
-            newpath=cache_dir
-        )
-        copyfile(
-            waymask,
-            waymask_tmp_path,
-            copy=True,
-            use_hardlink=False)
+    sphere_key = ("pmf_gen", hash(np.asarray(sphere.vertices).tobytes()))
+    if sphere_key not in _tracking_cache:
+        _tracking_cache[sphere_key] = SHCoeffPmfGen(
+            np.asarray(tracking_data["mod_fit"], dtype=float), sphere, None)
+
+    if directget.lower() in ["probabilistic", "prob"]:
+        dg_class = ProbabilisticDirectionGetter
+    elif directget.lower() in ["closestpeaks", "cp", "clos"]:
+        dg_class = ClosestPeakDirectionGetter
+    elif directget.lower() in ["deterministic", "det"]:
+        dg_class = DeterministicMaximumDirectionGetter
     else:
-        waymask_tmp_path = None
+        raise ValueError(
+            "ERROR: No valid direction getter(s) specified."
+        )
 
-    tissue_img = nib.load(tissues4d_tmp_path)
+    dg_key = (dg_class.__name__, float(curv_thr), sphere_key[1],
+              float(min_separation_angle))
+    if dg_key not in _tracking_cache:
+        _tracking_cache[dg_key] = dg_class(
+            _tracking_cache[sphere_key], float(curv_thr), sphere, 0.1,
+            min_separation_angle=min_separation_angle)
 
-    # Order:
-    B0_mask = index_img(tissue_img, 0)
-    atlas_img = index_img(tissue_img, 1)
-    seeding_mask = index_img(tissue_img, 2)
-    t1w2dwi = index_img(tissue_img, 3)
-    gm_in_dwi = index_img(tissue_img, 4)
-    vent_csf_in_dwi = index_img(tissue_img, 5)
-    wm_in_dwi = index_img(tissue_img, 6)
+    tiss_key = ("tiss_classifier", tiss_class)
+    if tiss_key not in _tracking_cache:
+        _tracking_cache[tiss_key] = tissue_classifier_from_maps(
+            tracking_data["tissue_maps"], tiss_class)
 
-    tiss_classifier = prep_tissues(
-        t1w2dwi,
-        gm_in_dwi,
-        vent_csf_in_dwi,
-        wm_in_dwi,
-        tiss_class,
-        B0_mask
-    )
+    return _tracking_cache[dg_key], _tracking_cache[tiss_key]
+
+
+def run_tracking(step_curv_combinations, tracking_data,
+                 n_seeds_per_iter, directget, maxcrossing, max_length,
+                 pft_back_tracking_dist, pft_front_tracking_dist,
+                 particle_count, roi_neighborhood_tol, min_length,
+                 track_type, min_separation_angle, sphere, tiss_class,
+                 random_seed=42, min_seeds=100, progress=None, task_ix=0,
+                 n_remaining=None, seed_batch_size=50, seeds_tracked=None):
 
-    B0_mask_data = np.asarray(B0_mask.dataobj).astype("bool")
+    import gc
+    from dipy.tracking.local_tracking import LocalTracking, \
+        ParticleFilteringTracking
+    from pynets.dmri.track import get_tracking_objects
+    from pynets.dmri.utils import sample_seeds_from_mask, filter_streamlines
+    from nibabel.streamlines.array_sequence import ArraySequence
 
-    seeding_mask = np.asarray(
-        seeding_mask.dataobj
-    ).astype("bool").astype("int16")
+    # Stop right away if the ensemble has already reached its target
+    if progress is not None and n_remaining is not None and \
+            np.sum(progress) >= n_remaining:
+        return None
 
-    with h5py.File(recon_path_tmp_path, 'r+') as hf:
-        mod_fit = hf['reconstruction'][:].astype('float32')
+    # Read-only volumes shared by track_ensemble
+    B0_mask_data = tracking_data["B0_mask"]
+    seeding_mask = tracking_data["seeding_mask"]
+    parcel_nearest = tracking_data["parcel_nearest"]
+    waymask_nearest = tracking_data["waymask_nearest"]
 
     print("%s%s" % ("Curvature: ", step_curv_combinations[1]))
 
-    # Instantiate DirectionGetter
-    if directget.lower() in ["probabilistic", "prob"]:
-        dg = ProbabilisticDirectionGetter.from_shcoeff(
-            mod_fit,
-            max_angle=float(step_curv_combinations[1]),
-            sphere=sphere,
-            min_separation_angle=min_separation_angle,
-        )
-    elif directget.lower() in ["closestpeaks", "cp"]:
-        dg = ClosestPeakDirectionGetter.from_shcoeff(
-            mod_fit,
-            max_angle=float(step_curv_combinations[1]),
-            sphere=sphere,
-            min_separation_angle=min_separation_angle,
-        )
-    elif directget.lower() in ["deterministic", "det"]:
+    # Instantiate DirectionGetter and tissue classifier, reusing those
+    # already built by this worker process
+    [dg, tiss_classifier] = get_tracking_objects(
+        tracking_data, directget, step_curv_combinations[1], sphere,
+        min_separation_angle, tiss_class)
+    if directget.lower() in ["deterministic", "det"]:
         maxcrossing = 1
-        dg = DeterministicMaximumDirectionGetter.from_shcoeff(
-            mod_fit,
-            max_angle=float(step_curv_combinations[1]),
-            sphere=sphere,
-            min_separation_angle=min_separation_angle,
-        )
-    else:
-        raise ValueError(
-            "ERROR: No valid direction getter(s) specified."
-        )
 
     print("%s%s" % ("Step: ", step_curv_combinations[0]))
 
     # Perform wm-gm interface seeding, using n_seeds at a time
-    seeds = utils.random_seeds_from_mask(
-        seeding_mask > 0,
-        seeds_count=n_seeds_per_iter,
-        seed_count_per_voxel=False,
-        affine=np.eye(4),
-    )
+    seeds = sample_seeds_from_mask(seeding_mask, n_seeds_per_iter,
+                                   random_seed=random_seed)
     if len(seeds) < min_seeds:
         print(UserWarning(
             f"<{min_seeds} valid seed points found in wm-gm interface..."
         ))
         return None
 
-    # print(seeds)
-
-    # Perform tracking
-    if track_type == "local":
-        streamline_generator = LocalTracking(
-            dg,
-            tiss_classifier,
-            seeds,
-            np.eye(4),
-            max_cross=int(maxcrossing),
-            maxlen=int(max_length),
-            step_size=float(step_curv_combinations[0]),
-            fixedstep=False,
-            return_all=True,
-            random_seed=42
-        )
-    elif track_type == "particle":
-        streamline_generator = ParticleFilteringTracking(
-            dg,
-            tiss_classifier,
-            seeds,
-            np.eye(4),
-            max_cross=int(maxcrossing),
-            step_size=float(step_curv_combinations[0]),
-            maxlen=int(max_length),
-            pft_back_tracking_dist=pft_back_tracking_dist,
-            pft_front_tracking_dist=pft_front_tracking_dist,
-            pft_max_trial=20,
-            particle_count=particle_count,
-            return_all=True,
-            random_seed=42
-        )
-    else:
-        raise ValueError(
-            "ERROR: No valid tracking method(s) specified.")
-
-    # Filter resulting streamlines by those that stay entirely
-    # inside the brain
-    try:
-        roi_proximal_streamlines = utils.target(
-            streamline_generator, np.eye(4),
-            B0_mask_data.astype('bool'), include=True
-        )
-    except BaseException:
-        print('No streamlines found inside the brain! '
-              'Check registrations.')
-        return None
-
-    del mod_fit, seeds, tiss_classifier, streamline_generator, \
-        B0_mask_data, seeding_mask, dg
-
-    B0_mask.uncache()
-    atlas_img.uncache()
-    t1w2dwi.uncache()
-    gm_in_dwi.uncache()
-    vent_csf_in_dwi.uncache()
-    wm_in_dwi.uncache()
-    atlas_img.uncache()
-    tissue_img.uncache()
-    gc.collect()
-
-    # Filter resulting streamlines by roi-intersection
-    # characteristics
-    atlas_data = np.array(atlas_img.dataobj).astype("uint16")
-
-    # Build mask vector from atlas for later roi filtering
-    parcels = []
-    i = 0
-    intensities = [i for i in np.unique(atlas_data) if i != 0]
-    for roi_val in intensities:
-        parcels.append(atlas_data == roi_val)
-        i += 1
-
-    parcel_vec = list(np.ones(len(parcels)).astype("bool"))
-
-    try:
-        roi_proximal_streamlines = \
-            nib.streamlines.array_sequence.ArraySequence(
-                select_by_rois(
-                    roi_proximal_streamlines,
-                    affine=np.eye(4),
-                    rois=parcels,
-                    include=parcel_vec,
-                    mode="any",
-                    tol=roi_neighborhood_tol,
-                )
+    # Track and filter the seeds in small batches, so that tracking can stop
+    # as soon as the ensemble reaches its target
+    roi_proximal_streamlines = []
+    for seed_batch in np.array_split(
+            seeds, int(np.ceil(len(seeds) / float(seed_batch_size)))):
+        if progress is not None and n_remaining is not None and \
+                np.sum(progress) >= n_remaining:
+            print("Target streamline count reached...")
+            break
+
+        # Perform tracking
+        if track_type == "local":
+            streamline_generator = LocalTracking(
+                dg,
+                tiss_classifier,
+                seed_batch,
+                np.eye(4),
+                max_cross=int(maxcrossing),
+                maxlen=int(max_length),
+                step_size=float(step_curv_combinations[0]),
+                fixedstep=False,
+                return_all=True,
+                random_seed=random_seed
             )
-        print("%s%s" % ("Filtering by: \nNode intersection: ",
-                        len(roi_proximal_streamlines)))
-    except BaseException:
-        print('No streamlines found to connect any parcels! '
-              'Check registrations.')
-        return None
-
-    try:
-        roi_proximal_streamlines = nib.streamlines. \
-            array_sequence.ArraySequence(
-                [
-                    s for s in roi_proximal_streamlines
-                    if len(s) >= float(min_length)
-                ]
+        elif track_type == "particle":
+            streamline_generator = ParticleFilteringTracking(
+                dg,
+                tiss_classifier,
+                seed_batch,
+                np.eye(4),
+                max_cross=int(maxcrossing),
+                step_size=float(step_curv_combinations[0]),
+                maxlen=int(max_length),
+                pft_back_tracking_dist=pft_back_tracking_dist,
+                pft_front_tracking_dist=pft_front_tracking_dist,
+                pft_max_trial=20,
+                particle_count=particle_count,
+                return_all=True,
+                random_seed=random_seed
             )
-        print(f"Minimum fiber length >{min_length}mm: "
-              f"{len(roi_proximal_streamlines)}")
-    except BaseException:
-        print('No streamlines remaining after minimal length criterion.')
-        return None
-
-    if waymask is not None and os.path.isfile(waymask_tmp_path):
-        waymask_data = np.asarray(nib.load(waymask_tmp_path
-                                           ).dataobj).astype("bool")
-        try:
-            roi_proximal_streamlines = roi_proximal_streamlines[
-                utils.near_roi(
-                    roi_proximal_streamlines,
-                    np.eye(4),
-                    waymask_data,
-                    tol=int(round(roi_neighborhood_tol*0.50, 1)),
-                    mode="all"
-                )
-            ]
-            print("%s%s" % ("Waymask proximity: ",
-                            len(roi_proximal_streamlines)))
-            del waymask_data
-        except BaseException:
-            print('No streamlines remaining in waymask\'s vacinity.')
-            return None
-
-    hf.close()
-    del parcels, atlas_data
-
-    tmp_files = [tissues4d_tmp_path, waymask_tmp_path, recon_path_tmp_path]
-    for j in tmp_files:
-        if j is not None:
-            if os.path.isfile(j):
-                os.system(f"rm -f {j} &")
+        else:
+            raise ValueError(
+                "ERROR: No valid tracking method(s) specified.")
+
+        # Filter resulting streamlines by those that stay inside the brain,
+        # intersect any parcel, satisfy the minimum length and stay in the
+        # waymask's vicinity, all in one pass over the batch
+        batch_streamlines = list(streamline_generator)
+        keep = filter_streamlines(
+            batch_streamlines, B0_mask_data, parcel_nearest,
+            roi_neighborhood_tol, min_length,
+            waymask_nearest=waymask_nearest,
+            waymask_tol=int(round(roi_neighborhood_tol*0.50, 1)))
+        roi_proximal_streamlines.extend(
+            [batch_streamlines[i].astype("float32") for i in
+             np.flatnonzero(keep)])
+        if progress is not None:
+            progress[task_ix] += int(np.sum(keep))
+        if seeds_tracked is not None:
+            seeds_tracked[task_ix] += len(seed_batch)
+        del streamline_generator, batch_streamlines
+
+    print(f"Filtering by: \nNode intersection, minimum fiber length "
+          f">{min_length}mm and waymask proximity: "
+          f"{len(roi_proximal_streamlines)}")
+
+    del seeds, tiss_classifier, B0_mask_data, seeding_mask, dg, \
+        parcel_nearest, waymask_nearest
+    gc.collect()
 
     if len(roi_proximal_streamlines) > 0:
-        return ArraySequence([s.astype("float32") for s in
-                              roi_proximal_streamlines])
+        return ArraySequence(roi_proximal_streamlines)
     else:
         return None
@@ -101,6 +101,383 @@ def generate_sl(streamlines):
         yield sl
 
 
+def sample_seeds_from_mask(mask, seeds_count, random_seed=None):
+    """
+    Draw seed points uniformly jittered within randomly selected voxels of a
+    mask.
+
+    Voxels are visited in a random order, cycling through the whole mask
+    before any voxel is seeded twice, as in DiPy's `random_seeds_from_mask`
+    with `seed_count_per_voxel=False`, but using a single random generator
+    so that the cost scales with `seeds_count` rather than the mask size.
+
+    Parameters
+    ----------
+    mask : ndarray
+        3D boolean seeding mask.
+    seeds_count : int
+        Number of seeds to draw.
+    random_seed : int
+        Seed of the random generator. Default is None.
+
+    Returns
+    -------
+    seeds : ndarray
+        (seeds_count, 3) array of seed points in voxel coordinates.
+    """
+    vox = np.flatnonzero(np.asarray(mask).ravel())
+    if len(vox) == 0:
+        return np.empty((0, 3))
+
+    rng = np.random.default_rng(random_seed)
+    n_cycles = int(seeds_count) // len(vox) + 1
+    if n_cycles == 1:
+        ix = rng.choice(len(vox), int(seeds_count), replace=False)
+    else:
+        ix = np.concatenate([rng.permutation(len(vox)) for _ in
+                             range(n_cycles)])[:int(seeds_count)]
+    seeds = np.column_stack(np.unravel_index(vox[ix], mask.shape))
+    return seeds + rng.random((len(seeds), 3)) - 0.5
+
+
+def nearest_mask_voxels(mask):
+    """
+    Map every voxel of a volume to the nearest nonzero voxel of a mask, using
+    a single Euclidean distance transform.
+
+    Parameters
+    ----------
+    mask : ndarray
+        3D boolean mask.
+
+    Returns
+    -------
+    nearest : ndarray
+        (X, Y, Z, 3) int16 array of the voxel coordinates of the nearest
+        voxel of `mask`, or None if `mask` is empty.
+    """
+    from scipy.ndimage import distance_transform_edt
+
+    mask = np.asarray(mask).astype("bool")
+    if not np.any(mask):
+        return None
+    nearest = distance_transform_edt(~mask, return_distances=False,
+                                     return_indices=True)
+    return np.moveaxis(nearest, 0, -1).astype("int16")
+
+
+def filter_streamlines(streamlines, brain_mask, parcel_nearest, roi_tol,
+                       min_length, waymask_nearest=None, waymask_tol=None):
+    """
+    Filter a batch of streamlines by brain mask, ROI proximity, length and
+    waymask proximity in a single vectorized pass over their points.
+
+    A streamline is retained if any of its points falls within `brain_mask`,
+    any of its points lies within `roi_tol` of the center of a parcel voxel,
+    it has at least `min_length` points and, if `waymask_nearest` is given,
+    all of its points lie within `waymask_tol` of the center of a waymask
+    voxel. Proximity is measured to the mask voxel nearest to the voxel
+    containing each point, as given by `nearest_mask_voxels`, so that a
+    point is never admitted beyond the tolerance. As in DiPy's
+    `select_by_rois` and `near_roi`, tolerances are at least the distance
+    from a voxel center to its corner.
+
+    Parameters
+    ----------
+    streamlines : list
+        List of (n_points, 3) arrays of streamline points in voxel-space.
+    brain_mask : ndarray
+        3D boolean brain mask.
+    parcel_nearest : ndarray
+        Nearest parcel voxel of every voxel, from `nearest_mask_voxels`, or
+        None if there are no parcels.
+    roi_tol : float
+        Distance, in voxels, from the parcels within which a streamline is
+        considered to intersect them.
+    min_length : int
+        Minimum number of streamline points.
+    waymask_nearest : ndarray
+        Nearest waymask voxel of every voxel, from `nearest_mask_voxels`.
+        Default is None, for no waymask constraint.
+    waymask_tol : float
+        Distance, in voxels, from the waymask within which all points of a
+        streamline must lie.
+
+    Returns
+    -------
+    keep : ndarray
+        Boolean array indicating the streamlines retained.
+    """
+    if len(streamlines) == 0 or parcel_nearest is None:
+        return np.zeros(len(streamlines), dtype="bool")
+
+    dtc = np.sqrt(3) / 2
+    lengths = np.array([len(s) for s in streamlines], dtype="int64")
+    starts = np.cumsum(lengths) - lengths
+    points = np.concatenate(streamlines)
+    dims = np.array(brain_mask.shape[:3])
+    vox = np.floor(points + 0.5).astype("int64")
+    inside = np.all((vox >= 0) & (vox < dims), axis=1)
+    vox = tuple(np.clip(vox, 0, dims - 1).T)
+
+    keep = (lengths >= float(min_length)) & np.logical_or.reduceat(
+        inside & np.asarray(brain_mask)[vox], starts)
+    keep &= np.logical_or.reduceat(
+        np.linalg.norm(points - parcel_nearest[vox], axis=1) <=
+        max(float(roi_tol), dtc), starts)
+    if waymask_nearest is not None:
+        keep &= np.logical_and.reduceat(
+            np.linalg.norm(points - waymask_nearest[vox], axis=1) <=
+            max(float(waymask_tol), dtc), starts)
+    return keep
+
+
+def streamline_buffer(streamlines):
+    """
+    Flat point buffer of a set of streamlines.
+
+    Points are read directly from the `_data` buffer of an ArraySequence
+    using its per-streamline offsets, so that no per-streamline arrays are
+    created. Views left by indexing or slicing are gathered in one step.
+
+    Parameters
+    ----------
+    streamlines : ArraySequence
+        DiPy list/array-like object of streamline points from tractography.
+
+    Returns
+    -------
+    points : ndarray
+        N x 3 array of the points of all streamlines, in order.
+    lengths : ndarray
+        Number of points of each streamline.
+    """
+    from nibabel.streamlines import ArraySequence
+
+    if not isinstance(streamlines, ArraySequence):
+        streamlines = ArraySequence(streamlines)
+    lengths = np.asarray(streamlines._lengths, dtype="int64")
+    offsets = np.asarray(streamlines._offsets, dtype="int64")
+    starts = np.cumsum(lengths) - lengths
+    if len(streamlines._data) == np.sum(lengths) and \
+            np.array_equal(offsets, starts):
+        return streamlines._data, lengths
+    return streamlines._data[np.repeat(offsets - starts, lengths) +
+                             np.arange(np.sum(lengths))], lengths
+
+
+def positive_voxel_streamlines(streamlines, affine=np.eye(4)):
+    """
+    Identify streamlines whose points all map to non-negative voxel indices.
+
+    Parameters
+    ----------
+    streamlines : ArraySequence
+        DiPy list/array-like object of streamline points from tractography.
+    affine : ndarray
+        Mapping from voxel coordinates to streamline points. Default is the
+        identity.
+
+    Returns
+    -------
+    keep : ndarray
+        Boolean array indicating the streamlines with no negative voxel
+        indices.
+    """
+    from dipy.tracking._utils import _mapping_to_voxel
+
+    points, lengths = streamline_buffer(streamlines)
+    keep = np.zeros(len(lengths), dtype="bool")
+    nonempty = lengths > 0
+    if not np.any(nonempty):
+        return keep
+
+    lin_T, offset = _mapping_to_voxel(affine)
+    inds = np.dot(points, lin_T)
+    inds += offset
+    keep[nonempty] = np.minimum.reduceat(
+        inds.min(axis=1), (np.cumsum(lengths) - lengths)[nonempty]
+    ).round(decimals=6) >= 0
+    return keep
+
+
+def streamline_density_map(streamlines, vol_dims, affine=np.eye(4)):
+    """
+    Count the number of unique streamlines that pass through each voxel.
+
+    Equivalent to DiPy's `density_map`, computed with a single `bincount`
+    over the points of all streamlines.
+
+    Parameters
+    ----------
+    streamlines : ArraySequence
+        DiPy list/array-like object of streamline points from tractography.
+    vol_dims : tuple
+        Shape of the volume to be returned.
+    affine : ndarray
+        Mapping from voxel coordinates to streamline points. Default is the
+        identity.
+
+    Returns
+    -------
+    counts : ndarray
+        Number of streamlines passing through each voxel.
+    """
+    from dipy.tracking._utils import _mapping_to_voxel
+
+    vol_dims = tuple(int(i) for i in vol_dims[:3])
+    n_vox = int(np.prod(vol_dims))
+    points, lengths = streamline_buffer(streamlines)
+    if len(points) == 0:
+        return np.zeros(vol_dims, dtype="int64")
+
+    lin_T, offset = _mapping_to_voxel(affine)
+    inds = np.dot(points, lin_T)
+    inds += offset
+    if inds.min().round(decimals=6) < 0:
+        raise IndexError("streamline has points that map to negative voxel "
+                         "indices")
+    inds = inds.astype(np.intp)
+    if np.any(inds >= np.array(vol_dims)):
+        raise IndexError("streamline has points outside of the volume")
+
+    # Count each streamline at most once per voxel. Consecutive points
+    # mostly share a voxel, so repeats are dropped before the full sort.
+    vox = np.ravel_multi_index(tuple(inds.T), vol_dims) + np.repeat(
+        np.arange(len(lengths), dtype="int64") * n_vox, lengths)
+    vox = np.sort(vox[np.r_[True, vox[1:] != vox[:-1]]])
+    vox = vox[np.r_[True, vox[1:] != vox[:-1]]] % n_vox
+    return np.bincount(vox, minlength=n_vox).reshape(vol_dims)
+
+
+def iter_streamline_batches(streams, ref_img, batch_size=5000):
+    """
+    Lazily read a tractogram file in fixed-size batches of streamlines.
+
+    Streamlines are streamed from disk and mapped into the VOXMM space of
+    `ref_img`, with voxel centers at integer coordinates (i.e. the NIFTI
+    origin), so that no more than `batch_size` streamlines are held in
+    memory at once.
+
+    Parameters
+    ----------
+    streams : str
+        File path to streamline array sequence in .trk format.
+    ref_img : Nifti1Image
+        Reference image defining the voxel grid of the output coordinates.
+    batch_size : int
+        Number of streamlines per batch. Default is 5000.
+
+    Yields
+    ------
+    batch : list
+        List of up to `batch_size` (n_points, 3) float32 arrays of streamline
+        points.
+    """
+    from nibabel.affines import apply_affine
+
+    rasmm_to_voxmm = np.dot(
+        np.diag(list(ref_img.header.get_zooms()[:3]) + [1]),
+        np.linalg.inv(ref_img.affine))
+
+    batch = []
+    for sl in nib.streamlines.load(streams,
+                                   lazy_load=True).tractogram.streamlines:
+        batch.append(apply_affine(rasmm_to_voxmm, sl).astype(np.float32))
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+def streamline_label_counts(streamlines, atlas_data, vox_dims, error_margin,
+                            chunk_size=2000000):
+    """
+    Count, for every streamline, the atlas voxels of each label falling within
+    a spherical neighborhood of its points.
+
+    A single sphere offset kernel is precomputed for `error_margin` and added
+    to all points of a chunk of streamlines at once, so that fiber-ROI
+    intersection is evaluated with bulk array operations rather than one
+    sphere construction per point.
+
+    Parameters
+    ----------
+    streamlines : list
+        List of (n_points, 3) arrays of streamline points in voxel-space.
+    atlas_data : ndarray
+        3D array of integer atlas label intensities.
+    vox_dims : array/tuple
+        1D vector (x, y, z) of mm voxel resolution.
+    error_margin : int
+        Euclidean margin of error, in mm, for classifying a streamline point
+        as intersecting an ROI.
+    chunk_size : int
+        Approximate number of (point, sphere offset) pairs evaluated at once.
+        Default is 2000000.
+
+    Returns
+    -------
+    sl_ix : ndarray
+        Streamline index of each (streamline, label) pair, in ascending order.
+    labels : ndarray
+        Label intensity of each (streamline, label) pair, ascending within a
+        streamline.
+    counts : ndarray
+        Number of voxels of the label falling within the neighborhood of the
+        streamline's points, summed over points.
+    lengths : ndarray
+        Number of points of each streamline.
+    """
+    from pynets.core.nodemaker import get_sphere_kernel
+
+    kernel = get_sphere_kernel(error_margin, vox_dims)
+    dims = atlas_data.shape[:3]
+    atlas_flat = np.around(np.asarray(atlas_data)).astype("int64").ravel()
+    n_labels = int(atlas_flat.max()) + 1
+
+    lengths = np.array([len(s) for s in streamlines], dtype="int64")
+    ends = np.cumsum(lengths)
+    max_points = max(1, chunk_size // len(kernel))
+
+    keys = []
+    counts = []
+    start = 0
+    while start < len(streamlines):
+        stop = max(int(np.searchsorted(ends, ends[start] - lengths[start] +
+                                       max_points, side="right")), start + 1)
+
+        # Map the streamline coordinates to voxel coordinates, then each
+        # voxel to its spherical neighborhood
+        points = np.floor(np.concatenate(streamlines[start:stop]) + 0.5)
+        sphere = np.round(kernel[np.newaxis, :, :] +
+                          points[:, np.newaxis, :]).reshape(-1, 3)
+        ids = np.repeat(np.repeat(np.arange(start, stop),
+                                  lengths[start:stop]), len(kernel))
+        inside = np.all((sphere >= 0) & (sphere < dims), axis=1)
+        labs = atlas_flat[np.ravel_multi_index(
+            tuple(sphere[inside].astype("int64").T), dims)]
+        ids = ids[inside]
+        in_roi = labs > 0
+
+        key, count = np.unique(ids[in_roi] * n_labels + labs[in_roi],
+                               return_counts=True)
+        keys.append(key)
+        counts.append(count)
+        start = stop
+
+    if len(keys) == 0:
+        empty = np.array([], dtype="int64")
+        return empty, empty, empty, lengths
+
+    key, inv = np.unique(np.concatenate(keys), return_inverse=True)
+    counts = np.bincount(inv.ravel(), weights=np.concatenate(counts)
+                         ).astype("int64")
+
+    return key // n_labels, key % n_labels, counts, lengths
+
+
 def extract_b0(in_file, b0_ixs, out_path=None):
     """
     Extract the *b0* volumes from a DWI dataset.
@@ -170,31 +547,18 @@ def evaluate_streamline_plausibility(dwi_data, gtab, mask_data, streamlines,
     """
     import dipy.tracking.life as life
     import dipy.core.optimize as opt
-    from dipy.tracking._utils import _mapping_to_voxel
     # from dipy.data import get_sphere
     from dipy.tracking import utils
     from dipy.tracking.streamline import Streamlines
 
     original_count = len(streamlines)
 
-    streamlines_long = nib.streamlines. \
-        array_sequence.ArraySequence(
-            [
-                s
-                for s in streamlines
-                if len(s) >= float(10)
-            ]
-        )
     print('Removing streamlines with negative voxel indices...')
-    # Remove any streamlines with negative voxel indices
-    lin_T, offset = _mapping_to_voxel(np.eye(4))
-    streamlines_positive = []
-    for sl in streamlines_long:
-        inds = np.dot(sl, lin_T)
-        inds += offset
-        if not inds.min().round(decimals=6) < 0:
-            streamlines_positive.append(sl)
-    del streamlines_long
+    # Remove any short streamlines or streamlines with negative voxel indices
+    streamlines = nib.streamlines.ArraySequence(streamlines)
+    streamlines_positive = streamlines[
+        (np.asarray(streamlines._lengths) >= float(10)) &
+        positive_voxel_streamlines(streamlines)]
 
     # Filter resulting streamlines by those that stay entirely
     # inside the ROI of interest
@@ -70,7 +70,7 @@ def indx_3dto1d(idx, sz):
     return idx1
 
 
-def ncut(W, nbEigenValues):
+def ncut(W, nbEigenValues, solver="arpack", init_vec=None):
     """
     This function performs the first step of normalized cut spectral
     clustering. The normalized LaPlacian is calculated on the similarity
@@ -78,6 +78,13 @@ def ncut(W, nbEigenValues):
     eigenvectors corresponds to the maximum number of classes (K) that will be
     produced by the clustering algorithm.
 
+    Two eigensolvers are available. `arpack` uses implicitly restarted
+    Lanczos iterations (`eigsh`), which can be slow to converge for large k on
+    whole-brain masks. `lobpcg` solves for the smallest eigenvalues of the
+    complementary LaPlacian using block iterations, preconditioned with
+    algebraic multigrid if pyamg is installed (or a Jacobi preconditioner
+    otherwise), and converges quickly from a warm start.
+
     Parameters
     ----------
     W : array
@@ -88,6 +95,12 @@ def ncut(W, nbEigenValues):
     nbEigenValues : int
         Number of eigenvectors that should be calculated, this determines the
         maximum number of clusters (K) that can be derived from the result.
+    solver : str
+        Eigensolver backend. Options are `arpack` (default) and `lobpcg`.
+    init_vec : array
+        Optional #feature x #eigenvector array of eigenvectors returned by a
+        previous call to `ncut` on a similar matrix (e.g. another bootstrapped
+        sample), used to warm-start the eigensolver.
 
     Returns
     -------
@@ -132,10 +145,30 @@ def ncut(W, nbEigenValues):
     Dinvsqrt = spdiags((1.0 / np.sqrt(d + eps)), [0], m, m, "csc")
     P = Dinvsqrt * (W * Dinvsqrt)
 
-    # Perform the eigen decomposition
-    eigen_val, eigen_vec = eigsh(
-        P, nbEigenValues, maxiter=maxiterations, tol=eigsErrorTolerence,
-        which="LA")
+    # Eigenvectors returned by ncut are scaled by Dinvsqrt, so undo the
+    # scaling to recover a basis for the eigenvectors of P
+    if init_vec is not None:
+        init_vec = np.asarray(init_vec)
+        if init_vec.shape[0] != m:
+            raise ValueError("Warm-start eigenvectors must have one row per"
+                             " feature in W.")
+        init_vec = np.sqrt(np.asarray(d).ravel() + eps)[:, np.newaxis] * \
+            init_vec
+        init_vec = init_vec[:, :nbEigenValues]
+
+    # Perform the eigen decomposition, from a fixed starting vector unless
+    # warm-started, so that repeated calls yield the same eigenvectors
+    if solver == "arpack":
+        eigen_val, eigen_vec = eigsh(
+            P, nbEigenValues, maxiter=maxiterations, tol=eigsErrorTolerence,
+            which="LA",
+            v0=np.random.RandomState(42).uniform(-1, 1, m) if init_vec is
+            None else init_vec.sum(1))
+    elif solver == "lobpcg":
+        eigen_val, eigen_vec = _lobpcg_eigsh(P, nbEigenValues, init_vec)
+    else:
+        raise ValueError(f"Eigensolver {solver} not recognized. Options are "
+                         f"arpack and lobpcg.")
 
     # Sort the eigen_vals so that the first is the largest
     i = np.argsort(-eigen_val)
@@ -153,6 +186,44 @@ def ncut(W, nbEigenValues):
     return eigen_val, eigen_vec
 
 
+def _lobpcg_eigsh(P, nbEigenValues, init_vec=None, tol=1e-3,
+                  maxiter=40):
+    """
+    Computes the largest eigenpairs of the normalized affinity P as the
+    smallest eigenpairs of L = I - P using a preconditioned LOBPCG solver.
+    """
+    from scipy.sparse import identity, spdiags
+    from scipy.sparse.linalg import lobpcg
+
+    m = P.shape[0]
+
+    # Small diagonal shift keeps L positive definite for the preconditioner
+    L = (identity(m, format="csr") * (1 + 1e-5) - P).tocsr()
+
+    try:
+        from pyamg import smoothed_aggregation_solver
+
+        M = smoothed_aggregation_solver(L).aspreconditioner()
+    except ImportError:
+        # Fall back to a Jacobi preconditioner
+        diag = L.diagonal()
+        diag[diag == 0] = 1
+        M = spdiags(1.0 / diag, [0], m, m, "csr")
+
+    # Pad warm-start vectors with random ones to oversample the block
+    n_block = min(m - 1, nbEigenValues + max(5, nbEigenValues // 10))
+    X = np.random.RandomState(42).rand(m, n_block)
+    if init_vec is not None:
+        X[:, : init_vec.shape[1]] = init_vec
+
+    eigen_val, eigen_vec = lobpcg(L, X, M=M, tol=tol, maxiter=maxiter,
+                                  largest=False)
+    eigen_val = 1 + 1e-5 - eigen_val
+
+    i = np.argsort(-eigen_val)[:nbEigenValues]
+    return eigen_val[i], eigen_vec[:, i]
+
+
 def discretisation(eigen_vec):
     """
     This function performs the second step of normalized cut clustering which
@@ -290,7 +361,30 @@ def discretisation(eigen_vec):
         return eigenvec_discrete
 
 
-def parcellate_ncut(W, k, mask_img):
+def discrete_to_labels(eigenvec_discrete):
+    """
+    Collapses discretised eigenvectors into a vector of cluster labels,
+    renumbered to be contiguous and starting at 1.
+
+    Parameters
+    ----------
+    eigenvec_discrete : Compressed Sparse Matrix
+        Discretised eigenvector outputs of `discretisation`, with exactly one
+        non-zero entry per row.
+
+    Returns
+    -------
+    labels : array
+        1D array of contiguous cluster labels, one per feature.
+    """
+    # Each row holds a single one, so its column is the cluster assignment
+    assignments = np.asarray(eigenvec_discrete.argmax(axis=1)).ravel()
+
+    # Renumber clusters to make them contiguous
+    return np.unique(assignments, return_inverse=True)[1].ravel() + 1
+
+
+def parcellate_ncut(W, k, mask_img, solver="arpack", init_vec=None):
     """
     Converts a connectivity matrix into a nifti file where each voxel
     intensity corresponds to the number of the cluster to which it belongs.
@@ -307,6 +401,11 @@ def parcellate_ncut(W, k, mask_img):
     mask_img : Nifti1Image
         3D NIFTI file containing a mask, which restricts the voxels used in
         the analysis.
+    solver : str
+        Eigensolver backend passed to `ncut`. Options are `arpack` (default)
+        and `lobpcg`.
+    init_vec : array
+        Optional eigenvectors from a previous `ncut` used as a warm start.
 
     References
     ----------
@@ -319,36 +418,105 @@ def parcellate_ncut(W, k, mask_img):
     # We only have to calculate the eigendecomposition of the LaPlacian once,
     # for the largest number of clusters provided. This provides a significant
     # speedup, without any difference to the results.
-    [_, eigenvec] = ncut(W, k)
+    [_, eigenvec] = ncut(W, k, solver=solver, init_vec=init_vec)
 
     # Calculate each desired clustering result
     eigenvec_discrete = discretisation(eigenvec[:, :k])
 
     # Transform the discretised eigenvectors into a single vector where the
     # value corresponds to the cluster # of the corresponding ROI
-    a = eigenvec_discrete[:, 0].todense()
-
-    for i in range(1, k):
-        a = a + (i + 1) * eigenvec_discrete[:, i]
-
-    unique_a = sorted(set(np.array(a.flatten().tolist()[0])))
-
-    # Renumber clusters to make them non-contiguous
-    b = np.zeros((len(a), 1))
-    for i in range(0, len(unique_a)):
-        b[a == unique_a[i]] = i + 1
+    b = discrete_to_labels(eigenvec_discrete)
 
     imdat = mask_img.get_fdata()
     imdat[imdat > 0] = 1
-    imdat[imdat > 0] = np.short(b[0: int(np.sum(imdat))].flatten())
+    imdat[imdat > 0] = np.short(b[0: int(np.sum(imdat))])
 
-    del a, b, W
+    del b, W
 
     return nib.Nifti1Image(
         imdat.astype("uint16"), mask_img.get_affine(), mask_img.get_header()
     )
 
 
+def benchmark_ncut_solvers(mask_shape=(24, 24, 24), k=50,
+                           n_timepoints=120, solvers=("arpack", "lobpcg"),
+                           noise=1.0, seed=42):
+    """
+    Benchmarks ncut eigensolver backends on a synthetic spherical mask with
+    planted, spatially contiguous parcels.
+
+    Parameters
+    ----------
+    mask_shape : tuple
+        Shape of the synthetic volume containing the spherical mask.
+    k : int
+        Numbers of planted parcels and of clusters that will be generated.
+    n_timepoints : int
+        Number of synthetic time-points.
+    solvers : tuple
+        Eigensolver backends to compare. The first is used as the reference
+        partition for agreement scores.
+    noise : float
+        Standard deviation of the Gaussian noise added to each voxel.
+    seed : int
+        Random seed.
+
+    Returns
+    -------
+    results : dict
+        Dictionary keyed by solver, with the runtime in seconds (`time`), the
+        number of clusters recovered (`n_clusters`), and the adjusted Rand
+        index against the planted parcels (`ari_truth`) and against the
+        reference solver (`ari_reference`).
+    """
+    import time
+    from sklearn.cluster import KMeans
+    from sklearn.metrics import adjusted_rand_score
+
+    rng = np.random.RandomState(seed)
+
+    # Spherical mask split into k contiguous parcels via k-means on the voxel
+    # coordinates
+    grid = np.indices(mask_shape).reshape(3, -1).T
+    center = (np.array(mask_shape) - 1) / 2.0
+    radius = min(mask_shape) / 2.0 - 1
+    mask_data = (np.linalg.norm(grid - center, axis=1) <= radius).reshape(
+        mask_shape)
+    mask_img = nib.Nifti1Image(mask_data.astype("uint8"), np.eye(4))
+    coords = np.argwhere(mask_data)
+    truth = KMeans(n_clusters=k, n_init=1, random_state=seed).fit_predict(
+        coords)
+
+    latent = rng.randn(n_timepoints, k)
+    ts_data = latent[:, truth] + noise * rng.randn(n_timepoints,
+                                                   len(truth))
+
+    rows, cols = mask_edges(mask_img)
+    W = edge_correlations(ts_data.astype("float32"), rows, cols,
+                          r_thresh=0)
+
+    results = dict()
+    reference = None
+    for solver in solvers:
+        start = time.time()
+        [_, eigenvec] = ncut(W, k, solver=solver)
+        labels = discrete_to_labels(discretisation(eigenvec[:, :k]))
+        elapsed = time.time() - start
+        if reference is None:
+            reference = labels
+        results[solver] = {
+            "time": elapsed,
+            "n_clusters": len(np.unique(labels)),
+            "ari_truth": adjusted_rand_score(truth, labels),
+            "ari_reference": adjusted_rand_score(reference, labels),
+        }
+        print(f"{solver}: {elapsed:.2f}s, "
+              f"ARI (truth): {results[solver]['ari_truth']:.3f}, "
+              f"ARI ({solvers[0]}): {results[solver]['ari_reference']:.3f}")
+
+    return results
+
+
 def make_local_connectivity_scorr(func_img, clust_mask_img, thresh):
     """
     Constructs a spatially constrained connectivity matrix from a fMRI dataset.
@@ -725,6 +893,592 @@ def ensemble_parcellate(infiles, k):
     return out_img
 
 
+def mask_edges(mask_img, connectivity=None):
+    """
+    Enumerates the edges of the spatially-constrained neighborhood graph of
+    the voxels in a mask, in the same voxel order as `apply_mask`.
+
+    Parameters
+    ----------
+    mask_img : Nifti1Image
+        3D NIFTI file containing a mask, which restricts the voxels used in
+        the analysis.
+    connectivity : Compressed Sparse Matrix
+        Optional #voxel x #voxel local connectivity structure (e.g. from
+        `make_local_connectivity_tcorr`) whose sparsity pattern defines the
+        neighborhood. If omitted or of mismatched shape, the 26-neighborhood
+        grid graph of the mask is used instead.
+
+    Returns
+    -------
+    rows : array
+        Row voxel indices of each (upper-triangular) edge.
+    cols : array
+        Column voxel indices of each (upper-triangular) edge.
+    """
+    from scipy.sparse import triu, issparse
+    from sklearn.feature_extraction import image
+
+    mask_data = np.asarray(mask_img.dataobj).astype("bool")
+    n_voxels = int(np.sum(mask_data))
+
+    if issparse(connectivity) and connectivity.shape == (n_voxels,
+                                                         n_voxels):
+        graph = connectivity
+    else:
+        shape = mask_data.shape
+        graph = image.grid_to_graph(n_x=shape[0], n_y=shape[1],
+                                    n_z=shape[2], mask=mask_data)
+
+    graph = triu(abs(graph) + abs(graph.T), k=1).tocoo()
+
+    return graph.row.astype("int32"), graph.col.astype("int32")
+
+
+def edge_correlations(ts_data, rows, cols, r_thresh=0.4, chunk=100000):
+    """
+    Builds a spatially-constrained temporal correlation matrix by correlating
+    the time-series of the voxels joined by each neighborhood graph edge.
+
+    Parameters
+    ----------
+    ts_data : array
+        A #timepoints x #voxels array of masked fMRI data.
+    rows : array
+        Row voxel indices of the neighborhood graph edges (see `mask_edges`).
+    cols : array
+        Column voxel indices of the neighborhood graph edges.
+    r_thresh : float
+        Correlation coefficients lower than this value will be removed from
+        the matrix (set to zero).
+    chunk : int
+        Number of edges correlated at a time, which bounds memory use.
+
+    Returns
+    -------
+    W : Compressed Sparse Matrix
+        A symmetric #voxel x #voxel Scipy sparse matrix of correlations, with
+        ones along the diagonal.
+    """
+    from scipy.sparse import coo_matrix, identity
+
+    z = ts_data - ts_data.mean(axis=0)
+    z /= np.linalg.norm(z, axis=0) + np.finfo("float32").eps
+    weights = np.empty(len(rows), dtype="float32")
+    for start in range(0, len(rows), chunk):
+        stop = start + chunk
+        weights[start:stop] = np.einsum("ij,ij->j", z[:, rows[start:stop]],
+                                        z[:, cols[start:stop]])
+    weights[weights < r_thresh] = 0
+
+    n_voxels = ts_data.shape[1]
+    W = coo_matrix((weights, (rows, cols)),
+                   shape=(n_voxels, n_voxels)).tocsc()
+    W = W + W.T + identity(n_voxels, dtype="float32", format="csc")
+    W.eliminate_zeros()
+
+    return W
+
+
+def cut_tree_multi_k(children, n_leaves, k_list):
+    """
+    Cuts an agglomerative clustering tree at several cluster levels.
+
+    Parameters
+    ----------
+    children : array
+        The (#leaves - 1) x 2 array of merged nodes of a full agglomerative
+        tree, in merge order (i.e. `AgglomerativeClustering.children_`).
+    n_leaves : int
+        Number of leaves (i.e. voxels) of the tree.
+    k_list : list
+        Numbers of clusters at which to cut the tree.
+
+    Returns
+    -------
+    labels : list
+        List of 1D arrays of contiguous cluster labels starting at 1, one per
+        cluster level in k_list.
+    """
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+
+    n_nodes = n_leaves + len(children)
+    labels = []
+    for k in k_list:
+        # The partition into k clusters is given by the first n_leaves - k
+        # merges of the tree
+        n_merges = max(n_leaves - int(k), 0)
+        merges = np.asarray(children[:n_merges])
+        parents = np.repeat(np.arange(n_leaves, n_leaves + n_merges), 2)
+        graph = coo_matrix((np.ones(len(parents)),
+                            (merges.ravel(), parents)),
+                           shape=(n_nodes, n_nodes))
+        components = connected_components(graph, directed=False)[1]
+        labels.append(np.unique(components[:n_leaves],
+                                return_inverse=True)[1].ravel() + 1)
+
+    return labels
+
+
+def cluster_arrays(ts_data, clust_type, k, rows=None, cols=None,
+                   connectivity=None, affinity=None, r_thresh=0.4, seed=None,
+                   ncut_solver="arpack", init_vec=None):
+    """
+    Clusters the voxels of a masked time-series array at one or more
+    cluster levels.
+
+    This is the clustering backend shared by single-level, multi-level and
+    bootstrapped parcellations, such that the labels of a level do not depend
+    on the other levels requested alongside it. Agglomerative methods (ward,
+    complete, average) build the full tree once and cut it at each level.
+    k-means and ncut are refit for each level from fixed seeds.
+
+    Parameters
+    ----------
+    ts_data : array
+        A #timepoints x #voxels array of (cleaned) masked fMRI data.
+    clust_type : str
+        Type of clustering to be performed (e.g. 'ward', 'kmeans',
+        'complete', 'average', 'ncut').
+    k : int or list
+        Numbers of clusters that will be generated.
+    rows : array
+        Row voxel indices of the neighborhood graph edges (see `mask_edges`).
+        Used to estimate the ncut affinity when `affinity` is not given.
+    cols : array
+        Column voxel indices of the neighborhood graph edges.
+    connectivity : Compressed Sparse Matrix
+        Optional spatial connectivity structure for agglomerative clustering.
+    affinity : Compressed Sparse Matrix
+        Optional precomputed local connectivity used as the ncut affinity.
+    r_thresh : float
+        Correlation threshold for the estimated ncut affinity.
+    seed : int
+        Random seed for k-means and for the discretisation of ncut
+        eigenvectors.
+    ncut_solver : str
+        Eigensolver backend used for `ncut` clustering.
+    init_vec : array
+        Optional eigenvectors used to warm-start the `ncut` eigensolver.
+
+    Returns
+    -------
+    labels : array
+        1D array of cluster labels, one per voxel, if k is an int, or a
+        #k x #voxels array if k is a list.
+    """
+    k_list = [int(i) for i in np.atleast_1d(k)]
+
+    if clust_type == "ncut":
+        if affinity is None:
+            affinity = edge_correlations(ts_data, rows, cols, r_thresh)
+        labels = []
+        for i in k_list:
+            [_, eigenvec] = ncut(affinity, i, solver=ncut_solver,
+                                 init_vec=init_vec)
+            if seed is not None:
+                np.random.seed(seed)
+            labels.append(discrete_to_labels(discretisation(eigenvec)))
+    elif clust_type == "kmeans":
+        from sklearn.cluster import MiniBatchKMeans
+
+        labels = [MiniBatchKMeans(n_clusters=i, random_state=seed).fit(
+            ts_data.T).labels_ for i in k_list]
+    else:
+        from sklearn.cluster import AgglomerativeClustering
+
+        children = AgglomerativeClustering(
+            n_clusters=min(k_list), linkage=clust_type,
+            connectivity=connectivity, compute_full_tree=True).fit(
+            ts_data.T).children_
+        labels = cut_tree_multi_k(children, ts_data.shape[1], k_list)
+
+    labels = np.vstack(labels).astype("int32")
+
+    return labels if np.ndim(k) > 0 else labels[0]
+
+
+def cluster_boot_sample(ts_data, block_size, clust_type, k, rows, cols,
+                        connectivity=None, confounds=None, standardize=True,
+                        detrend=True, r_thresh=0.4, seed=None,
+                        ncut_solver="arpack", init_vec=None, mask_img=None,
+                        out_dir=None):
+    """
+    Clusters a single circular-block bootstrap sample of masked time-series
+    data held in memory.
+
+    Parameters
+    ----------
+    ts_data : array
+        A #timepoints x #voxels array of masked fMRI data. This is typically
+        a read-only memory map shared across workers.
+    block_size : int
+        Size of the bootstrapped blocks.
+    clust_type : str
+        Type of clustering to be performed (e.g. 'ward', 'kmeans',
+        'complete', 'average', 'ncut').
+    k : int or list
+        Numbers of clusters that will be generated. If a list is given, all
+        cluster levels are derived from one sample (see `cluster_arrays`).
+    rows : array
+        Row voxel indices of the neighborhood graph edges (see `mask_edges`).
+    cols : array
+        Column voxel indices of the neighborhood graph edges.
+    connectivity : Compressed Sparse Matrix
+        Optional spatial connectivity structure for agglomerative clustering.
+    confounds : array
+        Optional #timepoints x #regressors array of confound regressors.
+    standardize : bool
+        Whether to z-score the bootstrapped time-series.
+    detrend : bool
+        Whether to detrend the bootstrapped time-series.
+    r_thresh : float
+        Correlation coefficients lower than this value are removed from the
+        local connectivity graph used for `ncut` clustering.
+    seed : int
+        Random seed for the bootstrap resampling.
+    ncut_solver : str
+        Eigensolver backend used for `ncut` clustering.
+    init_vec : array
+        Optional eigenvectors used to warm-start the `ncut` eigensolver.
+    mask_img : Nifti1Image
+        3D NIFTI file containing the clustering mask used to produce
+        `ts_data`. Required with `out_dir`.
+    out_dir : str
+        Optional directory to which the bootstrapped parcellations are
+        written, one per cluster level (see `load_boot_labels`).
+
+    Returns
+    -------
+    labels : array or list
+        1D array of cluster labels, one per voxel (or a #k x #voxels array
+        if k is a list), the list of parcellation file paths if `out_dir` is
+        given, or None if the clustering of this sample failed.
+    """
+    from nilearn.signal import clean
+    from pynets.fmri.estimation import timeseries_bootstrap
+
+    if seed is not None:
+        np.random.seed(seed)
+
+    boot_series, boot_ixs = timeseries_bootstrap(ts_data, block_size)
+    if confounds is not None:
+        confounds = confounds[boot_ixs]
+
+    boot_series = clean(boot_series.astype("float32"), detrend=detrend,
+                        standardize=standardize, confounds=confounds)
+
+    try:
+        # Re-estimate the temporal correlation of each neighborhood edge
+        # from the bootstrapped sample when clustering with ncut
+        labels = cluster_arrays(boot_series, clust_type, k, rows, cols,
+                                connectivity=connectivity, r_thresh=r_thresh,
+                                seed=seed, ncut_solver=ncut_solver,
+                                init_vec=init_vec)
+    except (ValueError, MemoryError, np.linalg.LinAlgError) as e:
+        print(e, f"\nBootstrapped sample {seed} failed to cluster. "
+                 f"Skipping...")
+        return None
+
+    if out_dir is not None:
+        mask_data = np.asarray(mask_img.dataobj).astype("bool")
+        out_paths = []
+        for i, k_labels in enumerate(np.atleast_2d(labels)):
+            out_data = np.zeros(mask_data.shape, dtype="uint16")
+            out_data[mask_data] = k_labels + 1
+            out_path = f"{out_dir}/boot_parc_tmp_{str(seed)}_{str(i)}.nii.gz"
+            nib.save(nib.Nifti1Image(out_data, mask_img.affine), out_path)
+            out_paths.append(out_path)
+        return out_paths
+
+    return labels
+
+
+def load_boot_labels(boot_parcellations, mask_img):
+    """
+    Reads back the bootstrapped parcellations written by
+    `cluster_boot_sample`, one per cluster level, as a #k x #voxels array of
+    labels in the voxel order of `apply_mask`, and removes the files.
+    """
+    import os
+
+    mask_data = np.asarray(mask_img.dataobj).astype("bool")
+    labels = []
+    for boot_parcellation in boot_parcellations:
+        labels.append(np.asarray(
+            nib.load(boot_parcellation).dataobj)[mask_data])
+        os.remove(boot_parcellation)
+
+    return np.vstack(labels)
+
+
+def coassignment_consensus(coassignment, n_boot, rows, cols, k, mask_img,
+                           ncut_solver="arpack", seed=42):
+    """
+    Derives a consensus parcellation from accumulated co-assignment counts
+    of neighboring voxels across bootstrapped clusterings.
+
+    Parameters
+    ----------
+    coassignment : array
+        Number of bootstrapped samples in which the voxels of each
+        neighborhood edge were assigned to the same cluster.
+    n_boot : int
+        Number of bootstrapped samples accumulated.
+    rows : array
+        Row voxel indices of the neighborhood graph edges.
+    cols : array
+        Column voxel indices of the neighborhood graph edges.
+    k : int
+        Numbers of clusters that will be generated.
+    mask_img : Nifti1Image
+        3D NIFTI file containing the clustering mask.
+    ncut_solver : str
+        Eigensolver backend used for the consensus `ncut`.
+    seed : int
+        Random seed for the discretisation of the consensus eigenvectors.
+
+    Returns
+    -------
+    out_img : Nifti1Image
+        Consensus parcellation.
+    """
+    from scipy.sparse import coo_matrix, identity
+
+    n_voxels = int(np.sum(np.asarray(mask_img.dataobj).astype("bool")))
+    W = coo_matrix((coassignment / float(n_boot), (rows, cols)),
+                   shape=(n_voxels, n_voxels)).tocsc()
+    W = W + W.T + identity(n_voxels, dtype="float32", format="csc")
+    W.eliminate_zeros()
+
+    np.random.seed(seed)
+    out_img = parcellate_ncut(W, k, mask_img, solver=ncut_solver)
+    out_img.set_data_dtype(np.uint16)
+
+    return out_img
+
+
+def ensemble_parcellate_arrays(ts_data, block_size, clust_type, k, c_boot,
+                               mask_img, local_conn=None, conf=None,
+                               standardize=True, detrend=True, nthreads=1,
+                               r_thresh=0.4, ncut_solver="arpack",
+                               work_dir=None):
+    """
+    Builds a consensus parcellation from bootstrapped clusterings that are
+    computed directly on masked arrays.
+
+    The masked time-series are shared read-only with the workers through a
+    memory map, and each finished batch of bootstrapped labels is folded into
+    a sparse co-assignment count over the spatial neighborhood graph before
+    being discarded. Peak memory is therefore bounded by `nthreads`, rather
+    than `c_boot`. If `work_dir` is given, the workers write the
+    bootstrapped parcellations to disk instead of returning their labels,
+    which yields the same consensus.
+
+    Parameters
+    ----------
+    ts_data : array
+        A #timepoints x #voxels array of masked fMRI data (see
+        `NiParcellate.prep_boot`).
+    block_size : int
+        Size of the bootstrapped blocks.
+    clust_type : str
+        Type of clustering to be performed (e.g. 'ward', 'kmeans',
+        'complete', 'average', 'ncut').
+    k : int or list
+        Numbers of clusters that will be generated. If a list is given, every
+        bootstrapped sample is clustered at each cluster level, and a
+        consensus parcellation is returned for each level.
+    c_boot : int
+        Number of bootstrapped samples to accumulate.
+    mask_img : Nifti1Image
+        3D NIFTI file containing the clustering mask used to produce
+        `ts_data`.
+    local_conn : Compressed Sparse Matrix
+        Optional local connectivity structure. Required for `ncut`.
+    conf : str
+        File path to a confound regressor file.
+    standardize : bool
+        Whether to z-score the bootstrapped time-series.
+    detrend : bool
+        Whether to detrend the bootstrapped time-series.
+    nthreads : int
+        Number of parallel workers.
+    r_thresh : float
+        Correlation threshold for the `ncut` local connectivity graph.
+    ncut_solver : str
+        Eigensolver backend used for `ncut` clustering. With `lobpcg`, every
+        bootstrapped sample is warm-started from the eigenvectors of the
+        full-sample local connectivity.
+    work_dir : str
+        Optional directory to which the bootstrapped parcellations are
+        written, rather than being held in memory.
+
+    Returns
+    -------
+    out_img : Nifti1Image or list
+        Consensus parcellation, or a list of consensus parcellations if k is
+        a list.
+    """
+    import gc
+    import shutil
+    import tempfile
+    from joblib import Parallel, delayed
+
+    rows, cols, local_conn, confounds = _prep_array_clustering(
+        ts_data, clust_type, mask_img, local_conn, conf)
+    k_list = [int(i) for i in np.atleast_1d(k)]
+
+    if clust_type == "ncut" and ncut_solver == "lobpcg":
+        [_, init_vec] = ncut(local_conn, max(k_list), solver=ncut_solver)
+    else:
+        init_vec = None
+
+    coassignment = np.zeros((len(k_list), len(rows)), dtype="float32")
+    n_boot = 0
+    n_attempts = 0
+
+    cache_dir = tempfile.mkdtemp()
+    with Parallel(n_jobs=nthreads, backend="loky", max_nbytes="1M",
+                  mmap_mode="r", temp_folder=cache_dir) as parallel:
+        while n_boot < c_boot and n_attempts < 2 * c_boot:
+            batch_size = min(int(nthreads), c_boot - n_boot)
+            batch_labels = parallel(
+                delayed(cluster_boot_sample)(
+                    ts_data, block_size, clust_type, k_list, rows, cols,
+                    local_conn, confounds, standardize, detrend, r_thresh,
+                    n_attempts + i, ncut_solver, init_vec, mask_img,
+                    work_dir)
+                for i in range(batch_size))
+            n_attempts += batch_size
+
+            for labels in batch_labels:
+                if labels is None:
+                    continue
+                if work_dir is not None:
+                    labels = load_boot_labels(labels, mask_img)
+                coassignment += labels[:, rows] == labels[:, cols]
+                n_boot += 1
+            print(f"Bootstrapped samples complete: {n_boot}/{c_boot}")
+            del batch_labels
+            gc.collect()
+
+    shutil.rmtree(cache_dir, ignore_errors=True)
+
+    if n_boot == 0:
+        raise ValueError("All bootstrapped clusterings failed.")
+
+    out_imgs = [coassignment_consensus(coassignment[i], n_boot, rows, cols,
+                                       k_list[i], mask_img, ncut_solver)
+                for i in range(len(k_list))]
+
+    return out_imgs if np.ndim(k) > 0 else out_imgs[0]
+
+
+def parcellate_arrays(ts_data, clust_type, k, mask_img, local_conn=None,
+                      conf=None, standardize=True, detrend=True, r_thresh=0.4,
+                      ncut_solver="arpack"):
+    """
+    Parcellates masked time-series data held in memory at one or more
+    cluster levels (see `cluster_arrays`).
+
+    Parameters
+    ----------
+    ts_data : array
+        A #timepoints x #voxels array of masked fMRI data (see
+        `NiParcellate.prep_boot`).
+    clust_type : str
+        Type of clustering to be performed (e.g. 'ward', 'kmeans',
+        'complete', 'average', 'ncut').
+    k : int or list
+        Numbers of clusters that will be generated.
+    mask_img : Nifti1Image
+        3D NIFTI file containing the clustering mask used to produce
+        `ts_data`.
+    local_conn : Compressed Sparse Matrix
+        Optional local connectivity structure. Required for `ncut`, for which
+        it is used as the affinity.
+    conf : str
+        File path to a confound regressor file.
+    standardize : bool
+        Whether to z-score the time-series.
+    detrend : bool
+        Whether to detrend the time-series.
+    r_thresh : float
+        Correlation threshold for the `ncut` local connectivity graph.
+    ncut_solver : str
+        Eigensolver backend used for `ncut` clustering.
+
+    Returns
+    -------
+    out_img : Nifti1Image or list
+        Parcellation, or a list of parcellations if k is a list.
+    """
+    from scipy.sparse import issparse
+    from nilearn.signal import clean
+
+    if clust_type == "ncut" and issparse(local_conn) and \
+            local_conn.shape[0] == ts_data.shape[1]:
+        affinity = local_conn
+    else:
+        affinity = None
+
+    rows, cols, local_conn, confounds = _prep_array_clustering(
+        ts_data, clust_type, mask_img, local_conn, conf)
+
+    ts_data = clean(np.asarray(ts_data, dtype="float32"), detrend=detrend,
+                    standardize=standardize, confounds=confounds)
+    labels = cluster_arrays(ts_data, clust_type, np.atleast_1d(k), rows, cols,
+                            connectivity=local_conn, affinity=affinity,
+                            r_thresh=r_thresh, seed=42,
+                            ncut_solver=ncut_solver)
+
+    mask_data = np.asarray(mask_img.dataobj).astype("bool")
+    out_imgs = []
+    for k_labels in labels:
+        out_data = np.zeros(mask_data.shape, dtype="uint16")
+        out_data[mask_data] = k_labels
+        out_img = nib.Nifti1Image(out_data, mask_img.affine)
+        out_img.set_data_dtype(np.uint16)
+        out_imgs.append(out_img)
+
+    return out_imgs if np.ndim(k) > 0 else out_imgs[0]
+
+
+def _prep_array_clustering(ts_data, clust_type, mask_img, local_conn=None,
+                           conf=None):
+    """
+    Resolves the neighborhood graph, spatial connectivity and confound
+    regressors shared by the array-based clustering routines.
+    """
+    from scipy.sparse import issparse, coo_matrix
+
+    if clust_type == "ncut" and not issparse(local_conn):
+        raise ValueError("`ncut` clustering requires a sparse local "
+                         "connectivity structure (`tcorr` or `scorr`).")
+
+    if not issparse(local_conn):
+        local_conn = None
+
+    rows, cols = mask_edges(mask_img, local_conn)
+    if local_conn is None or local_conn.shape[0] != ts_data.shape[1]:
+        local_conn = coo_matrix(
+            (np.ones(len(rows), dtype="float32"), (rows, cols)),
+            shape=(ts_data.shape[1], ts_data.shape[1])).tocsr()
+        local_conn = local_conn + local_conn.T
+
+    if conf is not None:
+        import pandas as pd
+        confounds = pd.read_csv(conf, sep="\t")
+        confounds = confounds.apply(lambda x: x.fillna(x.mean()),
+                                    axis=0).values
+    else:
+        confounds = None
+
+    return rows, cols, local_conn, confounds
+
+
 class NiParcellate(object):
     """
     Class for implementing various clustering routines.
@@ -986,10 +1740,109 @@ class NiParcellate(object):
         ts_data = apply_mask(self._func_img, self._clust_mask_corr_img)
         return ts_data, int(int(np.sqrt(ts_data.shape[0])) * blocklength)
 
+    def get_multi_k_uatlases(self, k_list):
+        """
+        Resolve the parcellation file path of each cluster level in k_list,
+        following the naming used by `create_clean_mask`.
+        """
+        import os
+        from pynets.core import utils
+
+        mask_name = os.path.basename(self.clust_mask).split(".nii")[0]
+        uatlases = dict()
+        for k in k_list:
+            atlas = f"{mask_name}{'_'}{self.clust_type}{'_k'}{str(k)}"
+            uatlases[int(k)] = f"{utils.do_dir_path(atlas, self.outdir)}/" \
+                               f"{mask_name}_clust-{self.clust_type}" \
+                               f"_k{str(k)}.nii.gz"
+        return uatlases
+
+    def create_multi_k_clustering(self, k_list, c_boot=1, nthreads=1,
+                                  r_thresh=0.4, ncut_solver="arpack",
+                                  provenance=None):
+        """
+        Generate parcellations at every cluster level in k_list from a single
+        (optionally bootstrapped) clustering pass, using the same backend as
+        single-level parcellations.
+
+        The parcellations are recorded in a manifest alongside the clustering
+        outputs, and the work is guarded by a file lock, so that concurrent
+        nodes iterating over k_list compute them once and reuse them.
+        `provenance` is an optional dictionary of the original input file
+        paths, used in place of working copies to identify the data in the
+        manifest. The manifest also records digests of the content of these
+        files and the clustering settings, such that re-preprocessed inputs
+        at the same paths are clustered again.
+        """
+        import os
+        import json
+        from filelock import SoftFileLock
+        from pynets.core import utils
+
+        k_list = sorted(set([int(k) for k in k_list]))
+        uatlases = self.get_multi_k_uatlases(k_list)
+        mask_name = os.path.basename(self.clust_mask).split(".nii")[0]
+        manifest = f"{self.outdir}/{mask_name}_clust-{self.clust_type}_k" \
+                   f"{'-'.join([str(k) for k in k_list])}_multi_k.json"
+        if provenance is None:
+            provenance = {"func_file": self.func_file,
+                          "clust_mask": self.clust_mask,
+                          "conf": self.conf, "mask": self.mask}
+        digests = {key: utils.hash_content(path).hexdigest()
+                   for key, path in provenance.items()
+                   if isinstance(path, str) and os.path.isfile(path)}
+        signature = dict(provenance, digests=digests,
+                         clust_type=self.clust_type,
+                         local_corr=self.local_corr, c_boot=int(c_boot),
+                         r_thresh=float(r_thresh), ncut_solver=ncut_solver,
+                         standardize=self._standardize,
+                         detrend=self._detrending,
+                         uatlases={str(k): v for k, v in uatlases.items()})
+
+        with SoftFileLock(f"{manifest}.lock"):
+            if os.path.isfile(manifest):
+                with open(manifest, "r") as f:
+                    previous = json.load(f)
+                if previous == signature and all(
+                        [os.path.isfile(i) for i in uatlases.values()]):
+                    print(f"Reusing multi-k parcellations from {manifest}")
+                    return uatlases
+
+            self.create_local_clustering(overwrite=True, r_thresh=r_thresh)
+            ts_data, block_size = self.prep_boot()
+            if float(c_boot) > 1:
+                print(f"Performing circular block bootstrapping with "
+                      f"{c_boot} in-memory iterations for k={k_list}...")
+                out_imgs = ensemble_parcellate_arrays(
+                    ts_data, block_size, self.clust_type, k_list,
+                    int(c_boot), self._clust_mask_corr_img,
+                    local_conn=self._local_conn, conf=self.conf,
+                    standardize=self._standardize, detrend=self._detrending,
+                    nthreads=nthreads, r_thresh=r_thresh,
+                    ncut_solver=ncut_solver)
+            else:
+                print(f"Creating spatially-constrained parcellations for "
+                      f"k={k_list}...")
+                out_imgs = parcellate_arrays(
+                    ts_data, self.clust_type, k_list,
+                    self._clust_mask_corr_img, local_conn=self._local_conn,
+                    conf=self.conf, standardize=self._standardize,
+                    detrend=self._detrending, r_thresh=r_thresh,
+                    ncut_solver=ncut_solver)
+
+            for k, out_img in zip(k_list, out_imgs):
+                nib.save(out_img, uatlases[k])
+
+            with open(manifest, "w") as f:
+                json.dump(signature, f)
+
+        return uatlases
+
 
 def parcellate(func_boot_img, local_corr, clust_type, _local_conn_mat_path,
                num_conn_comps, _clust_mask_corr_img, _standardize,
-               _detrending, k, _local_conn, conf, _dir_path, _conn_comps):
+               _detrending, k, _local_conn, conf, _dir_path, _conn_comps,
+               ncut_solver="arpack"):
     """
     API for performing any of a variety of clustering routines available
     through NiLearn.
@@ -1083,7 +1936,7 @@ def parcellate(func_boot_img, local_corr, clust_type, _local_conn_mat_path,
 
     elif clust_type == "ncut":
         out_img = parcellate_ncut(
-            _local_conn, k, _clust_mask_corr_img
+            _local_conn, k, _clust_mask_corr_img, solver=ncut_solver
         )
         out_img.set_data_dtype(np.uint16)
         print(
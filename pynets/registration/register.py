@@ -211,7 +211,7 @@ def direct_streamline_norm(
     from nilearn.image import resample_to_img
     from dipy.io.streamline import load_tractogram
     from dipy.tracking import utils
-    from dipy.tracking._utils import _mapping_to_voxel
+    from pynets.dmri.utils import positive_voxel_streamlines
     from dipy.io.stateful_tractogram import Space, StatefulTractogram, Origin
     from dipy.io.streamline import save_tractogram
     from pynets.core.utils import load_runconfig
@@ -221,6 +221,8 @@ def direct_streamline_norm(
     hardcoded_params = load_runconfig()
     try:
         run_dsn = hardcoded_params['tracking']["DSN"][0]
+        dsn_profile = hardcoded_params['tracking'].get("DSN_profile",
+                                                       ["accurate"])[0]
     except FileNotFoundError as e:
         print(e, "Failed to parse runconfig.yaml")
 
@@ -303,9 +305,10 @@ def direct_streamline_norm(
 
         # streams_warp_png = '/tmp/dsn.png'
 
-        # SyN FA->Template
+        # SyN FA->Template, computed once per subject and reused by every
+        # tractogram
         [mapping, affine_map, warped_fa] = regutils.wm_syn(
-            t1w_brain, ap_path, dsn_dir
+            t1w_brain, ap_path, dsn_dir, profile=dsn_profile
         )
 
         tractogram = load_tractogram(
@@ -337,13 +340,8 @@ def direct_streamline_norm(
                                                        brain_mask)
 
         # Remove streamlines with negative voxel indices
-        lin_T, offset = _mapping_to_voxel(np.eye(4))
-        streams_final_filt_final = []
-        for sl in streams_final_filt:
-            inds = np.dot(sl, lin_T)
-            inds += offset
-            if not inds.min().round(decimals=6) < 0:
-                streams_final_filt_final.append(sl)
+        streams_final_filt_final = streams_final_filt[
+            positive_voxel_streamlines(streams_final_filt)]
 
         # Save streamlines
         stf = StatefulTractogram(
@@ -648,7 +646,6 @@ class DmriReg(object):
         """
         A function to segment and threshold tissue types from T1w.
         """
-        import time
         import shutil
 
         # Segment the t1w brain into probability maps
@@ -671,7 +668,6 @@ class DmriReg(object):
         else:
             try:
                 maps = regutils.segment_t1w(self.t1w_brain, self.map_name)
-                time.sleep(0.5)
                 wm_mask = maps["wm_prob"]
                 gm_mask = maps["gm_prob"]
                 csf_mask = maps["csf_prob"]
@@ -689,7 +685,6 @@ class DmriReg(object):
         # Extract wm edge
         self.wm_edge = regutils.get_wm_contour(wm_mask, self.wm_mask_thr,
                                                self.wm_edge)
-        time.sleep(0.5)
         shutil.copyfile(wm_mask, self.wm_mask)
         shutil.copyfile(gm_mask, self.gm_mask)
         shutil.copyfile(csf_mask, self.csf_mask)
@@ -700,7 +695,6 @@ class DmriReg(object):
         """
         A function to perform alignment from T1w --> MNI template.
         """
-        import time
 
         # Create linear transform/ initializer T1w-->MNI
         regutils.align(
@@ -714,7 +708,6 @@ class DmriReg(object):
             cost="mutualinfo",
             searchrad=True,
         )
-        time.sleep(0.5)
         # Attempt non-linear registration of T1 to MNI template
         if self.simple is False:
             try:
@@ -731,16 +724,13 @@ class DmriReg(object):
                     warp=self.warp_t1w2mni,
                     ref_mask=self.input_mni_mask,
                 )
-                time.sleep(0.5)
                 # Get warp from MNI -> T1
                 regutils.inverse_warp(
                     self.t1w_brain, self.mni2t1w_warp, self.warp_t1w2mni
                 )
-                time.sleep(0.5)
                 # Get mat from MNI -> T1
                 self.mni2t1_xfm = regutils.invert_xfm(self.t12mni_xfm_init,
                                                       self.mni2t1_xfm)
-                time.sleep(0.5)
             except BaseException:
                 # Falling back to linear registration
                 regutils.align(
@@ -756,11 +746,9 @@ class DmriReg(object):
                     out=self.t1_aligned_mni,
                     sch=None,
                 )
-                time.sleep(0.5)
                 # Get mat from MNI -> T1
                 self.mni2t1_xfm = regutils.invert_xfm(self.t12mni_xfm,
                                                       self.mni2t1_xfm)
-                time.sleep(0.5)
         else:
             # Falling back to linear registration
             regutils.align(
@@ -776,11 +764,9 @@ class DmriReg(object):
                 out=self.t1_aligned_mni,
                 sch=None,
             )
-            time.sleep(0.5)
             # Get mat from MNI -> T1
             self.t12mni_xfm = regutils.invert_xfm(self.mni2t1_xfm,
                                                   self.t12mni_xfm)
-            time.sleep(0.5)
 
     def t1w2dwi_align(self):
         """
@@ -789,7 +775,6 @@ class DmriReg(object):
         bbr to obtain a good alignment of brain boundaries.
         Assumes input dwi is already preprocessed and brain extracted.
         """
-        import time
 
         self.ap_path = regutils.apply_mask_to_image(self.ap_path,
                                                     self.B0_mask,
@@ -812,10 +797,8 @@ class DmriReg(object):
             searchrad=True,
             sch=None,
         )
-        time.sleep(0.5)
         self.dwi2t1w_xfm = regutils.invert_xfm(self.t1w2dwi_xfm,
                                                self.dwi2t1w_xfm)
-        time.sleep(0.5)
         if self.simple is False:
             # Flirt bbr
             try:
@@ -834,10 +817,8 @@ class DmriReg(object):
                     cost="bbr",
                     sch="${FSLDIR}/etc/flirtsch/bbr.sch",
                 )
-                time.sleep(0.5)
                 self.t1w2dwi_bbr_xfm = regutils.invert_xfm(
                     self.dwi2t1w_bbr_xfm, self.t1w2dwi_bbr_xfm)
-                time.sleep(0.5)
                 # Apply the alignment
                 regutils.align(
                     self.t1w_brain,
@@ -852,7 +833,6 @@ class DmriReg(object):
                     searchrad=True,
                     sch=None,
                 )
-                time.sleep(0.5)
             except BaseException:
                 # Apply the alignment
                 regutils.align(
@@ -868,7 +848,6 @@ class DmriReg(object):
                     searchrad=True,
                     sch=None,
                 )
-                time.sleep(0.5)
         else:
             # Apply the alignment
             regutils.align(
@@ -884,7 +863,6 @@ class DmriReg(object):
                 searchrad=True,
                 sch=None,
             )
-            time.sleep(0.5)
 
         self.t1w2dwi = regutils.apply_mask_to_image(self.t1w2dwi,
                                                     self.B0_mask,
@@ -901,11 +879,11 @@ class DmriReg(object):
         have called both t1w2dwi_align.
         """
         import sys
-        import time
         import os.path as op
         import pkg_resources
         from pynets.core.utils import load_runconfig
         from nilearn.image import resample_to_img
+        from scipy.ndimage import binary_erosion
 
         hardcoded_params = load_runconfig()
         tiss_class = hardcoded_params['tracking']["tissue_classifier"][0]
@@ -954,7 +932,6 @@ class DmriReg(object):
             interp="spline",
             out=None,
         )
-        time.sleep(0.5)
 
         if sys.platform.startswith('win') is False:
             try:
@@ -977,7 +954,6 @@ class DmriReg(object):
             self.xfm_roi2mni_init,
             self.vent_mask_mni,
         )
-        time.sleep(0.5)
         if self.simple is False:
             # Apply warp resulting from the inverse MNI->T1w created earlier
             regutils.apply_warp(
@@ -988,7 +964,6 @@ class DmriReg(object):
                 interp="nn",
                 sup=True,
             )
-            time.sleep(0.5)
 
             if sys.platform.startswith('win') is False:
                 try:
@@ -1018,14 +993,12 @@ class DmriReg(object):
                 self.t1w_brain,
                 self.mni2t1_xfm,
                 self.vent_mask_t1w)
-            time.sleep(0.5)
             regutils.applyxfm(
                 self.corpuscallosum,
                 self.t1w_brain,
                 self.mni2t1_xfm,
                 self.corpuscallosum_mask_t1w,
             )
-            time.sleep(0.5)
 
         # Applyxfm to map FA template image to T1w space
         regutils.applyxfm(
@@ -1033,7 +1006,6 @@ class DmriReg(object):
             self.fa_template_res,
             self.mni2t1_xfm,
             self.fa_template_t1w)
-        time.sleep(0.5)
 
         # Applyxfm tissue maps to dwi space
         if self.t1w_brain_mask is not None:
@@ -1043,27 +1015,22 @@ class DmriReg(object):
                 self.t1wtissue2dwi_xfm,
                 self.t1w_brain_mask_in_dwi,
             )
-            time.sleep(0.5)
         regutils.applyxfm(
             self.ap_path,
             self.vent_mask_t1w,
             self.t1wtissue2dwi_xfm,
             self.vent_mask_dwi)
-        time.sleep(0.5)
         regutils.applyxfm(
             self.ap_path,
             self.csf_mask,
             self.t1wtissue2dwi_xfm,
             self.csf_mask_dwi)
-        time.sleep(0.5)
         regutils.applyxfm(
             self.ap_path, self.gm_mask, self.t1wtissue2dwi_xfm, self.gm_in_dwi
         )
-        time.sleep(0.5)
         regutils.applyxfm(
             self.ap_path, self.wm_mask, self.t1wtissue2dwi_xfm, self.wm_in_dwi
         )
-        time.sleep(0.5)
 
         regutils.applyxfm(
             self.ap_path,
@@ -1071,7 +1038,6 @@ class DmriReg(object):
             self.t1wtissue2dwi_xfm,
             self.corpuscallosum_dwi,
         )
-        time.sleep(0.5)
 
         if tiss_class == 'wb' or tiss_class == 'cmc':
             csf_thr = 0.50
@@ -1101,41 +1067,39 @@ class DmriReg(object):
         self.wm_in_dwi = regutils.apply_mask_to_image(self.wm_in_dwi,
                                                       self.wm_in_dwi_bin,
                                                       self.wm_in_dwi)
-        time.sleep(0.5)
         # Threshold GM to binary in dwi space
         self.gm_in_dwi = regutils.apply_mask_to_image(self.gm_in_dwi,
                                                       self.gm_in_dwi_bin,
                                                       self.gm_in_dwi)
-        time.sleep(0.5)
         # Threshold CSF to binary in dwi space
         self.csf_mask = regutils.apply_mask_to_image(self.csf_mask_dwi,
                                                      self.csf_mask_dwi_bin,
                                                      self.csf_mask_dwi)
-        time.sleep(0.5)
         # Create ventricular CSF mask
         print("Creating Ventricular CSF mask...")
-        os.system(
-            f"fslmaths {self.vent_mask_dwi} -kernel sphere 10 -ero "
-            f"-bin {self.vent_mask_dwi}"
-        )
-        time.sleep(1)
-        os.system(
-            f"fslmaths {self.csf_mask_dwi} -add {self.vent_mask_dwi} "
-            f"-bin {self.vent_csf_in_dwi}"
-        )
-        time.sleep(1)
+        vent_img = nib.load(self.vent_mask_dwi)
+        zooms = np.asarray(vent_img.header.get_zooms()[:3])
+        # Erode with a 10mm sphere, as with fslmaths -kernel sphere 10 -ero
+        grid = np.ogrid[tuple(slice(-int(r), int(r) + 1)
+                              for r in np.floor(10 / zooms))]
+        sphere = sum((g * z) ** 2 for g, z in zip(grid, zooms)) <= 10 ** 2
+        vent_mask = binary_erosion(np.asanyarray(vent_img.dataobj) != 0,
+                                   structure=sphere, border_value=1)
+        vent_img = nib.Nifti1Image(vent_mask.astype("uint8"),
+                                   affine=vent_img.affine)
+        nib.save(vent_img, self.vent_mask_dwi)
+        math_img("(img1 + img2) > 0", img1=self.csf_mask_dwi,
+                 img2=vent_img).to_filename(self.vent_csf_in_dwi)
         print("Creating Corpus Callosum mask...")
-        os.system(
-            f"fslmaths {self.corpuscallosum_dwi} -mas {self.wm_in_dwi_bin} "
-            f"-sub {self.vent_csf_in_dwi} "
-            f"-bin {self.corpuscallosum_dwi}")
-        time.sleep(1)
+        math_img("(img1 * (img2 > 0) - img3) > 0",
+                 img1=self.corpuscallosum_dwi, img2=self.wm_in_dwi_bin,
+                 img3=self.vent_csf_in_dwi).to_filename(
+            self.corpuscallosum_dwi)
         # Create gm-wm interface image
-        os.system(
-            f"fslmaths {self.gm_in_dwi_bin} -mul {self.wm_in_dwi_bin} "
-            f"-add {self.corpuscallosum_dwi} "
-            f"-mas {self.B0_mask} -bin {self.wm_gm_int_in_dwi}")
-        time.sleep(1)
+        math_img("(img1 * img2 + img3) * (img4 > 0) > 0",
+                 img1=self.gm_in_dwi_bin, img2=self.wm_in_dwi_bin,
+                 img3=self.corpuscallosum_dwi,
+                 img4=self.B0_mask).to_filename(self.wm_gm_int_in_dwi)
         return
 
 
@@ -1241,7 +1205,6 @@ class FmriReg(object):
         """
         A function to segment and threshold tissue types from T1w.
         """
-        import time
 
         # Segment the t1w brain into probability maps
         if (
@@ -1275,18 +1238,15 @@ class FmriReg(object):
         self.gm_mask = regutils.apply_mask_to_image(gm_mask,
                                                     self.gm_mask_thr,
                                                     self.gm_mask)
-        time.sleep(0.5)
 
         # Threshold WM to binary in dwi space
         t_img = nib.load(wm_mask)
         mask = math_img("img > 0.50", img=t_img)
         mask.to_filename(self.wm_mask_thr)
-        time.sleep(0.5)
         self.wm_mask = regutils.apply_mask_to_image(wm_mask,
                                                     self.wm_mask_thr,
                                                     self.wm_mask)
         # Extract wm edge
-        time.sleep(0.5)
         self.wm_edge = regutils.get_wm_contour(wm_mask, self.wm_mask_thr,
                                                self.wm_edge)
 
@@ -1296,7 +1256,6 @@ class FmriReg(object):
         """
         A function to perform alignment from T1w --> MNI.
         """
-        import time
 
         # Create linear transform/ initializer T1w-->MNI
         regutils.align(
@@ -1310,7 +1269,6 @@ class FmriReg(object):
             cost="mutualinfo",
             searchrad=True,
         )
-        time.sleep(0.5)
         # Attempt non-linear registration of T1 to MNI template
         if self.simple is False:
             try:
@@ -1327,12 +1285,10 @@ class FmriReg(object):
                     warp=self.warp_t1w2mni,
                     ref_mask=self.input_mni_mask,
                 )
-                time.sleep(0.5)
                 # Get warp from T1w --> MNI
                 regutils.inverse_warp(
                     self.t1w_brain, self.mni2t1w_warp, self.warp_t1w2mni
                 )
-                time.sleep(0.5)
                 # Get mat from MNI -> T1w
                 self.mni2t1_xfm = regutils.invert_xfm(self.t12mni_xfm_init,
                                                       self.mni2t1_xfm)
@@ -1352,7 +1308,6 @@ class FmriReg(object):
                     out=self.t1_aligned_mni,
                     sch=None,
                 )
-                time.sleep(0.5)
                 # Get mat from MNI -> T1w
                 self.t12mni_xfm = regutils.invert_xfm(self.mni2t1_xfm,
                                                       self.t12mni_xfm)
@@ -1371,7 +1326,6 @@ class FmriReg(object):
                 out=self.t1_aligned_mni,
                 sch=None,
             )
-            time.sleep(0.5)
             # Get mat from MNI -> T1w
             self.t12mni_xfm = regutils.invert_xfm(self.mni2t1_xfm,
                                                   self.t12mni_xfm)
@@ -23,7 +23,6 @@ except KeyError as e:
 
 
 def gen_mask(t1w_head, t1w_brain, mask):
-    import time
     import os.path as op
     from pynets.registration import utils as regutils
     from nilearn.image import math_img
@@ -58,11 +57,9 @@ def gen_mask(t1w_head, t1w_brain, mask):
     img = math_img("img > 0.0", img=t_img)
     img.to_filename(t1w_brain_mask)
     t_img.uncache()
-    time.sleep(0.5)
 
     t1w_brain = regutils.apply_mask_to_image(t1w_head, t1w_brain_mask,
                                              t1w_brain)
-    time.sleep(0.5)
 
     assert op.isfile(t1w_brain)
     assert op.isfile(t1w_brain_mask)
@@ -93,10 +90,8 @@ def deep_skull_strip(t1w_data, t1w_brain_mask, img):
     return t1w_brain_mask
 
 
-def atlas2t1w2dwi_align(
-    uatlas,
-    uatlas_parcels,
-    atlas,
+def atlases2t1w2dwi_align(
+    label_files,
     t1w_brain,
     t1w_brain_mask,
     mni2t1w_warp,
@@ -105,134 +100,190 @@ def atlas2t1w2dwi_align(
     mni2t1_xfm,
     t1w2dwi_xfm,
     wm_gm_int_in_dwi,
-    aligned_atlas_t1mni,
-    aligned_atlas_skull,
-    dwi_aligned_atlas,
-    dwi_aligned_atlas_wmgm_int,
+    aligned_atlases_t1mni,
+    aligned_atlases_skull,
+    dwi_aligned_atlases,
+    dwi_aligned_atlases_wmgm_int,
     B0_mask,
     mni2dwi_xfm,
     simple,
+    cache_dir=None,
 ):
     """
-    A function to perform atlas alignment atlas --> T1 --> dwi.
-    Tries nonlinear registration first, and if that fails, does a linear
-    registration instead. For this to succeed, must first have called
-    t1w2dwi_align.
+    A function to perform alignment of any number of atlases
+    atlas --> T1 --> dwi at once. Nearest-neighbour maps from the T1w and dwi
+    grids back to the template grid are computed once (and reused across
+    calls if `cache_dir` is given), and every atlas is then resampled by a
+    single lookup. Tries the nonlinear warp first, and if that fails, uses
+    the linear template transforms instead. For this to succeed, must first
+    have called t1w2dwi_align. An existing `mni2dwi_xfm` (e.g. from a
+    `TransformRegistry`) is reused rather than recomposed.
+
+    Parameters
+    ----------
+    label_files : list
+        File paths to the atlas parcellations (Nifti1Image) in template space.
+    aligned_atlases_t1mni, aligned_atlases_skull, dwi_aligned_atlases,
+    dwi_aligned_atlases_wmgm_int : list
+        Output file paths, one per atlas, for the atlases in template, T1w,
+        and dwi space, and for their union with the WM-GM interface in dwi
+        space, respectively.
+    cache_dir : str
+        Optional directory in which to persist the nearest-neighbour maps.
+
+    Returns
+    -------
+    dwi_aligned_atlases_wmgm_int : list
+    dwi_aligned_atlases : list
+    aligned_atlases_skull : list
     """
-    import time
     from nilearn.image import resample_to_img
     from pynets.core.utils import checkConsecutive
-    from pynets.registration import utils as regutils
-    from nilearn.image import math_img
-    from nilearn.masking import intersect_masks
+    from pynets.core.nodemaker import label_inventory
 
     template_img = nib.load(t1_aligned_mni)
-    if uatlas_parcels:
-        atlas_img_orig = nib.load(uatlas_parcels)
-    else:
-        atlas_img_orig = nib.load(uatlas)
-
-    old_count = len(np.unique(np.asarray(atlas_img_orig.dataobj)))
-
-    uatlas_res_template = resample_to_img(
-        atlas_img_orig, template_img, interpolation="nearest"
-    )
+    t1w_img = nib.load(t1w_brain)
+    ap_img = nib.load(ap_path)
 
-    uatlas_res_template = nib.Nifti1Image(
-        np.asarray(uatlas_res_template.dataobj).astype('uint16'),
-        affine=uatlas_res_template.affine,
-        header=uatlas_res_template.header,
-    )
-    nib.save(uatlas_res_template, aligned_atlas_t1mni)
+    atlases_template = []
+    old_counts = []
+    for label_file, aligned_atlas_t1mni in zip(label_files,
+                                               aligned_atlases_t1mni):
+        atlas_img_orig = nib.load(label_file)
+        old_counts.append(len(label_inventory(label_file)["labels"]))
+        uatlas_res_template = resample_to_img(
+            atlas_img_orig, template_img, interpolation="nearest"
+        )
+        uatlas_res_template = nib.Nifti1Image(
+            np.asarray(uatlas_res_template.dataobj).astype('uint16'),
+            affine=uatlas_res_template.affine,
+            header=uatlas_res_template.header,
+        )
+        nib.save(uatlas_res_template, aligned_atlas_t1mni)
+        atlases_template.append(np.asarray(uatlas_res_template.dataobj))
+        atlas_img_orig.uncache()
 
+    linear = simple
     if simple is False:
         try:
-            regutils.apply_warp(
-                t1w_brain,
-                aligned_atlas_t1mni,
-                aligned_atlas_skull,
-                warp=mni2t1w_warp,
-                interp="nn",
-                sup=True,
-                mask=t1w_brain_mask,
-            )
-            time.sleep(0.5)
-
-            # Apply linear transformation from template to dwi space
-            regutils.applyxfm(ap_path, aligned_atlas_skull, t1w2dwi_xfm,
-                              dwi_aligned_atlas, interp="nearestneighbour")
-            time.sleep(0.5)
+            t1w_map = label_index_map(template_img, t1w_img,
+                                      warp=mni2t1w_warp, mask=t1w_brain_mask,
+                                      cache_dir=cache_dir)
+            # Compose with the T1w --> dwi lookup, as two nearest-neighbour
+            # resamplings would
+            dwi_map = label_index_map(t1w_img, ap_img, xfm=t1w2dwi_xfm,
+                                      cache_dir=cache_dir)
+            dwi_map = np.where(dwi_map >= 0, t1w_map[dwi_map], -1)
         except BaseException:
             print(
                 "Warning: Atlas is not in correct dimensions, or input is low"
                 " quality,\nusing linear template registration.")
-
-            regutils.applyxfm(t1w_brain, aligned_atlas_t1mni, mni2t1_xfm,
-                              aligned_atlas_skull, interp="nearestneighbour")
-            time.sleep(0.5)
+            linear = True
+    if linear is True:
+        t1w_map = label_index_map(template_img, t1w_img, xfm=mni2t1_xfm,
+                                  cache_dir=cache_dir)
+        if not os.path.isfile(mni2dwi_xfm):
             combine_xfms(mni2t1_xfm, t1w2dwi_xfm, mni2dwi_xfm)
-            time.sleep(0.5)
-            regutils.applyxfm(ap_path, aligned_atlas_t1mni, mni2dwi_xfm,
-                              dwi_aligned_atlas, interp="nearestneighbour")
-            time.sleep(0.5)
-    else:
-        regutils.applyxfm(t1w_brain, aligned_atlas_t1mni, mni2t1_xfm,
-                          aligned_atlas_skull, interp="nearestneighbour")
-        time.sleep(0.5)
-        combine_xfms(mni2t1_xfm, t1w2dwi_xfm, mni2dwi_xfm)
-        time.sleep(0.5)
-        regutils.applyxfm(ap_path, aligned_atlas_t1mni, mni2dwi_xfm,
-                          dwi_aligned_atlas, interp="nearestneighbour")
-        time.sleep(0.5)
-
-    atlas_img = nib.load(dwi_aligned_atlas)
-    wm_gm_img = nib.load(wm_gm_int_in_dwi)
-    wm_gm_mask_img = math_img("img > 0", img=wm_gm_img)
-    atlas_mask_img = math_img("img > 0", img=atlas_img)
-
-    atlas_img_corr = nib.Nifti1Image(
-        np.asarray(atlas_img.dataobj).astype('uint16'),
-        affine=atlas_img.affine,
-        header=atlas_img.header,
-    )
+        dwi_map = label_index_map(template_img, ap_img, xfm=mni2dwi_xfm,
+                                  cache_dir=cache_dir)
 
-    # Get the union of masks
-    dwi_aligned_atlas_wmgm_int_img = intersect_masks(
-        [wm_gm_mask_img, atlas_mask_img], threshold=0,
-        connected=False
-    )
-
-    nib.save(atlas_img_corr, dwi_aligned_atlas)
-    nib.save(dwi_aligned_atlas_wmgm_int_img, dwi_aligned_atlas_wmgm_int)
-
-    dwi_aligned_atlas = regutils.apply_mask_to_image(dwi_aligned_atlas,
-                                                     B0_mask,
-                                                     dwi_aligned_atlas)
-
-    time.sleep(0.5)
+    atlases_skull = resample_labels(atlases_template, t1w_map,
+                                    t1w_img.shape[:3])
+    atlases_dwi = resample_labels(atlases_template, dwi_map,
+                                  ap_img.shape[:3])
 
-    dwi_aligned_atlas_wmgm_int = regutils.apply_mask_to_image(
-        dwi_aligned_atlas_wmgm_int, B0_mask, dwi_aligned_atlas_wmgm_int)
+    wm_gm_img = nib.load(wm_gm_int_in_dwi)
+    wm_gm_mask = np.asarray(wm_gm_img.dataobj) > 0
+    B0_mask_data = np.asarray(nib.load(B0_mask).dataobj) > 0
+
+    for i in range(len(label_files)):
+        atlas_img_skull = nib.Nifti1Image(atlases_skull[i], t1w_img.affine,
+                                          t1w_img.header)
+        atlas_img_skull.set_data_dtype('uint16')
+        nib.save(atlas_img_skull, aligned_atlases_skull[i])
+
+        # Get the union of masks
+        atlas_dwi = atlases_dwi[i]
+        atlas_wmgm_int = (wm_gm_mask | (atlas_dwi > 0)) & B0_mask_data
+        atlas_dwi[~B0_mask_data] = 0
+
+        atlas_img_corr = nib.Nifti1Image(atlas_dwi, ap_img.affine,
+                                         ap_img.header)
+        atlas_img_corr.set_data_dtype('uint16')
+        nib.save(atlas_img_corr, dwi_aligned_atlases[i])
+        nib.save(nib.Nifti1Image(atlas_wmgm_int.astype('int8'),
+                                 wm_gm_img.affine),
+                 dwi_aligned_atlases_wmgm_int[i])
+
+        unique_a = label_inventory(dwi_aligned_atlases[i],
+                                   labels_data=atlas_dwi)["labels"]
+        # Include the background, as in the full set of intensities
+        if not checkConsecutive(np.union1d([0], unique_a)):
+            print("Warning! Non-consecutive integers found in "
+                  "parcellation...")
+
+        new_count = len(unique_a)
+        diff = np.abs(int(float(new_count) - float(old_counts[i])))
+        print(f"Previous label count: {old_counts[i]}")
+        print(f"New label count: {new_count}")
+        print(f"Labels dropped: {diff}")
 
-    time.sleep(0.5)
-    final_dat = atlas_img_corr.get_fdata()
-    unique_a = sorted(set(np.array(final_dat.flatten().tolist())))
+    template_img.uncache()
+    t1w_img.uncache()
+    ap_img.uncache()
+    wm_gm_img.uncache()
 
-    if not checkConsecutive(unique_a):
-        print("Warning! Non-consecutive integers found in parcellation...")
+    return dwi_aligned_atlases_wmgm_int, dwi_aligned_atlases, \
+        aligned_atlases_skull
 
-    new_count = len(unique_a)
-    diff = np.abs(np.int(float(new_count) - float(old_count)))
-    print(f"Previous label count: {old_count}")
-    print(f"New label count: {new_count}")
-    print(f"Labels dropped: {diff}")
 
-    atlas_img.uncache()
-    atlas_img_corr.uncache()
-    atlas_img_orig.uncache()
-    atlas_mask_img.uncache()
-    wm_gm_img.uncache()
-    wm_gm_mask_img.uncache()
+def atlas2t1w2dwi_align(
+    uatlas,
+    uatlas_parcels,
+    atlas,
+    t1w_brain,
+    t1w_brain_mask,
+    mni2t1w_warp,
+    t1_aligned_mni,
+    ap_path,
+    mni2t1_xfm,
+    t1w2dwi_xfm,
+    wm_gm_int_in_dwi,
+    aligned_atlas_t1mni,
+    aligned_atlas_skull,
+    dwi_aligned_atlas,
+    dwi_aligned_atlas_wmgm_int,
+    B0_mask,
+    mni2dwi_xfm,
+    simple,
+    cache_dir=None,
+):
+    """
+    A function to perform atlas alignment atlas --> T1 --> dwi.
+    Tries nonlinear registration first, and if that fails, does a linear
+    registration instead. For this to succeed, must first have called
+    t1w2dwi_align. See `atlases2t1w2dwi_align`.
+    """
+    [dwi_aligned_atlas_wmgm_int], [dwi_aligned_atlas], \
+        [aligned_atlas_skull] = atlases2t1w2dwi_align(
+            [uatlas_parcels if uatlas_parcels else uatlas],
+            t1w_brain,
+            t1w_brain_mask,
+            mni2t1w_warp,
+            t1_aligned_mni,
+            ap_path,
+            mni2t1_xfm,
+            t1w2dwi_xfm,
+            wm_gm_int_in_dwi,
+            [aligned_atlas_t1mni],
+            [aligned_atlas_skull],
+            [dwi_aligned_atlas],
+            [dwi_aligned_atlas_wmgm_int],
+            B0_mask,
+            mni2dwi_xfm,
+            simple,
+            cache_dir=cache_dir,
+        )
 
     return dwi_aligned_atlas_wmgm_int, dwi_aligned_atlas, aligned_atlas_skull
 
@@ -253,7 +304,6 @@ def roi2dwi_align(
     A function to perform alignment of a waymask from
     MNI space --> T1w --> dwi.
     """
-    import time
     from pynets.registration import utils as regutils
     from nilearn.image import resample_to_img
 
@@ -273,7 +323,6 @@ def roi2dwi_align(
     else:
         regutils.applyxfm(t1w_brain, roi, mni2t1_xfm, roi_in_t1w)
 
-    time.sleep(0.5)
     # Apply transform from t1w to native dwi space
     regutils.applyxfm(ap_path, roi_in_t1w, t1wtissue2dwi_xfm, roi_in_dwi)
 
@@ -297,7 +346,6 @@ def waymask2dwi_align(
     A function to perform alignment of a waymask from
     MNI space --> T1w --> dwi.
     """
-    import time
     from pynets.registration import utils as regutils
     from nilearn.image import resample_to_img
 
@@ -321,7 +369,6 @@ def waymask2dwi_align(
     else:
         regutils.applyxfm(t1w_brain, waymask_res, mni2t1_xfm, waymask_in_t1w)
 
-    time.sleep(0.5)
     # Apply transform from t1w to native dwi space
     regutils.applyxfm(
         ap_path,
@@ -329,8 +376,6 @@ def waymask2dwi_align(
         t1wtissue2dwi_xfm,
         waymask_in_dwi)
 
-    time.sleep(0.5)
-
     waymask_in_dwi = regutils.apply_mask_to_image(waymask_in_dwi,
                                                   B0_mask_tmp_path,
                                                   waymask_in_dwi)
@@ -349,7 +394,6 @@ def roi2t1w_align(
     """
     A function to perform alignment of a roi from MNI space --> T1w.
     """
-    import time
     from pynets.registration import utils as regutils
     from nilearn.image import resample_to_img
 
@@ -369,8 +413,6 @@ def roi2t1w_align(
     else:
         regutils.applyxfm(t1w_brain, roi_res, mni2t1_xfm, roi_in_t1w)
 
-    time.sleep(0.5)
-
     return roi_in_t1w
 
 
@@ -388,7 +430,6 @@ def RegisterParcellation2MNIFunc_align(
     """
     A function to perform atlas alignment from T1w atlas --> MNI.
     """
-    import time
     from pynets.registration import utils as regutils
     from nilearn.image import resample_to_img
 
@@ -416,7 +457,6 @@ def RegisterParcellation2MNIFunc_align(
                 interp="nn",
                 sup=True,
             )
-            time.sleep(0.5)
         except BaseException:
             print(
                 "Warning: Atlas is not in correct dimensions, or input is "
@@ -432,7 +472,6 @@ def RegisterParcellation2MNIFunc_align(
                 interp="nearestneighbour",
                 cost="mutualinfo",
             )
-            time.sleep(0.5)
     else:
         regutils.align(
             aligned_atlas_t1w,
@@ -444,7 +483,6 @@ def RegisterParcellation2MNIFunc_align(
             interp="nearestneighbour",
             cost="mutualinfo",
         )
-        time.sleep(0.5)
     return aligned_atlas_mni
 
 
@@ -467,7 +505,6 @@ def atlas2t1w_align(
     """
     A function to perform atlas alignment from atlas --> T1w.
     """
-    import time
     from pynets.registration import utils as regutils
     from nilearn.image import resample_to_img
     # from pynets.core.utils import checkConsecutive
@@ -502,7 +539,6 @@ def atlas2t1w_align(
                 sup=True,
                 mask=t1w_brain_mask,
             )
-            time.sleep(0.5)
         except BaseException:
             print(
                 "Warning: Atlas is not in correct dimensions, or input is low "
@@ -510,11 +546,9 @@ def atlas2t1w_align(
 
             regutils.applyxfm(t1w_brain, aligned_atlas_t1mni, mni2t1_xfm,
                               aligned_atlas_skull, interp="nearestneighbour")
-            time.sleep(0.5)
     else:
         regutils.applyxfm(t1w_brain, aligned_atlas_t1mni, mni2t1_xfm,
                           aligned_atlas_skull, interp="nearestneighbour")
-        time.sleep(0.5)
 
     # aligned_atlas_gm = regutils.apply_mask_to_image(aligned_atlas_skull,
     #                                                 gm_mask,
@@ -523,7 +557,6 @@ def atlas2t1w_align(
                                                     t1w_brain_mask,
                                                     aligned_atlas_gm)
 
-    time.sleep(0.5)
     atlas_img = nib.load(aligned_atlas_gm)
 
     atlas_img_corr = nib.Nifti1Image(
@@ -582,8 +615,7 @@ def segment_t1w(t1w, basename, opts=""):
     print("Segmenting Anatomical Image into WM, GM, and CSF...")
     # run FAST, with options -t for the image type and -n to
     # segment into CSF (pve_0), GM (pve_1), WM (pve_2)
-    cmd = f"fast -t 1 {opts} -n 3 -o {basename} {t1w}"
-    os.system(cmd)
+    run_fsl(f"fast -t 1 {opts} -n 3 -o {basename} {t1w}")
     out = {}  # the outputs
     out["wm_prob"] = f"{basename}_{'pve_2.nii.gz'}"
     out["gm_prob"] = f"{basename}_{'pve_1.nii.gz'}"
@@ -591,6 +623,347 @@ def segment_t1w(t1w, basename, opts=""):
     return out
 
 
+def run_fsl(cmd):
+    """
+    Runs an FSL command line to completion.
+
+    Parameters
+    ----------
+    cmd : str
+        The command line to run.
+
+    Raises
+    ------
+    RuntimeError
+        If the command exits with a nonzero status.
+    """
+    import subprocess
+
+    print(cmd)
+    proc = subprocess.run(cmd, shell=True, stderr=subprocess.PIPE,
+                          universal_newlines=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"{cmd.split()[0]} failed with exit status "
+                           f"{proc.returncode}:\n{proc.stderr}")
+    return
+
+
+def fsl_scaled_affine(img):
+    """
+    Affine from voxel indices to the FSL scaled-voxel coordinates (mm) in
+    which FLIRT matrices and FNIRT displacement fields are expressed.
+
+    Voxel indices are scaled by the voxel dimensions and, for images whose
+    voxel-to-world affine has a positive determinant (neurological storage
+    order), the x axis is flipped first.
+
+    Parameters
+    ----------
+    img : Nifti1Image
+        A nibabel image.
+
+    Returns
+    -------
+    scaled_affine : ndarray
+        A 4 x 4 voxel to FSL scaled-voxel affine.
+    """
+    scaled_affine = np.diag(np.append(
+        np.asarray(img.header.get_zooms()[:3], dtype=np.float64), 1.0))
+    if np.linalg.det(img.affine[:3, :3]) > 0:
+        flip = np.eye(4)
+        flip[0, 0] = -1
+        flip[0, 3] = img.shape[0] - 1
+        scaled_affine = scaled_affine @ flip
+    return scaled_affine
+
+
+def load_xfm(xfm):
+    """
+    Loads an FSL-style 4 x 4 affine .mat file.
+    """
+    return np.loadtxt(xfm, dtype=np.float64).reshape(4, 4)
+
+
+def save_xfm(mat, xfm):
+    """
+    Saves a 4 x 4 affine as an FSL-style .mat file.
+    """
+    np.savetxt(xfm, mat, fmt="%.10f", delimiter="  ")
+    return xfm
+
+
+def interp_order(interp):
+    """
+    Spline order equivalent to an FSL interpolation method.
+    """
+    orders = {None: 1, "trilinear": 1, "nearestneighbour": 0, "nn": 0,
+              "spline": 3, "sinc": 3}
+    if interp not in orders:
+        raise ValueError(f"Interpolation method {interp} not supported.")
+    return orders[interp]
+
+
+def resample_vox(inp_img, ref_img, vox_map, interp="trilinear",
+                 disp=None, mask=None):
+    """
+    Resamples an image onto the grid of a reference image in-process.
+
+    Parameters
+    ----------
+    inp_img : Nifti1Image
+        The 3D or 4D image to resample.
+    ref_img : Nifti1Image
+        Image defining the output grid.
+    vox_map : ndarray
+        4 x 4 affine mapping reference voxel indices to input voxel indices.
+        If `disp` is given, it instead maps FSL scaled-voxel coordinates of the
+        reference, after displacement, to input voxel indices.
+    interp : str
+        FSL interpolation method. Default is trilinear.
+    disp : callable
+        Optional function mapping an array of reference FSL scaled-voxel
+        coordinates of shape (3, N) to their warped coordinates.
+    mask : ndarray
+        Optional boolean array on the reference grid, outside of which the
+        output is zeroed.
+
+    Returns
+    -------
+    out_img : Nifti1Image
+        The resampled image, with the reference geometry and the input data
+        type.
+    """
+    from scipy.ndimage import affine_transform, map_coordinates
+
+    order = interp_order(interp)
+    dtype = inp_img.get_data_dtype()
+    if order == 0:
+        data = np.asanyarray(inp_img.dataobj)
+    else:
+        data = inp_img.get_fdata(dtype=np.float32)
+    # Pad with a voxel of zeros, so that samples up to half a voxel beyond
+    # the edges still round onto them, as in FSL
+    vols = np.pad(data.reshape(data.shape[:3] + (-1,)),
+                  [(1, 1)] * 3 + [(0, 0)], mode="constant")
+    vox_map = vox_map.copy()
+    vox_map[:3, 3] += 1
+    out_shape = ref_img.shape[:3]
+    out = np.zeros(out_shape + (vols.shape[-1],), dtype=vols.dtype)
+
+    if disp is None:
+        for vol in range(vols.shape[-1]):
+            out[..., vol] = affine_transform(
+                vols[..., vol], vox_map[:3, :3], offset=vox_map[:3, 3],
+                output_shape=out_shape, order=order, mode="constant",
+                cval=0)
+    else:
+        ref2scaled = fsl_scaled_affine(ref_img)
+        if order > 1:
+            from scipy.ndimage import spline_filter
+            vols = np.stack([spline_filter(vols[..., vol], order=order)
+                             for vol in range(vols.shape[-1])], axis=-1)
+        # Sample in slabs of z-slices to bound the size of coordinate arrays
+        slab = max(1, int(2e6 // (out_shape[0] * out_shape[1])))
+        for z0 in range(0, out_shape[2], slab):
+            z1 = min(z0 + slab, out_shape[2])
+            ijk = np.mgrid[0:out_shape[0], 0:out_shape[1], z0:z1].reshape(
+                3, -1).astype(np.float64)
+            coords = disp(ref2scaled[:3, :3] @ ijk + ref2scaled[:3, 3:])
+            coords = vox_map[:3, :3] @ coords + vox_map[:3, 3:]
+            for vol in range(vols.shape[-1]):
+                out[:, :, z0:z1, vol] = map_coordinates(
+                    vols[..., vol], coords, order=order, mode="constant",
+                    cval=0, prefilter=False).reshape(
+                    out_shape[:2] + (z1 - z0,))
+
+    if mask is not None:
+        out[~mask] = 0
+    if order > 0 and np.issubdtype(dtype, np.integer):
+        out = np.rint(out)
+    out = out.reshape(out_shape + data.shape[3:])
+
+    out_img = nib.Nifti1Image(out, ref_img.affine, ref_img.header)
+    out_img.set_data_dtype(dtype)
+    return out_img
+
+
+def fsl_displacement(warp_img, premat=None):
+    """
+    Builds a function applying an FSL displacement field, and optionally a
+    preceding affine, to reference FSL scaled-voxel coordinates.
+
+    Parameters
+    ----------
+    warp_img : Nifti1Image
+        A 4D displacement field with 3 volumes, in mm. Whether displacements
+        are relative or absolute is inferred from the field, as applywarp
+        does.
+    premat : ndarray
+        Optional 4 x 4 FSL affine from the input to the space that the field
+        warps into.
+
+    Returns
+    -------
+    disp : callable
+        Function mapping an array of reference FSL scaled-voxel coordinates of
+        shape (3, N) to input FSL scaled-voxel coordinates.
+    """
+    from scipy.ndimage import map_coordinates
+
+    field = warp_img.get_fdata(dtype=np.float32).reshape(
+        warp_img.shape[:3] + (3,))
+    scaled2warp = np.linalg.inv(fsl_scaled_affine(warp_img))
+
+    # Absolute fields hold coordinates, relative fields hold offsets from them
+    ijk = np.mgrid[tuple(slice(0, i, 4) for i in field.shape[:3])].reshape(
+        3, -1)
+    scaled = fsl_scaled_affine(warp_img)
+    coords = scaled[:3, :3] @ ijk + scaled[:3, 3:]
+    samples = field[ijk[0], ijk[1], ijk[2]].T
+    relative = np.abs(samples).mean() <= np.abs(samples - coords).mean()
+    inv_premat = np.linalg.inv(premat) if premat is not None else np.eye(4)
+
+    def disp(coords):
+        warp_vox = scaled2warp[:3, :3] @ coords + scaled2warp[:3, 3:]
+        warped = np.stack([map_coordinates(field[..., i], warp_vox, order=1,
+                                           mode="nearest")
+                           for i in range(3)])
+        if relative:
+            warped += coords
+        return inv_premat[:3, :3] @ warped + inv_premat[:3, 3:]
+
+    return disp
+
+
+def label_index_map(inp_img, ref_img, xfm=None, warp=None, mask=None,
+                    cache_dir=None):
+    """
+    Nearest-neighbour map from the voxels of a reference image to the voxels
+    of an input image, through an FSL affine and/or displacement field. Label
+    volumes on the input grid can then be resampled by indexing alone (see
+    `resample_labels`), rather than by one applywarp/flirt per volume.
+
+    Parameters
+    ----------
+    inp_img : Nifti1Image
+        Image defining the source grid.
+    ref_img : Nifti1Image
+        Image defining the target grid.
+    xfm : str
+        Optional file path to an FSL affine .mat file from input to
+        reference (or, with `warp`, to the space the field warps into).
+    warp : str
+        Optional file path to an FSL displacement field, as produced by
+        invwarp. Coefficient fields are not supported.
+    mask : str
+        Optional file path to a mask on the reference grid, outside of which
+        voxels map to nothing.
+    cache_dir : str
+        Optional directory in which to persist the map, keyed by the contents
+        of the transforms, mask, and both grids.
+
+    Returns
+    -------
+    index_map : ndarray
+        Flat indices into the input grid for every voxel of the reference
+        grid, in C order, or -1 for voxels mapping outside the input grid.
+    """
+    import hashlib
+
+    if cache_dir is not None:
+        from filelock import SoftFileLock
+
+        key = hashlib.sha1()
+        for img in [inp_img, ref_img]:
+            key.update(np.asarray(img.shape[:3], dtype=np.int64).tobytes())
+            key.update(np.asarray(img.affine, dtype=np.float64).tobytes())
+        for path in [xfm, warp, mask]:
+            key.update(b"\0")
+            if path is not None:
+                with open(path, "rb") as f:
+                    for chunk in iter(lambda: f.read(2 ** 20), b""):
+                        key.update(chunk)
+        os.makedirs(cache_dir, exist_ok=True)
+        map_path = f"{cache_dir}/index_map_{key.hexdigest()}.npy"
+        with SoftFileLock(f"{map_path}.lock"):
+            if not os.path.isfile(map_path):
+                index_map = label_index_map(inp_img, ref_img, xfm=xfm,
+                                            warp=warp, mask=mask)
+                np.save(f"{map_path}.tmp.npy", index_map)
+                os.replace(f"{map_path}.tmp.npy", map_path)
+            else:
+                index_map = np.load(map_path)
+        return index_map
+
+    premat = load_xfm(xfm) if xfm is not None else np.eye(4)
+    if warp is not None:
+        warp_img = nib.load(warp)
+        if int(warp_img.header["intent_code"]) in [2007, 2008, 2009, 2016,
+                                                   2017]:
+            raise ValueError(f"{warp} is not a displacement field.")
+        disp = fsl_displacement(warp_img, premat)
+    else:
+        inv_premat = np.linalg.inv(premat)
+
+        def disp(coords):
+            return inv_premat[:3, :3] @ coords + inv_premat[:3, 3:]
+
+    ref2scaled = fsl_scaled_affine(ref_img)
+    scaled2inp = np.linalg.inv(fsl_scaled_affine(inp_img))
+    inp_shape = np.asarray(inp_img.shape[:3])
+    out_shape = ref_img.shape[:3]
+    index_map = np.empty(np.prod(out_shape), dtype=np.int32)
+
+    # Map in slabs of z-slices to bound the size of coordinate arrays
+    slab = max(1, int(2e6 // (out_shape[0] * out_shape[1])))
+    for z0 in range(0, out_shape[2], slab):
+        z1 = min(z0 + slab, out_shape[2])
+        ijk = np.mgrid[0:out_shape[0], 0:out_shape[1], z0:z1].reshape(
+            3, -1).astype(np.float64)
+        coords = disp(ref2scaled[:3, :3] @ ijk + ref2scaled[:3, 3:])
+        # Round halves up, as FSL does
+        vox = np.floor(scaled2inp[:3, :3] @ coords + scaled2inp[:3, 3:] +
+                       0.5).astype(np.int64)
+        inside = np.all((vox >= 0) & (vox < inp_shape[:, None]), axis=0)
+        flat = np.ravel_multi_index(tuple(np.where(inside, vox, 0)),
+                                    tuple(inp_shape))
+        # ijk is C-ordered within each slab, so write it out slab-major
+        index_map.reshape(out_shape)[:, :, z0:z1] = np.where(
+            inside, flat, -1).reshape(out_shape[:2] + (z1 - z0,))
+
+    if mask is not None:
+        index_map[np.asanyarray(nib.load(mask).dataobj).reshape(-1) <= 0] = -1
+    return index_map
+
+
+def resample_labels(label_arrays, index_map, ref_shape):
+    """
+    Resamples any number of label volumes sharing a grid through a single
+    nearest-neighbour `label_index_map` lookup.
+
+    Parameters
+    ----------
+    label_arrays : list
+        Label volumes on the source grid of `index_map`.
+    index_map : ndarray
+        Output of `label_index_map`.
+    ref_shape : tuple
+        Shape of the target grid of `index_map`.
+
+    Returns
+    -------
+    resampled : ndarray
+        Label volumes on the target grid, stacked along the first axis, with
+        zeros wherever `index_map` is -1.
+    """
+    stacked = np.stack([np.asarray(i).reshape(-1) for i in label_arrays])
+    # Index -1 lands on an appended column of zeros
+    stacked = np.concatenate([stacked, np.zeros((stacked.shape[0], 1),
+                                                dtype=stacked.dtype)], axis=1)
+    return stacked[:, index_map].reshape((len(label_arrays),) +
+                                         tuple(ref_shape))
+
+
 def align(
     inp,
     ref,
@@ -660,8 +1033,7 @@ def align(
         cmd += f" -wmseg {wmseg}"
     if init is not None:
         cmd += f" -init {init}"
-    print(cmd)
-    os.system(cmd)
+    run_fsl(cmd)
     return
 
 
@@ -710,14 +1082,14 @@ def align_nonlinear(
         cmd += f" --inmask={in_mask}"
     if config is not None:
         cmd += f" --config={config}"
-    print(cmd)
-    os.system(cmd)
+    run_fsl(cmd)
     return
 
 
 def applyxfm(ref, inp, xfm, aligned, interp="trilinear", dof=6):
     """
-    Aligns two images with a given transform.
+    Aligns two images with a given transform. The transform is applied
+    in-process, equivalently to `flirt -applyxfm`.
 
     Parameters
     ----------
@@ -734,13 +1106,17 @@ def applyxfm(ref, inp, xfm, aligned, interp="trilinear", dof=6):
         interp : str
             Interpolation method to use. Default is trilinear.
         dof : int
-            Number of degrees of freedom to use in the alignment.
+            Number of degrees of freedom to use in the alignment. Unused, since
+            the transform is given.
 
     """
-    cmd = f"flirt -in {inp} -ref {ref} -out {aligned} -init {xfm} -interp" \
-          f" {interp} -dof {dof} -applyxfm"
-    print(cmd)
-    os.system(cmd)
+    inp_img = nib.load(inp)
+    ref_img = nib.load(ref)
+
+    # FLIRT matrices map input to reference FSL scaled-voxel coordinates
+    vox_map = np.linalg.inv(fsl_scaled_affine(inp_img)) @ \
+        np.linalg.inv(load_xfm(xfm)) @ fsl_scaled_affine(ref_img)
+    nib.save(resample_vox(inp_img, ref_img, vox_map, interp=interp), aligned)
     return
 
 
@@ -755,7 +1131,9 @@ def apply_warp(
         sup=False):
     """
     Applies a warp to a Nifti1Image which transforms the image to the
-    reference space used in generating the warp.
+    reference space used in generating the warp. Affines and displacement
+    fields are applied in-process, equivalently to `applywarp`, whereas FNIRT
+    coefficient fields are passed to `applywarp` itself.
 
     Parameters
     ----------
@@ -777,9 +1155,35 @@ def apply_warp(
         interp : str
             Interpolation method to use.
         sup : bool
-            Intermediary supersampling of output. Default is False.
+            Intermediary supersampling of output, used only by `applywarp`.
+            Default is False.
 
     """
+    # NIfTI intent codes of FNIRT/TOPUP spline and DCT coefficient fields
+    fsl_coef_intents = [2007, 2008, 2009, 2016, 2017]
+
+    ref_img = nib.load(ref)
+    warp_img = nib.load(warp) if warp is not None else None
+    if warp_img is None or \
+            int(warp_img.header["intent_code"]) not in fsl_coef_intents:
+        inp_img = nib.load(inp)
+        premat = load_xfm(xfm) if xfm is not None else np.eye(4)
+        if mask is not None:
+            mask = np.asanyarray(nib.load(mask).dataobj).reshape(
+                ref_img.shape[:3]) > 0
+        if warp_img is None:
+            vox_map = np.linalg.inv(fsl_scaled_affine(inp_img)) @ \
+                np.linalg.inv(premat) @ fsl_scaled_affine(ref_img)
+            out_img = resample_vox(inp_img, ref_img, vox_map, interp=interp,
+                                   mask=mask)
+        else:
+            out_img = resample_vox(
+                inp_img, ref_img,
+                np.linalg.inv(fsl_scaled_affine(inp_img)), interp=interp,
+                disp=fsl_displacement(warp_img, premat), mask=mask)
+        nib.save(out_img, out)
+        return
+
     cmd = f"applywarp --ref={ref} --in={inp} --out={out}"
     if xfm is not None:
         cmd += f" --premat={xfm}"
@@ -791,8 +1195,7 @@ def apply_warp(
         cmd += f" --interp={interp}"
     if sup is True:
         cmd += " --super --superlevel=a"
-    print(cmd)
-    os.system(cmd)
+    run_fsl(cmd)
     return
 
 
@@ -814,9 +1217,7 @@ def inverse_warp(ref, out, warp):
             following alignment.
 
     """
-    cmd = f"invwarp --warp={warp} --out={out} --ref={ref}"
-    print(cmd)
-    os.system(cmd)
+    run_fsl(f"invwarp --warp={warp} --out={out} --ref={ref}")
     return
 
 
@@ -828,42 +1229,187 @@ def combine_xfms(xfm1, xfm2, xfmout):
     Parameters
     ----------
         xfm1 : str
-            File path to the first transformation.
+            File path to the first transformation, applied first.
         xfm2 : str
-            File path to the second transformation.
+            File path to the second transformation, applied to the output of
+            the first.
         xfmout : str
             File path to the output transformation.
 
     """
-    cmd = f"convert_xfm -omat {xfmout} -concat {xfm1} {xfm2}"
-    print(cmd)
-    os.system(cmd)
+    save_xfm(load_xfm(xfm2) @ load_xfm(xfm1), xfmout)
     return
 
 
+class TransformRegistry(object):
+    """
+    A subject-level registry of the transforms relating template (e.g. mni),
+    anatomical (t1w), and native (e.g. dwi, epi) spaces.
+
+    Transforms are recorded once per subject, keyed by their source and target
+    spaces, in a manifest kept in the subject's `reg` directory along with a
+    digest of their contents. Composed affines are computed on first use and
+    persisted alongside them, so that every atlas and ROI registered for the
+    subject resolves the same files instead of copying or recomputing them.
+    Composed entries are recomputed whenever a transform they derive from
+    changes.
+    """
+
+    def __init__(self, reg_path):
+        self.reg_path = reg_path
+        self.reg_path_mat = f"{reg_path}/mats"
+        self.manifest = f"{reg_path}/transforms.json"
+        os.makedirs(self.reg_path_mat, exist_ok=True)
+
+    @staticmethod
+    def key(source, target, kind="xfm"):
+        return f"{source}2{target}_{kind}"
+
+    def _load(self):
+        import json
+
+        if not os.path.isfile(self.manifest):
+            return {}
+        with open(self.manifest, "r") as f:
+            return json.load(f)
+
+    def _save(self, transforms):
+        import json
+
+        with open(f"{self.manifest}.tmp", "w") as f:
+            json.dump(transforms, f, indent=2)
+        os.replace(f"{self.manifest}.tmp", self.manifest)
+
+    @staticmethod
+    def _stat(path):
+        stat = os.stat(path)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def _digest(self, path, entry=None):
+        import hashlib
+
+        # Skip rehashing files that are unchanged since they were recorded
+        if entry is not None and entry["path"] == path and \
+                entry["stat"] == self._stat(path):
+            return entry["digest"]
+        digest = hashlib.sha1()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(2 ** 20), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def register(self, source, target, path, kind="xfm"):
+        """
+        Record a transform from `source` to `target` space.
+
+        Parameters
+        ----------
+        source : str
+            Name of the source space (e.g. 'mni').
+        target : str
+            Name of the target space (e.g. 't1w').
+        path : str
+            File path to the transform.
+        kind : str
+            Either 'xfm', for an FSL-style affine .mat file, or 'warp', for a
+            nonlinear warp field. Default is 'xfm'.
+
+        Returns
+        -------
+        path : str
+            File path to the transform.
+        """
+        from filelock import SoftFileLock
+
+        key = self.key(source, target, kind)
+        with SoftFileLock(f"{self.manifest}.lock"):
+            transforms = self._load()
+            entry = transforms.get(key)
+            digest = self._digest(path, entry)
+            if entry is None or entry["path"] != path or \
+                    entry["digest"] != digest or \
+                    entry["stat"] != self._stat(path):
+                transforms[key] = {"path": path, "digest": digest,
+                                   "stat": self._stat(path), "inputs": {}}
+                self._save(transforms)
+        return path
+
+    def get(self, source, target, kind="xfm"):
+        """
+        File path to a recorded transform from `source` to `target` space, or
+        None if there is none.
+        """
+        entry = self._load().get(self.key(source, target, kind))
+        if entry is None or not os.path.isfile(entry["path"]):
+            return None
+        return entry["path"]
+
+    def compose(self, source, via, target):
+        """
+        Affine from `source` to `target` space through `via` space, composed
+        from the recorded `source`-->`via` and `via`-->`target` affines on
+        first use.
+
+        Returns
+        -------
+        xfm : str
+            File path to the composed FSL-style affine .mat file.
+        """
+        from filelock import SoftFileLock
+
+        first = self.key(source, via)
+        second = self.key(via, target)
+        key = self.key(source, target)
+        with SoftFileLock(f"{self.manifest}.lock"):
+            transforms = self._load()
+            missing = [i for i in [first, second] if i not in transforms]
+            if len(missing) > 0:
+                raise ValueError(f"Transforms {missing} have not been "
+                                 f"registered in {self.reg_path}")
+            inputs = {i: transforms[i]["digest"] for i in [first, second]}
+            entry = transforms.get(key)
+            if entry is not None and entry["inputs"] == inputs and \
+                    os.path.isfile(entry["path"]):
+                return entry["path"]
+
+            xfm = f"{self.reg_path_mat}/{key}.mat"
+            combine_xfms(transforms[first]["path"],
+                         transforms[second]["path"], xfm)
+            transforms[key] = {"path": xfm, "digest": self._digest(xfm),
+                               "stat": self._stat(xfm), "inputs": inputs}
+            self._save(transforms)
+        return xfm
+
+
 def invert_xfm(in_mat, out_mat):
-    import os
-    cmd = f"convert_xfm -omat {out_mat} -inverse {in_mat}"
-    print(cmd)
-    os.system(cmd)
+    save_xfm(np.linalg.inv(load_xfm(in_mat)), out_mat)
     return out_mat
 
 
 def apply_mask_to_image(input, mask, output):
-    import os
+    """
+    Masks an image in-process, equivalently to
+    `fslmaths input -mas mask -thrp 0.0001 output`.
+    """
+    img = nib.load(input)
+    data = np.array(img.dataobj)
+    mask_data = np.asanyarray(nib.load(mask).dataobj)
+    if mask_data.shape[:3] != data.shape[:3]:
+        raise ValueError(f"{mask} and {input} dimensions differ.")
 
-    cmd = f"fslmaths {input} -mas {mask} -thrp 0.0001 {output}"
-    print(cmd)
-    os.system(cmd)
+    data[mask_data.reshape(mask_data.shape[:3]) <= 0] = 0
+    robust_min, robust_max = np.percentile(data, [2, 98])
+    data[data < robust_min + 1e-6 * (robust_max - robust_min)] = 0
+
+    out_img = nib.Nifti1Image(data, img.affine, img.header)
+    out_img.set_data_dtype(img.get_data_dtype())
+    nib.save(out_img, output)
 
     return output
 
 
 def get_wm_contour(wm_map, mask, wm_edge):
-    import os
-    cmd = f"fslmaths {wm_map} -edge -bin -mas {mask} {wm_edge}"
-    print(cmd)
-    os.system(cmd)
+    run_fsl(f"fslmaths {wm_map} -edge -bin -mas {mask} {wm_edge}")
     return wm_edge
 
 
@@ -883,37 +1429,78 @@ def warp_streamlines(
     warped_fa_img,
     streams_in_curr_grid,
     brain_mask,
+    chunk_size=1000000,
 ):
-    from dipy.tracking import utils
-    from dipy.tracking.streamline import (
-        values_from_volume,
-        transform_streamlines,
-        Streamlines,
-    )
+    """
+    Deform streamlines with a DiPy SyN mapping and keep those in the brain.
 
-    # Deform streamlines, isocenter, and remove streamlines outside brain
-    streams_in_brain = [
-        sum(d, s)
-        for d, s in zip(
-            values_from_volume(
-                mapping.get_forward_field(), streams_in_curr_grid, ref_grid_aff
-            ),
-            streams_in_curr_grid,
-        )
-    ]
-    streams_final_filt = Streamlines(
-        utils.target_line_based(
-            transform_streamlines(
-                transform_streamlines(
-                    streams_in_brain,
-                    np.linalg.inv(adjusted_affine)),
-                np.linalg.inv(
-                    warped_fa_img.affine),
-            ),
-            np.eye(4),
-            brain_mask,
-            include=True,
-        ))
+    All streamlines are handled as one flat point buffer: displacements are
+    sampled from the forward field for every point at once, the isocentering
+    and voxel affines are composed into a single matrix applied in-place,
+    and the brain mask is tested on per-streamline views of the buffer taken
+    at their offsets.
+    Memory stays at about one copy of the tractogram.
+
+    Parameters
+    ----------
+    adjusted_affine : ndarray
+        Affine of the isocentered template grid.
+    ref_grid_aff : ndarray
+        Affine of the grid on which the SyN mapping was estimated.
+    mapping : DiffeomorphicMap
+        DiPy SyN mapping whose forward field is used to deform the points.
+    warped_fa_img : Nifti1Image
+        FA image warped to template space.
+    streams_in_curr_grid : ArraySequence
+        DiPy list/array-like object of streamline points in the grid of
+        `ref_grid_aff`.
+    brain_mask : ndarray
+        Binary brain mask in template voxel space.
+    chunk_size : int
+        Maximum number of points transformed per step. Default is 1000000.
+
+    Returns
+    -------
+    streams_final_filt : ArraySequence
+        Warped streamlines, in template voxel coordinates, that pass
+        through the brain mask.
+    """
+    from dipy.tracking._utils import _mapping_to_voxel
+    from dipy.tracking.streamline import values_from_volume, Streamlines
+    from dipy.tracking.vox2track import _streamlines_in_mask
+    from pynets.dmri.utils import streamline_buffer
+
+    points, lengths = streamline_buffer(streams_in_curr_grid)
+    points = np.array(points, dtype=np.result_type(points.dtype, "float32"))
+    offsets = np.cumsum(lengths) - lengths
+
+    # Deform all points at once
+    field = mapping.get_forward_field()
+    for start in range(0, len(points), chunk_size):
+        chunk = points[start:start + chunk_size]
+        chunk += np.asarray(values_from_volume(field, chunk[None],
+                                               ref_grid_aff)[0],
+                            dtype=points.dtype)
+
+    # Isocenter and map to voxel space with one composed affine
+    aff = np.dot(np.linalg.inv(warped_fa_img.affine),
+                 np.linalg.inv(adjusted_affine)).astype(points.dtype)
+    for start in range(0, len(points), chunk_size):
+        chunk = points[start:start + chunk_size]
+        chunk[:] = np.dot(chunk, aff[:3, :3].T) + aff[:3, 3]
+
+    # Remove streamlines outside brain, with the line-based test of
+    # `target_line_based` run on views of the buffer
+    lin_T, offset = _mapping_to_voxel(np.eye(4))
+    keep = _streamlines_in_mask(
+        [points[o:o + n] for o, n in zip(offsets, lengths)],
+        np.array(brain_mask, dtype="uint8"), lin_T, offset) == 1
+
+    point_keep = np.repeat(keep, lengths)
+    streams_final_filt = Streamlines()
+    streams_final_filt._data = points[point_keep]
+    streams_final_filt._lengths = lengths[keep]
+    streams_final_filt._offsets = np.cumsum(lengths[keep]) - lengths[keep]
 
     return streams_final_filt
 
@@ -960,9 +1547,10 @@ def rescale_affine_to_center(input_affine, voxel_dims=[1, 1, 1],
 
 
 def wm_syn(t1w_brain, ap_path, working_dir, fa_path=None,
-           template_fa_path=None):
+           template_fa_path=None, profile="accurate"):
     """
-    A function to perform SyN registration
+    A function to perform SyN registration. The mapping is computed once per
+    set of inputs and profile, and cached in `working_dir` for reuse.
 
     Parameters
     ----------
@@ -976,9 +1564,16 @@ def wm_syn(t1w_brain, ap_path, working_dir, fa_path=None,
             File path to the FA moving image.
         template_fa_path  : str
             File path to the T1w-connformed template FA reference image.
+        profile : str
+            Registration profile. 'accurate' refines the affine and
+            diffeomorphic fits at full resolution. 'fast' uses fewer affine
+            iterations, stops both fits one pyramid level short of full
+            resolution, and estimates mutual information from a 25% sample of
+            voxels. Default is 'accurate'.
     """
-    import uuid
-    from time import strftime
+    import hashlib
+    import pickle
+    from filelock import SoftFileLock
     from dipy.align.imaffine import (
         MutualInformationMetric,
         AffineRegistration,
@@ -995,107 +1590,143 @@ def wm_syn(t1w_brain, ap_path, working_dir, fa_path=None,
     # from dipy.viz import regtools
     # from nilearn.image import resample_to_img
 
-    ap_img = nib.load(ap_path)
-    t1w_brain_img = nib.load(t1w_brain)
-    static = np.asarray(t1w_brain_img.dataobj, dtype=np.float32)
-    static_affine = t1w_brain_img.affine
-    moving = np.asarray(ap_img.dataobj, dtype=np.float32)
-    moving_affine = ap_img.affine
-
-    affine_map = transform_origins(
-        static, static_affine, moving, moving_affine)
-
-    nbins = 32
-    sampling_prop = None
-    metric = MutualInformationMetric(nbins, sampling_prop)
-
-    level_iters = [10, 10, 5]
-    sigmas = [3.0, 1.0, 0.0]
-    factors = [4, 2, 1]
-    affine_reg = AffineRegistration(
-        metric=metric, level_iters=level_iters, sigmas=sigmas, factors=factors
-    )
-    transform = TranslationTransform3D()
-
-    params0 = None
-    translation = affine_reg.optimize(
-        static, moving, transform, params0, static_affine, moving_affine
-    )
-    transform = RigidTransform3D()
-
-    rigid_map = affine_reg.optimize(
-        static,
-        moving,
-        transform,
-        params0,
-        static_affine,
-        moving_affine,
-        starting_affine=translation.affine,
-    )
-    transform = AffineTransform3D()
-
-    # We bump up the iterations to get a more exact fit:
-    affine_reg.level_iters = [1000, 1000, 100]
-    affine_opt = affine_reg.optimize(
-        static,
-        moving,
-        transform,
-        params0,
-        static_affine,
-        moving_affine,
-        starting_affine=rigid_map.affine,
-    )
-
-    # We now perform the non-rigid deformation using the Symmetric
-    # Diffeomorphic Registration(SyN) Algorithm:
-    metric = CCMetric(3)
-    level_iters = [10, 10, 5]
-
-    # Refine fit
+    # Iterations per pyramid level, coarsest first
+    profiles = {
+        "accurate": {"level_iters": [10, 10, 5],
+                     "refine_iters": [1000, 1000, 100],
+                     "syn_iters": [10, 10, 5],
+                     "sampling_prop": None},
+        "fast": {"level_iters": [10, 10, 0],
+                 "refine_iters": [100, 100, 0],
+                 "syn_iters": [10, 10, 0],
+                 "sampling_prop": 0.25},
+    }
+    if profile not in profiles:
+        raise ValueError(f"SyN profile {profile} not recognized. Options "
+                         f"are: {list(profiles.keys())}")
+    params = profiles[profile]
+
+    # The mapping depends only on the images registered and the profile
+    inputs = [t1w_brain, ap_path]
     if template_fa_path is not None:
-        from nilearn.image import resample_to_img
-        fa_img = nib.load(fa_path)
-        template_img = nib.load(template_fa_path)
-        template_img_res = resample_to_img(template_img, t1w_brain_img)
-        static = np.asarray(template_img_res.dataobj, dtype=np.float32)
-        static_affine = template_img_res.affine
-        moving = np.asarray(fa_img.dataobj, dtype=np.float32)
-        moving_affine = fa_img.affine
-    else:
+        inputs += [fa_path, template_fa_path]
+    key = hashlib.sha1(profile.encode())
+    for path in inputs:
+        key.update(b"\0")
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(2 ** 20), b""):
+                key.update(chunk)
+    key = key.hexdigest()
+    mapping_path = f"{working_dir}/syn_{key}.pkl"
+    warped_fa = f"{working_dir}/warped_fa_{key}.nii.gz"
+
+    with SoftFileLock(f"{mapping_path}.lock"):
+        if os.path.isfile(mapping_path) and os.path.isfile(warped_fa):
+            with open(mapping_path, "rb") as f:
+                mapping, affine_map = pickle.load(f)
+            return mapping, affine_map, warped_fa
+
+        ap_img = nib.load(ap_path)
+        t1w_brain_img = nib.load(t1w_brain)
         static = np.asarray(t1w_brain_img.dataobj, dtype=np.float32)
         static_affine = t1w_brain_img.affine
         moving = np.asarray(ap_img.dataobj, dtype=np.float32)
         moving_affine = ap_img.affine
 
-    sdr = SymmetricDiffeomorphicRegistration(metric, level_iters)
+        affine_map = transform_origins(
+            static, static_affine, moving, moving_affine)
 
-    mapping = sdr.optimize(
-        static, moving, static_affine, moving_affine, affine_opt.affine
-    )
-    warped_moving = mapping.transform(moving)
+        nbins = 32
+        metric = MutualInformationMetric(
+            nbins=nbins, sampling_proportion=params["sampling_prop"])
 
-    # Save warped FA image
-    run_uuid = f"{strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4()}"
-    warped_fa = f"{working_dir}/warped_fa_{run_uuid}.nii.gz"
-    nib.save(
-        nib.Nifti1Image(
-            warped_moving,
-            affine=static_affine),
-        warped_fa)
-
-    # # We show the registration result with:
-    # regtools.overlay_slices(static, warped_moving, None, 0,
-    # "Static", "Moving",
-    #                         "%s%s%s%s" % (working_dir,
-    #                         "/transformed_sagittal_", run_uuid, ".png"))
-    # regtools.overlay_slices(static, warped_moving, None,
-    # 1, "Static", "Moving",
-    #                         "%s%s%s%s" % (working_dir,
-    #                         "/transformed_coronal_", run_uuid, ".png"))
-    # regtools.overlay_slices(static, warped_moving,
-    # None, 2, "Static", "Moving",
-    #                         "%s%s%s%s" % (working_dir,
-    #                         "/transformed_axial_", run_uuid, ".png"))
+        sigmas = [3.0, 1.0, 0.0]
+        factors = [4, 2, 1]
+        affine_reg = AffineRegistration(
+            metric=metric, level_iters=params["level_iters"], sigmas=sigmas,
+            factors=factors
+        )
+        transform = TranslationTransform3D()
+
+        params0 = None
+        translation = affine_reg.optimize(
+            static, moving, transform, params0,
+            static_grid2world=static_affine, moving_grid2world=moving_affine
+        )
+        transform = RigidTransform3D()
+
+        rigid_map = affine_reg.optimize(
+            static,
+            moving,
+            transform,
+            params0,
+            static_grid2world=static_affine,
+            moving_grid2world=moving_affine,
+            starting_affine=translation.affine,
+        )
+        transform = AffineTransform3D()
+
+        # We bump up the iterations to get a more exact fit:
+        affine_reg.level_iters = params["refine_iters"]
+        affine_opt = affine_reg.optimize(
+            static,
+            moving,
+            transform,
+            params0,
+            static_grid2world=static_affine,
+            moving_grid2world=moving_affine,
+            starting_affine=rigid_map.affine,
+        )
+
+        # We now perform the non-rigid deformation using the Symmetric
+        # Diffeomorphic Registration(SyN) Algorithm:
+        metric = CCMetric(3)
+
+        # Refine fit
+        if template_fa_path is not None:
+            from nilearn.image import resample_to_img
+            fa_img = nib.load(fa_path)
+            template_img = nib.load(template_fa_path)
+            template_img_res = resample_to_img(template_img, t1w_brain_img)
+            static = np.asarray(template_img_res.dataobj, dtype=np.float32)
+            static_affine = template_img_res.affine
+            moving = np.asarray(fa_img.dataobj, dtype=np.float32)
+            moving_affine = fa_img.affine
+
+        sdr = SymmetricDiffeomorphicRegistration(
+            metric, level_iters=params["syn_iters"])
+
+        mapping = sdr.optimize(
+            static, moving, static_grid2world=static_affine,
+            moving_grid2world=moving_affine, prealign=affine_opt.affine
+        )
+        warped_moving = mapping.transform(moving)
+
+        # Save warped FA image
+        nib.save(
+            nib.Nifti1Image(
+                warped_moving,
+                affine=static_affine),
+            warped_fa)
+
+        # # We show the registration result with:
+        # regtools.overlay_slices(static, warped_moving, None, 0,
+        # "Static", "Moving",
+        #                         "%s%s%s%s" % (working_dir,
+        #                         "/transformed_sagittal_", run_uuid, ".png"))
+        # regtools.overlay_slices(static, warped_moving, None,
+        # 1, "Static", "Moving",
+        #                         "%s%s%s%s" % (working_dir,
+        #                         "/transformed_coronal_", run_uuid, ".png"))
+        # regtools.overlay_slices(static, warped_moving,
+        # None, 2, "Static", "Moving",
+        #                         "%s%s%s%s" % (working_dir,
+        #                         "/transformed_axial_", run_uuid, ".png"))
+
+        with open(f"{mapping_path}.tmp", "wb") as f:
+            pickle.dump((mapping, affine_map), f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(f"{mapping_path}.tmp", mapping_path)
 
     return mapping, affine_map, warped_fa
 
@@ -31,9 +31,10 @@ setup(
             'pynets=pynets.cli.pynets_run:main',
             'pynets_cloud=pynets.cli.pynets_cloud:main',
             'pynets_bids=pynets.cli.pynets_bids:main',
-            'pynets_collect=pynets.cli.pynets_collect:main'
+            'pynets_collect=pynets.cli.pynets_collect:main',
             'pynets_benchmark=pynets.cli.pynets_benchmark:main',
-            'pynets_predict=pynets.cli.pynets_predict:main'
+            'pynets_predict=pynets.cli.pynets_predict:main',
+            'pynets_atlases=pynets.cli.pynets_atlases:main'
         ]
     },
     include_package_data=True,
@@ -8,6 +8,25 @@ from dipy.core.gradients import gradient_table
 import pickle
 
 
+@pytest.fixture(scope='function')
+def function_cache(tmp_path, monkeypatch):
+    """Fixture enabling memoization with a temporary function cache."""
+    from pynets.core import utils
+
+    load_runconfig = utils.load_runconfig
+    cache_dir = str(tmp_path/"function_cache")
+
+    def _load_runconfig():
+        hardcoded_params = load_runconfig()
+        hardcoded_params["memoize"] = [True]
+        hardcoded_params["function_cache"] = [cache_dir]
+        return hardcoded_params
+
+    monkeypatch.setattr(utils, "load_runconfig", _load_runconfig)
+
+    yield cache_dir
+
+
 @pytest.fixture(scope='module')
 def dmri_estimation_data():
     """Fixture for dmri estimation tests."""
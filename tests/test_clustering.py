@@ -198,3 +198,154 @@ def test_ni_parcellate_mult_conn_comps(clust_type):
     nib.save(parcellation, out_path)
     assert atlas is not None
     assert os.path.isfile(out_path)
+
+
+@pytest.mark.parametrize("clust_type", ['ward', 'average', 'kmeans', 'ncut'])
+def test_ensemble_parcellate_arrays(clust_type):
+    """
+    Test for in-memory bootstrapped ensemble clustering
+    """
+    from scipy.sparse import coo_matrix
+
+    mask_data = np.zeros((8, 8, 8), dtype='uint8')
+    mask_data[1:7, 1:7, 1:7] = 1
+    mask_img = nib.Nifti1Image(mask_data, np.eye(4))
+    n_voxels = int(mask_data.sum())
+    ts_data = np.random.rand(60, n_voxels).astype('float32')
+
+    rows, cols = clustools.mask_edges(mask_img)
+    assert len(rows) == len(cols)
+    assert np.all(rows < cols)
+
+    local_conn = coo_matrix((np.ones(len(rows)), (rows, cols)),
+                            shape=(n_voxels, n_voxels)).tocsc()
+
+    out_img = clustools.ensemble_parcellate_arrays(
+        ts_data, 7, clust_type, 10, 4, mask_img, local_conn=local_conn)
+
+    out_data = np.asarray(out_img.dataobj)
+    assert isinstance(out_img, nib.Nifti1Image)
+    assert out_data.shape == mask_data.shape
+    assert np.all(out_data[mask_data == 0] == 0)
+    assert np.all(out_data[mask_data > 0] > 0)
+
+
+@pytest.mark.parametrize("clust_type", ['ward', 'average', 'kmeans', 'ncut'])
+def test_ensemble_parcellate_arrays_disk(clust_type, tmp_path):
+    """
+    Test that bootstrapped ensembles held in memory and written to disk
+    yield identical parcellations
+    """
+    mask_data = np.zeros((8, 8, 8), dtype='uint8')
+    mask_data[1:7, 1:7, 1:7] = 1
+    mask_img = nib.Nifti1Image(mask_data, np.eye(4))
+    n_voxels = int(mask_data.sum())
+    ts_data = np.random.RandomState(0).rand(60, n_voxels).astype('float32')
+    rows, cols = clustools.mask_edges(mask_img)
+    local_conn = clustools.edge_correlations(ts_data, rows, cols,
+                                             r_thresh=0)
+
+    memory_img = clustools.ensemble_parcellate_arrays(
+        ts_data, 7, clust_type, 10, 3, mask_img, local_conn=local_conn)
+    disk_img = clustools.ensemble_parcellate_arrays(
+        ts_data, 7, clust_type, 10, 3, mask_img, local_conn=local_conn,
+        work_dir=str(tmp_path))
+
+    assert np.array_equal(np.asarray(memory_img.dataobj),
+                          np.asarray(disk_img.dataobj))
+    assert os.listdir(str(tmp_path)) == []
+
+
+@pytest.mark.parametrize("solver", ['arpack', 'lobpcg'])
+def test_ncut_solvers(solver):
+    """
+    Test for ncut eigensolver backends, including warm starts
+    """
+    results = clustools.benchmark_ncut_solvers(mask_shape=(12, 12, 12), k=8,
+                                               n_timepoints=60,
+                                               solvers=('arpack', solver))
+    assert results[solver]['n_clusters'] > 1
+    assert results[solver]['ari_truth'] > 0.5
+    assert -1 <= results[solver]['ari_reference'] <= 1
+
+    mask_img = nib.Nifti1Image(np.ones((6, 6, 6), dtype='uint8'), np.eye(4))
+    rows, cols = clustools.mask_edges(mask_img)
+    W = clustools.edge_correlations(np.random.rand(40, 216).astype('float32'),
+                                    rows, cols, r_thresh=0)
+    _, eigenvec = clustools.ncut(W, 5, solver=solver)
+    eigen_val, eigenvec_warm = clustools.ncut(W, 5, solver=solver,
+                                              init_vec=eigenvec)
+    assert eigenvec_warm.shape == (216, 5)
+    assert np.all(np.diff(eigen_val) <= 0)
+
+
+@pytest.mark.parametrize("clust_type", ['ward', 'average', 'complete',
+                                        'ncut'])
+def test_parcellate_arrays_multi_k(clust_type):
+    """
+    Test for multi-k parcellation from a single clustering fit
+    """
+    from sklearn.cluster import AgglomerativeClustering
+
+    mask_data = np.zeros((8, 8, 8), dtype='uint8')
+    mask_data[1:7, 1:7, 1:7] = 1
+    mask_img = nib.Nifti1Image(mask_data, np.eye(4))
+    n_voxels = int(mask_data.sum())
+    ts_data = np.random.rand(60, n_voxels).astype('float32')
+    rows, cols = clustools.mask_edges(mask_img)
+    local_conn = clustools.edge_correlations(ts_data, rows, cols,
+                                             r_thresh=0)
+
+    k_list = [5, 10, 20]
+    labels = clustools.cluster_arrays(ts_data, clust_type, k_list, rows, cols,
+                                      connectivity=local_conn,
+                                      affinity=local_conn)
+    assert labels.shape == (len(k_list), n_voxels)
+    if clust_type != 'ncut':
+        for k, k_labels in zip(k_list, labels):
+            assert len(np.unique(k_labels)) == k
+            ref = AgglomerativeClustering(
+                n_clusters=k, linkage=clust_type,
+                connectivity=local_conn).fit(ts_data.T).labels_
+            # Same partition, up to label permutation
+            assert np.unique(np.vstack([ref, k_labels]),
+                             axis=1).shape[1] == k
+
+    out_imgs = clustools.parcellate_arrays(ts_data, clust_type, k_list,
+                                           mask_img, local_conn=local_conn)
+    assert len(out_imgs) == len(k_list)
+    for out_img in out_imgs:
+        out_data = np.asarray(out_img.dataobj)
+        assert np.all(out_data[mask_data == 0] == 0)
+        assert np.all(out_data[mask_data > 0] > 0)
+
+    boot_imgs = clustools.ensemble_parcellate_arrays(
+        ts_data, 7, clust_type, k_list, 2, mask_img, local_conn=local_conn)
+    assert len(boot_imgs) == len(k_list)
+
+
+@pytest.mark.parametrize("clust_type", ['ward', 'average', 'complete',
+                                        'kmeans', 'ncut'])
+def test_multi_k_matches_single_k(clust_type):
+    """
+    Test that every level of a multi-k parcellation is identical to the
+    single-k parcellation of that level
+    """
+    mask_data = np.zeros((8, 8, 8), dtype='uint8')
+    mask_data[1:7, 1:7, 1:7] = 1
+    mask_img = nib.Nifti1Image(mask_data, np.eye(4))
+    n_voxels = int(mask_data.sum())
+    ts_data = np.random.RandomState(0).rand(60, n_voxels).astype('float32')
+    rows, cols = clustools.mask_edges(mask_img)
+    local_conn = clustools.edge_correlations(ts_data, rows, cols,
+                                             r_thresh=0)
+
+    k_list = [5, 10, 20]
+    out_imgs = clustools.parcellate_arrays(ts_data, clust_type, k_list,
+                                           mask_img, local_conn=local_conn)
+    for k, out_img in zip(k_list, out_imgs):
+        single_img = clustools.parcellate_arrays(ts_data, clust_type, k,
+                                                 mask_img,
+                                                 local_conn=local_conn)
+        assert np.array_equal(np.asarray(out_img.dataobj),
+                              np.asarray(single_img.dataobj))
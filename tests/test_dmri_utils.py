@@ -7,6 +7,7 @@ Created on Wed Dec 27 16:19:14 2017
 """
 import os
 import numpy as np
+import pytest
 try:
     import cPickle as pickle
 except ImportError:
@@ -82,3 +83,166 @@ def test_evaluate_streamline_plausibility():
 
     assert len(cleaned) > 0
     assert len(cleaned) <= len(streamlines)
+
+
+def test_streamline_label_counts():
+    """
+    Test that bulk fiber-ROI intersection matches per-point get_sphere lookups
+    """
+    from pynets.core import nodemaker
+
+    rng = np.random.RandomState(0)
+    atlas_data = np.kron(rng.randint(0, 12, (6, 6, 6)),
+                         np.ones((5, 5, 5), dtype=int))
+    streamlines = [np.clip(np.cumsum(rng.normal(0, 1.5, (rng.randint(5, 40),
+                                                          3)), 0) +
+                           rng.uniform(3, 27, 3), 0, None).astype(np.float32)
+                   for _ in range(100)]
+
+    for error_margin, roi_zooms in [(2, (1, 1, 1)), (5, (2, 2, 2))]:
+        [sl_ix, labels, counts, lengths] = dmriutils.streamline_label_counts(
+            streamlines, atlas_data, roi_zooms, error_margin, chunk_size=5000)
+        assert np.array_equal(lengths, [len(s) for s in streamlines])
+        for ix, s in enumerate(streamlines):
+            lab_coords = np.vstack([
+                nodemaker.get_sphere(coord, error_margin, roi_zooms,
+                                     atlas_data.shape)
+                for coord in (s + 0.5).astype(np.intp)])
+            lab_arr = atlas_data[tuple(lab_coords.T)]
+            [labs, labs_counts] = np.unique(lab_arr[lab_arr > 0],
+                                            return_counts=True)
+            assert np.array_equal(labels[sl_ix == ix], labs)
+            assert np.array_equal(counts[sl_ix == ix], labs_counts)
+
+
+def test_iter_streamline_batches(tmp_path):
+    """
+    Test that batched streaming of a tractogram matches a full load
+    """
+    import nibabel as nib
+    from dipy.io.stateful_tractogram import StatefulTractogram, Space, Origin
+    from dipy.io.streamline import save_tractogram, load_tractogram
+
+    rng = np.random.RandomState(0)
+    affine = np.array([[-2., 0, 0, 40], [0, 2, 0, -30], [0, 0, 2, -20],
+                       [0, 0, 0, 1]])
+    ref_img = nib.Nifti1Image(np.zeros((20, 20, 20), dtype=np.float32),
+                              affine)
+    streamlines = [rng.uniform(2, 36, (rng.randint(2, 20), 3)).astype(
+        np.float32) for _ in range(53)]
+    streams = str(tmp_path/"streams.trk")
+    save_tractogram(StatefulTractogram(streamlines, ref_img, Space.VOXMM,
+                                       origin=Origin.NIFTI), streams)
+
+    full = load_tractogram(streams, ref_img, to_origin=Origin.NIFTI,
+                           to_space=Space.VOXMM).streamlines
+    batches = list(dmriutils.iter_streamline_batches(streams, ref_img,
+                                                     batch_size=10))
+    assert [len(i) for i in batches] == [10, 10, 10, 10, 10, 3]
+    batched = [s for batch in batches for s in batch]
+    assert len(batched) == len(full)
+    for s, s_ref in zip(batched, full):
+        assert s.dtype == np.float32
+        assert np.allclose(s, s_ref, atol=1e-4)
+
+
+def test_sample_seeds_from_mask():
+    """
+    Test that seeds are jittered within distinct voxels of the mask and are
+    reproducible given a random seed
+    """
+    rng = np.random.RandomState(0)
+    mask = rng.rand(10, 12, 14) > 0.9
+    n_vox = int(mask.sum())
+
+    for seeds_count in [50, n_vox, 3 * n_vox + 7]:
+        seeds = dmriutils.sample_seeds_from_mask(mask, seeds_count,
+                                                 random_seed=1)
+        assert seeds.shape == (seeds_count, 3)
+        vox = np.floor(seeds + 0.5).astype(int)
+        assert np.all(mask[tuple(vox.T)])
+        assert np.all(np.abs(seeds - vox) <= 0.5)
+        counts = np.unique(np.ravel_multi_index(tuple(vox.T), mask.shape),
+                           return_counts=True)[1]
+        assert counts.max() - counts.min() <= 1
+        assert np.array_equal(seeds, dmriutils.sample_seeds_from_mask(
+            mask, seeds_count, random_seed=1))
+
+    assert dmriutils.sample_seeds_from_mask(np.zeros((3, 3, 3), bool),
+                                            10).shape == (0, 3)
+
+
+@pytest.mark.parametrize("roi_tol", [0.5, 2, 6])
+def test_filter_streamlines(roi_tol):
+    """
+    Test that vectorized streamline filtering never admits streamlines
+    rejected by DiPy's target, select_by_rois and near_roi
+    """
+    from dipy.tracking import utils
+    from dipy.tracking.streamline import select_by_rois
+
+    rng = np.random.RandomState(0)
+    shape = (30, 32, 28)
+    brain = np.zeros(shape, dtype=bool)
+    brain[3:-3, 3:-3, 3:-3] = True
+    atlas = np.zeros(shape, dtype='uint16')
+    for label in range(1, 16):
+        x, y, z = rng.randint(5, 24, 3)
+        atlas[x:x + 3, y:y + 3, z:z + 2] = label
+    waymask = np.zeros(shape, dtype=bool)
+    waymask[2:-2, 2:-2, 5:-5] = True
+    streamlines = [np.clip(np.cumsum(rng.normal(0, 1, (rng.randint(1, 40),
+                                                        3)), 0) +
+                           rng.uniform(4, 24, 3), 0, 27)
+                   for _ in range(1000)]
+    waymask_tol = int(round(roi_tol * 0.50, 1))
+
+    keep = dmriutils.filter_streamlines(
+        streamlines, brain, dmriutils.nearest_mask_voxels(atlas > 0),
+        roi_tol, 10, waymask_nearest=dmriutils.nearest_mask_voxels(waymask),
+        waymask_tol=waymask_tol)
+
+    expected = np.array([
+        len(s) >= 10 and len(list(utils.target([s], np.eye(4), brain,
+                                               include=True))) == 1 and
+        len(list(select_by_rois([s], np.eye(4), [atlas > 0], [True],
+                                mode='any', tol=roi_tol))) == 1 and
+        utils.near_roi([s], np.eye(4), waymask, tol=waymask_tol,
+                       mode='all')[0]
+        for s in streamlines])
+    assert not np.any(keep & ~expected)
+    assert np.sum(keep) >= 0.99 * np.sum(expected)
+
+    assert not np.any(dmriutils.filter_streamlines(
+        streamlines, brain, None, roi_tol, 10))
+
+
+def test_streamline_density_map():
+    """
+    Test that the buffer-based negative-index filter and density map match
+    DiPy's per-streamline implementations, including on sliced views
+    """
+    from dipy.tracking import utils
+    from nibabel.streamlines import ArraySequence
+
+    rng = np.random.RandomState(0)
+    streamlines = ArraySequence(
+        [(rng.uniform(0, 20, 3) + np.cumsum(
+            rng.normal(0, 0.5, (rng.randint(2, 60), 3)), 0)).astype(
+            np.float32) for _ in range(500)])
+    streamlines[0][3] = [-0.4999999, 2, 2]
+    streamlines[1][1] = [2, -0.51, 2]
+
+    keep = dmriutils.positive_voxel_streamlines(streamlines)
+    assert keep[0] and not keep[1]
+    for sl, kept in zip(streamlines, keep):
+        assert kept == (not (sl + 0.5).min().round(decimals=6) < 0)
+
+    shape = (40, 40, 40)
+    for streams in [streamlines[keep], streamlines[::3][keep[::3]]]:
+        assert np.array_equal(
+            dmriutils.streamline_density_map(streams, shape),
+            utils.density_map(list(streams), np.eye(4), shape))
+
+    with pytest.raises(IndexError):
+        dmriutils.streamline_density_map(streamlines[~keep], shape)
@@ -29,7 +29,9 @@ from pynets.fmri.estimation import (get_conn_matrix, timeseries_bootstrap,
                                     fill_confound_nans, TimeseriesExtraction)
 from pynets.dmri.estimation import (create_anisopowermap, tens_mod_fa_est,
                                     tens_mod_est, csa_mod_est, csd_mod_est,
-                                    streams2graph, sfm_mod_est)
+                                    streams2graph, streams2edges,
+                                    streams2edges_batch, fit_shm_blocks,
+                                    sfm_mod_est)
 from nilearn._utils import as_ndarray
 from nilearn.tests.test_signal import generate_signals
 from nilearn._utils.extmath import is_spd
@@ -416,6 +418,32 @@ def test_csd_mod_est(dmri_estimation_data):
     B0_mask_file.close()
 
 
+def test_fit_shm_blocks():
+    """
+    Test that fitting voxel blocks in parallel matches a whole-mask fit
+    """
+    from dipy.core.gradients import gradient_table
+    from dipy.data import get_sphere
+    from dipy.reconst.shm import CsaOdfModel
+
+    bvecs = np.vstack([np.zeros((2, 3)),
+                       get_sphere('repulsion724').vertices[:60]])
+    bvals = np.array([0, 0] + [2000] * 60)
+    gtab = gradient_table(bvals, bvecs)
+    rng = np.random.RandomState(0)
+    data = rng.rand(8, 8, 8, 62) + 1
+    mask = np.zeros((8, 8, 8), dtype=bool)
+    mask[1:-1, 2:-1, 1:-2] = True
+
+    model = CsaOdfModel(gtab, sh_order=6)
+    shm_coeff = model.fit(data, mask=mask).shm_coeff
+    shm_coeff_blocks = fit_shm_blocks(model, data, mask, nthreads=2,
+                                      block_size=37)
+    assert shm_coeff_blocks.shape == shm_coeff.shape
+    assert_array_almost_equal(shm_coeff_blocks, shm_coeff)
+    assert not np.any(shm_coeff_blocks[~mask])
+
+
 def test_sfm_mod_est(dmri_estimation_data):
     """Test SFM model estimation."""
 
@@ -516,3 +544,78 @@ def test_streams2graph(fa_wei, dsn):
                                 directget, fa_path, min_length, error_margin)[2]
 
     assert conn_matrix is not None
+
+
+def test_streams2edges():
+    """
+    Test that chunked edge summaries match per-streamline edge enumeration
+    """
+    from itertools import combinations
+    from pynets.dmri.utils import streamline_label_counts
+
+    rng = np.random.RandomState(0)
+    atlas_data = np.kron(rng.permutation(np.arange(0, 64)).reshape(4, 4, 4),
+                         np.ones((5, 5, 5), dtype=int))
+    node_lut = np.arange(64)
+    streamlines = [np.clip(np.cumsum(rng.normal(0, 1.5, (rng.randint(5, 40),
+                                                          3)), 0) +
+                           rng.uniform(3, 17, 3), 0, None).astype(np.float32)
+                   for _ in range(200)]
+    fa_weights = rng.uniform(0, 1, len(streamlines))
+    fa_weights[::7] = np.nan
+
+    [edge_ids, counts, length_sums, fa_sums,
+     fa_counts] = streams2edges(streamlines, atlas_data, node_lut, (1, 1, 1),
+                                2, 2, fa_weights)
+
+    [sl_ix, labels, overlaps, lengths] = streamline_label_counts(
+        streamlines, atlas_data, (1, 1, 1), 2)
+    expected = {}
+    for ix in range(len(streamlines)):
+        endlabels = labels[(sl_ix == ix) & (overlaps >= 2)]
+        for u, v in combinations(node_lut[endlabels] - 1, 2):
+            expected.setdefault(u * 63 + v, []).append(ix)
+
+    assert len(edge_ids) > 0
+    assert list(edge_ids) == sorted(expected)
+    for edge_id, count, length_sum, fa_sum, fa_count in \
+            zip(edge_ids, counts, length_sums, fa_sums, fa_counts):
+        sls = expected[edge_id]
+        assert count == len(sls)
+        assert length_sum == np.sum(lengths[sls])
+        assert fa_count == np.sum(~np.isnan(fa_weights[sls]))
+        assert np.isclose(fa_sum, np.nansum(fa_weights[sls]))
+
+
+def test_streams2edges_batch():
+    """
+    Test that batched edge summaries carry raw FA sums and running FA extrema
+    """
+    from dipy.tracking.streamline import values_from_volume
+
+    rng = np.random.RandomState(0)
+    atlas_data = np.kron(rng.permutation(np.arange(0, 64)).reshape(4, 4, 4),
+                         np.ones((5, 5, 5), dtype=int))
+    node_lut = np.arange(64)
+    fa_data = rng.uniform(0, 1, atlas_data.shape).astype(np.float32)
+    streamlines = [np.clip(np.cumsum(rng.normal(0, 1.5, (rng.randint(5, 40),
+                                                          3)), 0) +
+                           rng.uniform(3, 17, 3), 0, 19).astype(np.float32)
+                   for _ in range(100)]
+
+    [edge_summary, fa_min, fa_max] = streams2edges_batch(
+        streamlines, atlas_data, node_lut, (1, 1, 1), 2, 2, fa_data)
+
+    fa_vals = values_from_volume(fa_data, streamlines, np.eye(4))
+    global_fa = np.concatenate(fa_vals)
+    assert fa_min == np.min(global_fa[global_fa > 0])
+    assert fa_max == np.max(global_fa)
+    expected = streams2edges(streamlines, atlas_data, node_lut, (1, 1, 1), 2,
+                             2, [np.nanmean(i) for i in fa_vals])
+    for out, exp in zip(edge_summary, expected):
+        assert np.allclose(out, exp)
+
+    [edge_summary, fa_min, fa_max] = streams2edges_batch(
+        streamlines, atlas_data, node_lut, (1, 1, 1), 2, 2)
+    assert np.isinf(fa_min) and np.isinf(fa_max)
+    assert np.all(edge_summary[4] == 0)
@@ -406,6 +406,82 @@ def test_parcel_naming():
     assert len(coords) == len(labels)
 
 
+def test_network_membership_table(tmp_path):
+    affine = np.diag([2., 2., 2., 1.])
+    template_img = nib.Nifti1Image(np.ones((10, 10, 10), dtype='float32'),
+                                   affine)
+    rsn_data = np.zeros((10, 10, 10, 3), dtype='uint8')
+    rsn_data[:5, :, :, 0] = 1
+    rsn_data[5:, :5, :, 1] = 1
+    rsn_file = str(tmp_path/"rsn.nii.gz")
+    nib.save(nib.Nifti1Image(rsn_data, affine), rsn_file)
+
+    labels_data = np.zeros((10, 10, 10), dtype='uint16')
+    labels_data[3:7, 2:4, 2:4] = 1
+    labels_data[6:9, 6:9, 6:9] = 4
+    parcel_list = str(tmp_path/"parcels.nii.gz")
+    nib.save(nib.Nifti1Image(labels_data, affine), parcel_list)
+
+    counts, voxel_counts = nodemaker.network_membership_table(
+        parcel_list, template_img, rsn_file)
+    assert list(voxel_counts) == [16, 27]
+    assert counts.tolist() == [[8, 8, 0], [0, 0, 0]]
+    parcels = nodemaker.ParcelMembership.from_img(parcel_list)
+    for k in range(3):
+        assert np.allclose(parcels.overlap(rsn_data[..., k]),
+                           counts[:, k] / voxel_counts)
+
+    # Overlapping networks are counted separately, and in-memory parcels
+    # are not cached
+    rsn_data[6:9, 6:9, 6:9, 2] = 1
+    rsn_data[6:9, 6:9, 6:9, 1] = 1
+    nib.save(nib.Nifti1Image(rsn_data, affine), rsn_file)
+    counts, voxel_counts = nodemaker.network_membership_table(
+        parcels, template_img, rsn_file)
+    assert counts.tolist() == [[8, 8, 0], [0, 27, 27]]
+    assert len(list(tmp_path.glob("parcels_rsnmembership_*.npz"))) == 1
+
+
+def test_parcel_naming_synthetic(tmp_path, monkeypatch):
+    import pkg_resources
+    from pynets.core import utils
+
+    for sub in ["templates", "core/atlases", "core/labelcharts"]:
+        os.makedirs(str(tmp_path/sub))
+    affine = np.diag([2., 2., 2., 1.])
+    nib.save(nib.Nifti1Image(np.ones((10, 10, 10), dtype='float32'), affine),
+             str(tmp_path/"templates/T_brain_2mm.nii.gz"))
+    labels_data = np.zeros((20, 20, 20), dtype='int16')
+    labels_data[:10] = 1
+    labels_data[10:] = 300
+    labels_data[:, :4] = 2
+    nib.save(nib.Nifti1Image(labels_data, np.eye(4)),
+             str(tmp_path/"core/atlases/lab_a.nii.gz"))
+    with open(str(tmp_path/"core/labelcharts/lab_a.txt"), "w") as f:
+        f.write("0 Background\n1 Left\n300 Right\n")
+    nib.save(nib.Nifti1Image(labels_data[::-1].copy(), np.eye(4)),
+             str(tmp_path/"core/atlases/lab_b.nii.gz"))
+    with open(str(tmp_path/"core/labelcharts/lab_b.txt"), "w") as f:
+        f.write("Background\nFirst\nSecond\n")
+
+    monkeypatch.setattr(pkg_resources, "resource_filename",
+                        lambda pkg, path: f"{tmp_path}/{path.lstrip('/')}")
+    monkeypatch.setattr(utils, "load_runconfig", lambda: {
+        "labeling_atlases": ["lab_a", "lab_b"], "template": ["T"],
+        "atlas_library": [str(tmp_path/"library")]})
+
+    coords = [(4, 12, 4), (14, 12, 4), (14, 2, 4), (40, 4, 4)]
+    expected = [{'lab_a': 'Left', 'lab_b': 'Unlabeled'},
+                {'lab_a': 'Right', 'lab_b': 'First'},
+                {'lab_a': 'Unlabeled', 'lab_b': 'Second'},
+                {'lab_a': 'Unlabeled', 'lab_b': 'Unlabeled'}]
+    assert nodemaker.parcel_naming(coords, vox_size='2mm') == expected
+
+    # The resampled labeling atlases are reused from the atlas library
+    os.remove(str(tmp_path/"core/atlases/lab_a.nii.gz"))
+    assert nodemaker.parcel_naming(coords, vox_size='2mm') == expected
+
+
 def test_enforce_hem_distinct_consecutive_labels():
     base_dir = str(Path(__file__).parent/"examples")
     parlistfile = f"{base_dir}/miscellaneous/whole_brain_cluster_labels_" \
@@ -497,3 +573,298 @@ def test_mask_roi():
     roi = f"{base_dir}/miscellaneous/pDMN_3_bin.nii.gz"
     roi_masked = nodemaker.mask_roi(dir_path, roi, mask, func_file)
     assert roi_masked is not None
+
+
+def test_parcel_membership():
+    """
+    Test ParcelMembership against per-parcel image operations
+    """
+    import tempfile
+    from nilearn.image import resample_to_img, concat_imgs
+
+    affine = np.array([[2., 0., 0., -20.], [0., 2., 0., -24.],
+                       [0., 0., 2., -18.], [0., 0., 0., 1.]])
+    labels_data = np.kron(np.random.RandomState(0).randint(1, 30, (5, 6, 6)),
+                          np.ones((4, 4, 3), dtype=int)).astype("uint16")
+    labels_data[:2] = 0
+    labels_img = nib.Nifti1Image(labels_data, affine)
+    par_tmp = tempfile.NamedTemporaryFile(mode='w+', suffix='.nii.gz').name
+    nib.save(labels_img, par_tmp)
+
+    parcels = nodemaker.ParcelMembership.from_img(par_tmp)
+    img_list = list(parcels.iter_imgs())
+    intensities = np.unique(labels_data)[1:]
+    assert len(parcels) == len(img_list) == len(intensities)
+    assert np.array_equal(np.asarray(parcels.to_img().dataobj), labels_data)
+
+    # 4D parcel stacks and lists of images yield the same operator
+    assert (nodemaker.ParcelMembership.from_img(
+        concat_imgs(img_list)).matrix != parcels.matrix).nnz == 0
+    assert (nodemaker.ParcelMembership.from_parcel_list(
+        iter(img_list)).matrix != parcels.matrix).nnz == 0
+
+    # Consecutive relabeling
+    [atlas_img, parcel_list_exp] = nodemaker.create_parcel_atlas(parcels)
+    atlas_data = np.asarray(atlas_img.dataobj)
+    assert np.array_equal(np.unique(atlas_data), parcel_list_exp)
+    assert np.array_equal((np.searchsorted(intensities, labels_data) + 1) *
+                          (labels_data > 0), atlas_data)
+
+    # Overlap with a mask, dropping and centroids
+    mask = np.zeros(labels_data.shape, dtype=bool)
+    mask[10:] = True
+    overlap = parcels.overlap(mask)
+    for i, val in enumerate(intensities):
+        parcel = labels_data == val
+        assert np.isclose(overlap[i], (parcel & mask).sum() / parcel.sum())
+    kept = parcels.drop(np.where(overlap < 0.5)[0])
+    assert len(kept) == (overlap >= 0.5).sum()
+    assert np.array_equal(kept.label_intensities,
+                          intensities[overlap >= 0.5])
+    com = [np.argwhere(labels_data == val).mean(0) for val in intensities]
+    assert np.allclose(parcels.centroids(),
+                       nib.affines.apply_affine(affine, com))
+
+    # Nearest-neighbor resampling matches nilearn parcel by parcel
+    target_img = nib.Nifti1Image(np.zeros((27, 33, 25)), np.array(
+        [[1.5, 0., 0., -21.], [0., 1.5, 0., -25.], [0., 0., 1.5, -19.],
+         [0., 0., 0., 1.]]))
+    parcels_res = parcels.resample_to_img(target_img)
+    for i, parcel in enumerate(img_list):
+        parcel_res = np.asarray(resample_to_img(
+            parcel, target_img, interpolation='nearest').dataobj)
+        assert np.array_equal(np.flatnonzero(parcel_res),
+                              parcels_res.matrix[i].indices)
+
+    # Overlapping voxels are zeroed when collapsing to a label image
+    overlapping = nodemaker.ParcelMembership.from_imgs(
+        [img_list[0], img_list[0], img_list[1]])
+    overlapping_data = np.asarray(overlapping.to_img().dataobj)
+    assert not np.any(overlapping_data == 1) and \
+        not np.any(overlapping_data == 2)
+    assert np.sum(overlapping_data == 3) == \
+        np.sum(labels_data == intensities[1])
+
+
+def test_enforce_hem_distinct_consecutive_labels_synthetic():
+    import tempfile
+    from nilearn.image.resampling import coord_transform
+
+    labels_data = np.zeros((10, 4, 4), dtype="uint16")
+    labels_data[1:4] = 5
+    labels_data[6:9] = 7
+    labels_data[3:7, 0] = 9
+    affine = np.array([[1., 0., 0., -5.], [0., 1., 0., 0.],
+                       [0., 0., 1., 0.], [0., 0., 0., 1.]])
+    uatlas = tempfile.NamedTemporaryFile(mode='w+', suffix='.nii.gz').name
+    nib.save(nib.Nifti1Image(labels_data, affine), uatlas)
+
+    [uatlas, label_names] = \
+        nodemaker.enforce_hem_distinct_consecutive_labels(
+            uatlas, label_names=['a', 'b', 'c'])
+    uatlas_data = np.asarray(nib.load(uatlas).dataobj)
+    # Label names are returned unchanged. Labels are visited in set order
+    # (9, 5, 7), and those with voxels in the left hemisphere are given a
+    # left and a (possibly empty) right parcel
+    assert label_names == ['a', 'b', 'c']
+    assert list(np.unique(uatlas_data)) == [0, 1, 2, 3, 5]
+    assert np.all(uatlas_data[3:5, 0] == 1)
+    assert np.all(uatlas_data[5:7, 0] == 2)
+    assert np.all(uatlas_data[1:3] == 3)
+    assert np.all(uatlas_data[7:9] == 5)
+
+    # Regression against the original per-label implementation
+    def enforce_hem_distinct_consecutive_labels_ref(labels_data, affine):
+        x = coord_transform(0, 0, 0, np.linalg.inv(affine))[0]
+        new_labs = []
+        for lab in set(np.unique(labels_data)) - set([0]):
+            cur_dat = labels_data == lab
+            left_lab = cur_dat.copy()
+            right_lab = cur_dat.copy()
+            left_hemi = labels_data.copy() == lab
+            right_hemi = labels_data.copy() == lab
+            left_hemi[int(x):] = 0
+            right_hemi[:int(x)] = 0
+            if np.any(left_hemi) or not np.any(right_hemi):
+                left_lab[int(x):] = 0
+                right_lab[:int(x)] = 0
+                new_labs.append(left_lab)
+                new_labs.append(right_lab)
+            else:
+                new_labs.append(cur_dat)
+        out = np.zeros(labels_data.shape, dtype="uint16")
+        for i, lab in enumerate(new_labs):
+            out[lab] = i + 1
+        return out
+
+    rng = np.random.RandomState(42)
+    for label_range in [60, 3000]:
+        labels_data = np.zeros((20, 12, 10), dtype="uint16")
+        for lab in rng.choice(np.arange(1, label_range), 40, replace=False):
+            x, y, z = rng.randint(0, 18), rng.randint(0, 10), \
+                rng.randint(0, 8)
+            labels_data[x:x + rng.randint(1, 6), y:y + 2, z:z + 2] = lab
+        nib.save(nib.Nifti1Image(labels_data, affine), uatlas)
+        uatlas = nodemaker.enforce_hem_distinct_consecutive_labels(uatlas)[0]
+        assert np.array_equal(
+            np.asarray(nib.load(uatlas).dataobj),
+            enforce_hem_distinct_consecutive_labels_ref(labels_data, affine))
+
+
+def test_label_inventory(tmp_path, monkeypatch):
+    from scipy import ndimage
+    from pynets.core import utils
+
+    monkeypatch.setattr(utils, "load_runconfig", lambda: {
+        "template": ["T"], "atlas_library": [str(tmp_path/"library")]})
+
+    labels_data = np.zeros((12, 10, 8), dtype="uint16")
+    labels_data[1:4, 2:5, 1:3] = 3
+    labels_data[6:11, 0:2, 4:8] = 8
+    labels_data[5, 9, 7] = 8
+    labels_data[2, 7, 0] = 12
+    affine = np.diag([2., 2., 2., 1.])
+    affine[:3, 3] = [-10, -8, -6]
+    uatlas = str(tmp_path/"atlas.nii.gz")
+    nib.save(nib.Nifti1Image(labels_data, affine), uatlas)
+
+    inventory = nodemaker.label_inventory(uatlas)
+    # Nothing is written next to the atlas
+    assert sorted(os.listdir(str(tmp_path))) == ["atlas.nii.gz", "library"]
+    cache_dir = os.path.dirname(os.path.dirname(nodemaker.atlas_library_dir()))
+    assert len(os.listdir(f"{cache_dir}/label_inventory")) == 1
+    assert list(inventory["labels"]) == [3, 8, 12]
+    assert list(inventory["counts"]) == [18, 41, 1]
+    com = ndimage.center_of_mass(labels_data > 0, labels_data, [3, 8, 12])
+    assert np.allclose(inventory["centroids"],
+                       nib.affines.apply_affine(affine, np.array(com)))
+    objects = ndimage.find_objects(labels_data)
+    for bbox, label in zip(inventory["bboxes"], [3, 8, 12]):
+        assert list(bbox[0]) == [i.start for i in objects[label - 1]]
+        assert list(bbox[1]) == [i.stop - 1 for i in objects[label - 1]]
+
+    # Reused while the image is unchanged, and refreshed otherwise
+    cached = nodemaker.label_inventory(uatlas, labels_data=np.zeros((1, 1, 1)))
+    assert list(cached["labels"]) == [3, 8, 12]
+    labels_data[labels_data == 12] = 0
+    nib.save(nib.Nifti1Image(labels_data, affine), uatlas)
+    assert list(nodemaker.label_inventory(uatlas)["labels"]) == [3, 8]
+
+    # Computed in memory when the cache directory cannot be created
+    inventory = nodemaker.label_inventory(uatlas,
+                                          cache_dir=f"{uatlas}/cache")
+    assert list(inventory["labels"]) == [3, 8]
+
+
+def test_atlas_library(tmp_path, monkeypatch):
+    labels_data = np.zeros((10, 4, 4), dtype="uint16")
+    labels_data[1:4] = 1
+    labels_data[6:9] = 2
+    uatlas = str(tmp_path/"my_atlas.nii.gz")
+    nib.save(nib.Nifti1Image(labels_data, np.eye(4)), uatlas)
+
+    calls = []
+
+    def fetch_nodes_and_labels(atlas, uatlas, ref_txt, parc, out_dir,
+                               use_parcel_naming=False, vox_size="2mm",
+                               clustering=False):
+        calls.append(uatlas)
+        uatlas_out = f"{out_dir}/my_atlas.nii.gz"
+        nib.save(nib.load(uatlas), uatlas_out)
+        return ['a', 'b'], [(2., 1.5, 1.5), (7., 1.5, 1.5)], 'my_atlas', \
+            None, 2, uatlas_out, [1, 2]
+
+    monkeypatch.setattr(nodemaker, "fetch_nodes_and_labels",
+                        fetch_nodes_and_labels)
+    library_dir = str(tmp_path/"library")
+    out_dir = str(tmp_path/"out")
+    os.makedirs(out_dir)
+
+    assert nodemaker.load_atlas_library_entry(
+        None, uatlas, None, True, out_dir, vox_size="2mm",
+        library_dir=library_dir) is None
+
+    entry_dir = nodemaker.build_atlas_library_entry(
+        None, uatlas, None, True, vox_size="2mm", library_dir=library_dir)
+    assert entry_dir.startswith(library_dir)
+    assert nodemaker.build_atlas_library_entry(
+        None, uatlas, None, True, vox_size="2mm",
+        library_dir=library_dir) == entry_dir
+    assert len(calls) == 1
+
+    [labels, coords, atlas, networks_list, par_max, uatlas_out,
+     label_intensities] = nodemaker.load_atlas_library_entry(
+        None, uatlas, None, True, out_dir, vox_size="2mm",
+        library_dir=library_dir)
+    assert labels == ['a', 'b'] and label_intensities == [1, 2]
+    assert coords == [(2., 1.5, 1.5), (7., 1.5, 1.5)]
+    assert atlas == 'my_atlas' and par_max == 2 and networks_list is None
+    assert uatlas_out == f"{out_dir}/my_atlas.nii.gz"
+    assert np.array_equal(np.asarray(nib.load(uatlas_out).dataobj),
+                          labels_data)
+
+    # Entries are specific to the resolution and to the atlas contents
+    assert nodemaker.load_atlas_library_entry(
+        None, uatlas, None, True, out_dir, vox_size="1mm",
+        library_dir=library_dir) is None
+    labels_data[labels_data == 2] = 0
+    nib.save(nib.Nifti1Image(labels_data, np.eye(4)), uatlas)
+    assert nodemaker.load_atlas_library_entry(
+        None, uatlas, None, True, out_dir, vox_size="2mm",
+        library_dir=library_dir) is None
+
+
+@pytest.mark.parametrize("r,vox_dims", [(4, (2, 2, 2)), (5, (2, 2, 2)),
+                                        (3, (1, 1, 1))])
+def test_get_spheres(r, vox_dims):
+    """
+    Test that get_spheres matches get_sphere for each center
+    """
+    dims = (20, 24, 20)
+    coords = np.random.RandomState(0).uniform(-3, 25, (20, 3))
+    [sphere_ix, neighbors] = nodemaker.get_spheres(coords, r, vox_dims, dims)
+    for i, coord in enumerate(coords):
+        inds = nodemaker.get_sphere(coord, r, vox_dims, dims)
+        assert np.array_equal(
+            np.unique(np.ravel_multi_index(tuple(inds.T), dims)),
+            neighbors[sphere_ix == i])
+
+
+def test_create_spherical_roi_volumes_synthetic():
+    import tempfile
+
+    template_mask = tempfile.NamedTemporaryFile(mode='w+',
+                                                suffix='.nii.gz').name
+    nib.save(nib.Nifti1Image(np.ones((20, 24, 20), dtype='uint8'), np.array(
+        [[2., 0., 0., -20.], [0., 2., 0., -24.], [0., 0., 2., -20.],
+         [0., 0., 0., 1.]])), template_mask)
+    coords = [(0, 0, 0), (6, 0, 0), (-10, 10, 4)]
+    [parcel_list, par_max, _, parc] = nodemaker.create_spherical_roi_volumes(
+        4, coords, template_mask)
+
+    assert len(parcel_list) == par_max == 3 and parc is True
+    # Voxels shared by only some of the spheres are kept in each of them
+    counts = parcel_list.voxel_counts()
+    assert counts[0] == counts[1] == counts[2]
+    assert parcel_list.matrix[0].multiply(parcel_list.matrix[1]).nnz > 0
+    assert np.allclose(parcel_list.centroids()[2], coords[2])
+    [in_mask, near_mask] = nodemaker.get_coords_mask_affinity(
+        [(0, 0, 0), (5, 17, 12), (9, 17, 12)],
+        np.asarray(parcel_list.to_img().dataobj) == 3, 4, (2, 2, 2))
+    assert list(in_mask) == [False, True, False]
+    assert list(near_mask) == [False, True, True]
+
+    # Only the intersection of all spheres is removed
+    coords = [(0, 0, 0), (4, 0, 0), (0, 4, 0)]
+    [parcel_list, _, _, _] = nodemaker.create_spherical_roi_volumes(
+        4, coords, template_mask)
+    full = nodemaker.get_spheres(
+        [nodemaker.mmToVox(parcel_list.affine, i) for i in coords], 4,
+        (2, 2, 2), parcel_list.shape)
+    in_all = np.bincount(full[1], minlength=9600) == 3
+    assert np.any(in_all)
+    assert not np.any(parcel_list.matrix.toarray()[:, in_all])
+    for i in range(3):
+        expected = full[1][full[0] == i]
+        expected = expected[~in_all[expected]]
+        assert np.array_equal(parcel_list.matrix[i].indices, expected)
@@ -6,6 +6,7 @@ Created on Monday July 29 16:19:14 2019
 
 """
 import numpy as np
+import pytest
 from pynets.registration import utils
 import os
 import nibabel as nib
@@ -127,6 +128,151 @@ def test_combine_xfms():
     assert test_out is not None
 
 
+def test_transform_registry(tmp_path, monkeypatch):
+    """
+    Test TransformRegistry functionality
+    """
+    calls = []
+
+    def combine_xfms(xfm1, xfm2, xfmout):
+        calls.append((xfm1, xfm2))
+        np.savetxt(xfmout, np.loadtxt(xfm2) @ np.loadtxt(xfm1))
+        return xfmout
+
+    monkeypatch.setattr(utils, "combine_xfms", combine_xfms)
+
+    reg_path = str(tmp_path/"reg")
+    mni2t1_xfm = str(tmp_path/"mni2t1.mat")
+    t1w2dwi_xfm = str(tmp_path/"t1w2dwi.mat")
+    shift = np.eye(4)
+    shift[:3, 3] = [1, 2, 3]
+    np.savetxt(mni2t1_xfm, shift)
+    np.savetxt(t1w2dwi_xfm, 2 * np.eye(4))
+
+    registry = utils.TransformRegistry(reg_path)
+    assert registry.get("mni", "t1w") is None
+    assert registry.register("mni", "t1w", mni2t1_xfm) == mni2t1_xfm
+    with pytest.raises(ValueError):
+        registry.compose("mni", "t1w", "dwi")
+    registry.register("t1w", "dwi", t1w2dwi_xfm)
+
+    # Composed once, then reused by every subsequent lookup
+    mni2dwi_xfm = registry.compose("mni", "t1w", "dwi")
+    assert utils.TransformRegistry(reg_path).compose(
+        "mni", "t1w", "dwi") == mni2dwi_xfm
+    assert calls == [(mni2t1_xfm, t1w2dwi_xfm)]
+    assert registry.get("mni", "dwi") == mni2dwi_xfm
+    assert np.allclose(np.loadtxt(mni2dwi_xfm),
+                       2 * np.eye(4) @ shift)
+
+    # Changing a source transform invalidates the composed one
+    np.savetxt(t1w2dwi_xfm, 3 * np.eye(4))
+    registry.register("t1w", "dwi", t1w2dwi_xfm)
+    registry.compose("mni", "t1w", "dwi")
+    assert len(calls) == 2
+    assert np.allclose(np.loadtxt(mni2dwi_xfm),
+                       3 * np.eye(4) @ shift)
+
+
+def test_resample_fsl_convention(tmp_path):
+    """
+    Test in-process application of FSL affines and displacement fields
+    """
+    from nilearn.image import resample_to_img
+
+    inp_affine = np.diag([2., 2., 2., 1.])
+    inp_affine[:3, 3] = [-20, -30, -10]
+    inp_data = np.random.RandomState(42).rand(20, 24, 18).astype('float32')
+    inp_img = nib.Nifti1Image(inp_data, inp_affine)
+    ref_affine = np.diag([-1.5, 1.5, 1.5, 1.])
+    ref_affine[:3, 3] = [15, -28, -8]
+    ref_img = nib.Nifti1Image(np.zeros((22, 30, 20), dtype='float32'),
+                              ref_affine)
+    inp = str(tmp_path/"inp.nii.gz")
+    ref = str(tmp_path/"ref.nii.gz")
+    nib.save(inp_img, inp)
+    nib.save(ref_img, ref)
+
+    # The FLIRT matrix relating the two images' world coordinates
+    xfm = utils.save_xfm(
+        utils.fsl_scaled_affine(ref_img) @ np.linalg.inv(ref_affine) @
+        inp_affine @ np.linalg.inv(utils.fsl_scaled_affine(inp_img)),
+        str(tmp_path/"inp2ref.mat"))
+    aligned = str(tmp_path/"aligned.nii.gz")
+    utils.applyxfm(ref, inp, xfm, aligned, interp="trilinear")
+    assert np.allclose(nib.load(aligned).get_fdata(),
+                       resample_to_img(inp_img, ref_img,
+                                       interpolation="linear").get_fdata(),
+                       atol=1e-4)
+
+    # Translations are in flipped x for neurological images
+    shift = np.eye(4)
+    shift[0, 3] = 4
+    shifted = str(tmp_path/"shifted.nii.gz")
+    utils.applyxfm(inp, inp, utils.save_xfm(shift, str(tmp_path/"t.mat")),
+                   shifted, interp="nearestneighbour")
+    assert np.array_equal(nib.load(shifted).get_fdata()[:-2], inp_data[2:])
+
+    # A null relative displacement field reduces to its premat
+    warp = str(tmp_path/"warp.nii.gz")
+    nib.save(nib.Nifti1Image(np.zeros((22, 30, 20, 3), dtype='float32'),
+                             ref_affine), warp)
+    warped = str(tmp_path/"warped.nii.gz")
+    utils.apply_warp(ref, inp, warped, warp=warp, xfm=xfm, interp="trilinear")
+    assert np.allclose(nib.load(warped).get_fdata(),
+                       nib.load(aligned).get_fdata())
+
+    combined = str(tmp_path/"combined.mat")
+    utils.combine_xfms(xfm, str(tmp_path/"t.mat"), combined)
+    assert np.allclose(utils.load_xfm(combined),
+                       shift @ utils.load_xfm(xfm))
+    inverted = utils.invert_xfm(combined, str(tmp_path/"inverted.mat"))
+    assert np.allclose(utils.load_xfm(inverted) @ utils.load_xfm(combined),
+                       np.eye(4))
+
+
+def test_resample_labels(tmp_path):
+    """
+    Test batched nearest-neighbour label resampling
+    """
+    rng = np.random.RandomState(42)
+    inp_affine = np.diag([2., 2., 2., 1.])
+    inp_affine[:3, 3] = [-20, -24, -18]
+    ref_affine = np.diag([-2.5, 2.5, 2.5, 1.])
+    ref_affine[:3, 3] = [20, -22, -16]
+    ref = str(tmp_path/"ref.nii.gz")
+    ref_img = nib.Nifti1Image(np.zeros((16, 18, 14), dtype='float32'),
+                              ref_affine)
+    nib.save(ref_img, ref)
+
+    rotation = np.eye(4)
+    rotation[:2, :2] = [[np.cos(0.1), -np.sin(0.1)],
+                        [np.sin(0.1), np.cos(0.1)]]
+    rotation[:3, 3] = [3, -2, 4]
+    xfm = utils.save_xfm(rotation, str(tmp_path/"xfm.mat"))
+
+    labels = [rng.randint(0, 30, (20, 24, 18)).astype('uint16')
+              for i in range(3)]
+    index_map = utils.label_index_map(nib.Nifti1Image(labels[0], inp_affine),
+                                      ref_img, xfm=xfm,
+                                      cache_dir=str(tmp_path/"maps"))
+    assert np.array_equal(
+        index_map, utils.label_index_map(
+            nib.Nifti1Image(labels[0], inp_affine), ref_img, xfm=xfm,
+            cache_dir=str(tmp_path/"maps")))
+    resampled = utils.resample_labels(labels, index_map, ref_img.shape)
+    assert resampled.shape == (3,) + ref_img.shape
+
+    for label, label_resampled in zip(labels, resampled):
+        inp = str(tmp_path/"inp.nii.gz")
+        nib.save(nib.Nifti1Image(label, inp_affine), inp)
+        utils.applyxfm(ref, inp, xfm, str(tmp_path/"aligned.nii.gz"),
+                       interp="nearestneighbour")
+        assert np.array_equal(
+            np.asarray(nib.load(str(tmp_path/"aligned.nii.gz")).dataobj),
+            label_resampled)
+
+
 def test_invwarp():
     base_dir = str(Path(__file__).parent/"examples")
     anat_dir = f"{base_dir}/003/anat"
@@ -422,3 +568,78 @@ def test_wm_syn():
     assert isinstance(mapping, imwarp.DiffeomorphicMap)
     assert isinstance(affine_map, imaffine.AffineMap) and \
            affine_map.affine.shape == (4, 4)
+
+
+def test_wm_syn_cache(tmp_path):
+    from scipy.ndimage import gaussian_filter
+
+    data = gaussian_filter(np.random.RandomState(42).rand(48, 48, 48),
+                           3).astype('float32')
+    affine = np.diag([2., 2., 2., 1.])
+    t1w_brain = str(tmp_path/"t1w_brain.nii.gz")
+    ap_path = str(tmp_path/"ap.nii.gz")
+    nib.save(nib.Nifti1Image(data, affine), t1w_brain)
+    nib.save(nib.Nifti1Image(np.roll(data, 2, axis=0), affine), ap_path)
+
+    [mapping, affine_map, warped_fa] = utils.wm_syn(t1w_brain, ap_path,
+                                                    str(tmp_path),
+                                                    profile="fast")
+    mtime = os.stat(warped_fa).st_mtime_ns
+
+    # Reused, rather than recomputed, for the same inputs and profile
+    [mapping_cached, affine_map_cached,
+     warped_fa_cached] = utils.wm_syn(t1w_brain, ap_path, str(tmp_path),
+                                      profile="fast")
+    assert warped_fa_cached == warped_fa
+    assert os.stat(warped_fa).st_mtime_ns == mtime
+    assert np.allclose(mapping_cached.forward, mapping.forward)
+    assert np.allclose(affine_map_cached.affine, affine_map.affine)
+
+    with pytest.raises(ValueError):
+        utils.wm_syn(t1w_brain, ap_path, str(tmp_path), profile="slow")
+
+
+def test_warp_streamlines():
+    from dipy.tracking import utils as track_utils
+    from dipy.tracking.streamline import (values_from_volume,
+                                          transform_streamlines, Streamlines)
+
+    class Mapping(object):
+        def __init__(self, field):
+            self.field = field
+
+        def get_forward_field(self):
+            return self.field
+
+    rng = np.random.RandomState(42)
+    lengths = rng.randint(1, 40, 500)
+    points = (np.cumsum(rng.normal(0, 0.5, (lengths.sum(), 3)), axis=0) %
+              40 + 5).astype('float32')
+    streamlines = Streamlines(np.split(points, np.cumsum(lengths)[:-1]))
+    mapping = Mapping(rng.normal(0, 0.5, (30, 30, 30, 3)).astype('float32'))
+    ref_grid_aff = np.diag([2., 2., 2., 1.])
+    adjusted_affine = np.eye(4)
+    adjusted_affine[:3, 3] = [-3, 2, 1]
+    warped_fa_img = nib.Nifti1Image(np.zeros((48, 48, 48)),
+                                    np.diag([1., 1., 1., 1.]))
+    brain_mask = np.zeros((48, 48, 48), dtype='uint8')
+    brain_mask[15:30, 15:30, 15:30] = 1
+
+    out = utils.warp_streamlines(adjusted_affine, ref_grid_aff, mapping,
+                                 warped_fa_img, streamlines, brain_mask,
+                                 chunk_size=1000)
+
+    # Per-streamline reference
+    warped = [s + d for s, d in
+              zip(streamlines, values_from_volume(mapping.field,
+                                                  streamlines,
+                                                  ref_grid_aff))]
+    expected = list(track_utils.target_line_based(
+        transform_streamlines(
+            transform_streamlines(warped, np.linalg.inv(adjusted_affine)),
+            np.linalg.inv(warped_fa_img.affine)),
+        np.eye(4), brain_mask, include=True))
+
+    assert len(out) == len(expected) > 0
+    for sl, sl_expected in zip(out, expected):
+        assert np.allclose(sl, sl_expected, atol=1e-4)
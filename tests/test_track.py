@@ -231,3 +231,152 @@ def test_track_ensemble_particle():
                                        space=Space.VOXMM, origin=Origin.NIFTI),
                     streams, bbox_valid_check=False)
     assert isinstance(streamlines, ArraySequence)
+
+
+def test_get_tracking_objects():
+    """
+    Test that tracking workers build direction getters and tissue classifiers
+    once per curvature threshold and ensemble
+    """
+    from pynets.dmri import track
+    from dipy.data import get_sphere
+
+    sphere = get_sphere('repulsion724')
+    rng = np.random.RandomState(0)
+    tracking_data = {
+        "uid": "a",
+        "mod_fit": rng.rand(6, 6, 6, 45).astype('float32'),
+        "tissue_maps": {"mask": np.ones((6, 6, 6), dtype=bool)},
+    }
+
+    [dg, tiss_classifier] = track.get_tracking_objects(
+        tracking_data, 'prob', 30, sphere, 20, 'wm')
+    [dg_30, tiss_classifier_30] = track.get_tracking_objects(
+        tracking_data, 'prob', 30, sphere, 20, 'wm')
+    [dg_40, tiss_classifier_40] = track.get_tracking_objects(
+        tracking_data, 'prob', 40, sphere, 20, 'wm')
+    assert dg_30 is dg
+    assert dg_40 is not dg
+    assert tiss_classifier_30 is tiss_classifier
+    assert tiss_classifier_40 is tiss_classifier
+
+    tracking_data["uid"] = "b"
+    [dg_b, tiss_classifier_b] = track.get_tracking_objects(
+        tracking_data, 'prob', 30, sphere, 20, 'wm')
+    assert dg_b is not dg
+    assert tiss_classifier_b is not tiss_classifier
+
+    with pytest.raises(ValueError):
+        track.get_tracking_objects(tracking_data, 'foo', 30, sphere, 20,
+                                   'wm')
+
+
+def test_allocate_seeds():
+    """
+    Test that seeds are reallocated towards productive ensemble combinations
+    within the balance bounds
+    """
+    from pynets.dmri import track
+
+    n_seeds = track.allocate_seeds(np.zeros(4), np.zeros(4), 500)
+    assert np.array_equal(n_seeds, [500, 500, 500, 500])
+
+    n_accepted = np.array([0, 10, 100, 400])
+    n_seeded = np.array([1000, 1000, 1000, 1000])
+    n_seeds = track.allocate_seeds(n_accepted, n_seeded, 500,
+                                   seed_share_cap=2)
+    assert np.all(np.diff(n_seeds) >= 0)
+    assert abs(np.sum(n_seeds) - 2000) <= len(n_seeds)
+    assert n_seeds.min() >= 250 - 1
+    assert n_seeds.max() <= 1000 + 1
+
+    n_seeds = track.allocate_seeds(n_accepted, n_seeded, 500,
+                                   seed_share_cap=1)
+    assert np.array_equal(n_seeds, [500, 500, 500, 500])
+
+    # Small budgets never starve a combination below the minimal seed count
+    n_seeds = track.allocate_seeds(n_accepted, n_seeded, 150,
+                                   seed_share_cap=2, min_seeds=100)
+    assert n_seeds.min() >= 100
+
+
+def test_run_tracking_seeds_tracked():
+    """
+    Test that tracking workers only report the seeds that they tracked
+    """
+    from pynets.dmri import track
+    from dipy.data import get_sphere
+
+    sphere = get_sphere('repulsion724')
+    rng = np.random.RandomState(0)
+    mask = np.zeros((8, 8, 8), dtype=bool)
+    mask[2:6, 2:6, 2:6] = True
+    tracking_data = {
+        "uid": "seeds_tracked",
+        "mod_fit": rng.rand(8, 8, 8, 45).astype('float32'),
+        "tissue_maps": {"mask": mask},
+        "B0_mask": mask,
+        "seeding_mask": mask,
+        "parcel_nearest": None,
+        "waymask_nearest": None,
+    }
+    args = (tracking_data, 150, 'prob', 2, 20, 2, 1, 15, 2, 0, 'local', 20,
+            sphere, 'wm')
+
+    progress = np.zeros(2, dtype="int64")
+    seeds_tracked = np.zeros(2, dtype="int64")
+    track.run_tracking((0.5, 30), *args, progress=progress, task_ix=1,
+                       n_remaining=10 ** 6, seeds_tracked=seeds_tracked)
+    assert np.array_equal(seeds_tracked, [0, 150])
+
+    # A worker that stops before tracking is not charged any seed
+    seeds_tracked[:] = 0
+    assert track.run_tracking((0.5, 30), *args, progress=progress,
+                              task_ix=0, n_remaining=0,
+                              seeds_tracked=seeds_tracked) is None
+    assert np.array_equal(seeds_tracked, [0, 0])
+
+
+def test_cached_reconstruction(tmp_path, monkeypatch):
+    """
+    Test that reconstructions are fit once per content-addressed key and
+    reused across tracking iterations
+    """
+    from pynets.dmri import track
+    from dipy.core.gradients import gradient_table
+    from dipy.data import get_sphere
+
+    bvecs = np.vstack([np.zeros((2, 3)),
+                       get_sphere('repulsion100').vertices[:30]])
+    bvals = np.array([0, 0] + [1000] * 30)
+    gtab = gradient_table(bvals, bvecs)
+    rng = np.random.RandomState(0)
+    dwi_file = str(tmp_path / 'dwi.nii.gz')
+    nib.save(nib.Nifti1Image(rng.rand(5, 5, 5, 32).astype('float32') + 1,
+                             np.eye(4)), dwi_file)
+    B0_mask = str(tmp_path / 'mask.nii.gz')
+    nib.save(nib.Nifti1Image(np.ones((5, 5, 5), dtype='uint8'),
+                             np.eye(4)), B0_mask)
+    cache_dir = str(tmp_path / 'cache')
+
+    calls = []
+    reconstruction = track.reconstruction
+
+    def counted_reconstruction(*args, **kwargs):
+        calls.append(args[0])
+        return reconstruction(*args, **kwargs)
+
+    monkeypatch.setattr(track, 'reconstruction', counted_reconstruction)
+
+    recon_path = track.cached_reconstruction('ten', gtab, dwi_file, B0_mask,
+                                             cache_dir)
+    assert track.cached_reconstruction('tensor', gtab, dwi_file, B0_mask,
+                                       cache_dir, sh_order=6) == recon_path
+    assert len(calls) == 1
+    with h5py.File(recon_path, 'r') as hf:
+        assert hf['reconstruction'].shape[:3] == (5, 5, 5)
+
+    assert track.reconstruction_key('csd', gtab, dwi_file, B0_mask, 6) != \
+        track.reconstruction_key('csd', gtab, dwi_file, B0_mask, 8)
+    assert track.reconstruction_key('csd', gtab, dwi_file, B0_mask) != \
+        track.reconstruction_key('csa', gtab, dwi_file, B0_mask)
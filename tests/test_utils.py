@@ -524,3 +524,55 @@ def test_build_mp_dict(modality):
         db.add_hp_columns(metaparams)
         db.add_row_from_df(pd.DataFrame([{'AUC': 0.8}], index=[0]),
                            metaparam_dict)
+
+
+def test_memoize(function_cache, tmp_path, monkeypatch):
+    """
+    Test memoize functionality
+    """
+    import shutil
+
+    calls = []
+
+    def scale(mat_file, factor, nthreads=1):
+        calls.append(factor)
+        return np.load(mat_file) * factor
+
+    os.makedirs(tmp_path/"a")
+    os.makedirs(tmp_path/"b")
+    mat = np.random.rand(5, 5)
+    np.save(tmp_path/"a/mat.npy", mat)
+    shutil.copy(tmp_path/"a/mat.npy", tmp_path/"b/mat.npy")
+
+    memoized = utils.memoize(scale, ignore=("nthreads",))
+    assert np.allclose(memoized(str(tmp_path/"a/mat.npy"), 2), mat * 2)
+    assert np.allclose(memoized(str(tmp_path/"a/mat.npy"), 2), mat * 2)
+    # Same content under a different path, irrelevant argument changed
+    assert np.allclose(memoized(str(tmp_path/"b/mat.npy"), 2, nthreads=4),
+                       mat * 2)
+    assert calls == [2]
+
+    # Only the new parameter is computed
+    assert np.allclose(memoized(str(tmp_path/"a/mat.npy"), 3), mat * 3)
+    assert calls == [2, 3]
+
+    # Changed file content invalidates the result
+    np.save(tmp_path/"b/mat.npy", mat + 1)
+    assert np.allclose(memoized(str(tmp_path/"b/mat.npy"), 2), (mat + 1) * 2)
+    assert calls == [2, 3, 2]
+
+    # The source of callees is part of the key
+    memoized = utils.memoize(scale, ignore=("nthreads",), depends=(np.load,))
+    assert np.allclose(memoized(str(tmp_path/"a/mat.npy"), 2), mat * 2)
+    assert calls == [2, 3, 2, 2]
+
+    # Arrays are keyed by content
+    memoized = utils.memoize(np.linalg.inv)
+    assert np.allclose(memoized(mat.copy()), np.linalg.inv(mat))
+    assert len(os.listdir(function_cache)) == 2
+
+    monkeypatch.setattr(utils, "load_runconfig", lambda: {
+        "memoize": [False]})
+    assert utils.memoize(scale) is scale
+    monkeypatch.setattr(utils, "load_runconfig", lambda: {})
+    assert utils.memoize(scale) is scale